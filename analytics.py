@@ -0,0 +1,264 @@
+# analytics.py
+# Instructor analytics over chat turns. Turns are stored one document per
+# turn (no repeated history), and small rollup collections are updated in
+# the same batch, so dashboards read a handful of pre-aggregated rows
+# instead of scanning the raw turns.
+#
+# Collections:
+#   chat_turns          one document per turn
+#   analytics_hourly    turns and unanswered turns per document per hour
+#   analytics_documents all-time totals per document
+#   analytics_questions question clusters per document (online leader clustering)
+
+# --- 1. Imports ---
+import os
+import datetime
+from typing import Dict, List
+
+import numpy as np
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+from pymongo.errors import BulkWriteError
+
+# Questions at least this similar (cosine) to a cluster's centroid join it.
+CLUSTER_SIMILARITY = float(os.getenv("ANALYTICS_CLUSTER_SIMILARITY", "0.8"))
+MAX_CLUSTERS_PER_SOURCE = int(os.getenv("ANALYTICS_MAX_CLUSTERS_PER_SOURCE", "2000"))
+EXAMPLES_PER_CLUSTER = 5
+
+def hour_bucket(timestamp: datetime.datetime) -> str:
+    """Rollup key for the hour a turn happened in; sorts chronologically as a string."""
+    return timestamp.strftime("%Y-%m-%dT%H:00")
+
+# --- 2. The AnalyticsStore Class ---
+class AnalyticsStore:
+    def __init__(self, db):
+        self.turns = db["chat_turns"]
+        self.hourly = db["analytics_hourly"]
+        self.documents = db["analytics_documents"]
+        self.questions = db["analytics_questions"]
+        # Cluster centroids per source, loaded from MongoDB on first use.
+        # Only the logger thread writes turns, so no lock is needed.
+        self._clusters: Dict[str, dict] = {}
+        # Question embeddings that came with the batch being written, by turn id.
+        self._question_vectors: Dict[str, list] = {}
+        self._indexes_ready = False
+
+    def ensure_indexes(self):
+        self.turns.create_index([("document_source", ASCENDING), ("timestamp", ASCENDING)])
+        self.turns.create_index([("session_id", ASCENDING), ("turn_index", ASCENDING)])
+        self.hourly.create_index([("source", ASCENDING), ("hour", ASCENDING)], unique=True)
+        self.questions.create_index([("source", ASCENDING), ("count", DESCENDING)])
+        self._indexes_ready = True
+
+    # --- Writing (runs in the chat logger thread) ---
+    def write_turns(self, records: List[dict]):
+        """
+        A ChatTurnLogger sink. Turns are inserted with a pending flag per
+        rollup, and each rollup folds only the turns of the batch still
+        flagged for it, then clears the flag. A batch replayed after a failed
+        rollup is therefore counted exactly once: already inserted turns are
+        skipped, but their missing rollups are applied.
+        """
+        if not self._indexes_ready:
+            self.ensure_indexes()
+        turns = [self._to_document(record) for record in records]
+        try:
+            self.turns.insert_many(turns, ordered=False)
+        except BulkWriteError as e:
+            if any(error.get("code") != 11000 for error in e.details.get("writeErrors", [])):
+                raise
+        ids = [turn["_id"] for turn in turns]
+        self._question_vectors = {record["_id"]: record["question_vector"] for record in records
+                                  if record.get("question_vector") is not None}
+        try:
+            self._fold(ids, "counted", self._update_counts)
+            self._fold(ids, "clustered", self._update_clusters)
+        finally:
+            self._question_vectors = {}
+
+    def _fold(self, ids: list, flag: str, update):
+        pending = list(self.turns.find({"_id": {"$in": ids}, flag: False}))
+        if not pending:
+            return
+        order = {turn_id: i for i, turn_id in enumerate(ids)}
+        pending.sort(key=lambda turn: order[turn["_id"]])
+        update(pending)
+        self.turns.update_many({"_id": {"$in": [turn["_id"] for turn in pending]}}, {"$set": {flag: True}})
+
+    @staticmethod
+    def _to_document(record: dict) -> dict:
+        turn = {key: value for key, value in record.items() if key not in ("chat_history", "question_vector")}
+        if isinstance(turn.get("timestamp"), str):
+            turn["timestamp"] = datetime.datetime.fromisoformat(turn["timestamp"])
+        turn["unanswered"] = bool(turn.get("unanswered", False))
+        # Cleared by write_turns once the turn is in each rollup.
+        turn["counted"] = turn["clustered"] = False
+        return turn
+
+    def _update_counts(self, turns: List[dict]):
+        hourly: Dict[tuple, List[int]] = {}
+        totals: Dict[str, List[int]] = {}
+        for turn in turns:
+            source = turn["document_source"]
+            unanswered = int(turn["unanswered"])
+            for counts in (hourly.setdefault((source, hour_bucket(turn["timestamp"])), [0, 0]),
+                           totals.setdefault(source, [0, 0])):
+                counts[0] += 1
+                counts[1] += unanswered
+        last_turn = max(turn["timestamp"] for turn in turns)
+        self.hourly.bulk_write([
+            UpdateOne({"source": source, "hour": hour},
+                      {"$inc": {"turns": count, "unanswered": unanswered}}, upsert=True)
+            for (source, hour), (count, unanswered) in hourly.items()
+        ], ordered=False)
+        self.documents.bulk_write([
+            UpdateOne({"_id": source},
+                      {"$inc": {"turns": count, "unanswered": unanswered}, "$max": {"last_turn": last_turn}},
+                      upsert=True)
+            for source, (count, unanswered) in totals.items()
+        ], ordered=False)
+
+    def _load_clusters(self, source: str) -> dict:
+        state = self._clusters.get(source)
+        if state is None:
+            ids, centroids, counts = [], [], []
+            for cluster in self.questions.find({"source": source}, {"centroid": 1, "count": 1}):
+                ids.append(cluster["_id"])
+                centroids.append(cluster["centroid"])
+                counts.append(cluster["count"])
+            state = self._clusters[source] = {
+                "ids": ids, "counts": counts,
+                "centroids": np.asarray(centroids, dtype=np.float32) if ids else None,
+            }
+        return state
+
+    def _update_clusters(self, turns: List[dict]):
+        """
+        Assigns each question to the nearest cluster, or starts a new one
+        (leader clustering). Questions are usually embedded already (the
+        chat request embedded them for retrieval); the rest are encoded as
+        background work, behind any waiting chat queries.
+        """
+        from embeddings import get_embedding_service
+
+        vectors = [self._question_vectors.get(turn["_id"]) for turn in turns]
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            encoded = get_embedding_service().encode([turns[i]["user_message"] for i in missing], background=True)
+            for i, vector in zip(missing, encoded):
+                vectors[i] = vector
+        vectors = np.asarray(vectors, dtype=np.float32)
+        vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        updates: Dict[str, dict] = {}
+        # Changes are made to copies and kept only once MongoDB has them, so a
+        # failed write leaves the in-memory centroids matching the stored ones.
+        working: Dict[str, dict] = {}
+        for turn, vector in zip(turns, vectors):
+            source = turn["document_source"]
+            state = working.get(source)
+            if state is None:
+                stored = self._load_clusters(source)
+                state = working[source] = {
+                    "ids": list(stored["ids"]), "counts": list(stored["counts"]),
+                    "centroids": None if stored["centroids"] is None else stored["centroids"].copy(),
+                }
+            centroids = state["centroids"]
+            best, similarity = None, -1.0
+            if centroids is not None:
+                scores = centroids @ vector
+                best = int(np.argmax(scores))
+                similarity = float(scores[best])
+            if best is None or (similarity < CLUSTER_SIMILARITY and len(state["ids"]) < MAX_CLUSTERS_PER_SOURCE):
+                cluster_id = f"{source}:{turn['_id']}"
+                state["ids"].append(cluster_id)
+                state["counts"].append(1)
+                state["centroids"] = vector[None, :].copy() if centroids is None else np.vstack([centroids, vector])
+                updates[cluster_id] = {"source": source, "question": turn["user_message"],
+                                       "count": 0, "examples": []}
+                best = len(state["ids"]) - 1
+            else:
+                # Running mean, re-normalized so dot products stay cosines.
+                state["counts"][best] += 1
+                centroid = centroids[best] + (vector - centroids[best]) / state["counts"][best]
+                centroids[best] = centroid / max(np.linalg.norm(centroid), 1e-12)
+            cluster_id = state["ids"][best]
+            update = updates.setdefault(cluster_id, {"source": source, "count": 0, "examples": []})
+            update["count"] += 1
+            update["examples"].append(turn["user_message"])
+            update["last_asked"] = turn["timestamp"]
+            update["centroid"] = state["centroids"][best].tolist()
+
+        operations = []
+        for cluster_id, update in updates.items():
+            operation = {
+                "$inc": {"count": update["count"]},
+                "$set": {"centroid": update["centroid"], "last_asked": update["last_asked"]},
+                "$push": {"examples": {"$each": update["examples"], "$slice": -EXAMPLES_PER_CLUSTER}},
+                "$setOnInsert": {"source": update["source"]},
+            }
+            if "question" in update:
+                # The question that started the cluster labels it.
+                operation["$setOnInsert"]["question"] = update["question"]
+            operations.append(UpdateOne({"_id": cluster_id}, operation, upsert=True))
+        self.questions.bulk_write(operations, ordered=False)
+        self._clusters.update(working)
+
+    # --- Reading (dashboard) ---
+    def document_totals(self) -> List[dict]:
+        rows = []
+        for row in self.documents.find().sort("turns", DESCENDING):
+            rows.append({"document_source": row["_id"], "turns": row["turns"], "unanswered": row["unanswered"],
+                         "unanswered_rate": round(row["unanswered"] / row["turns"], 3) if row["turns"] else None,
+                         "last_turn": row["last_turn"].isoformat() if row.get("last_turn") else None})
+        return rows
+
+    def document_report(self, source: str, hours: int = 168, top_n: int = 20) -> dict:
+        since = hour_bucket(datetime.datetime.now() - datetime.timedelta(hours=hours))
+        series = [{"hour": row["hour"], "turns": row["turns"], "unanswered": row["unanswered"]}
+                  for row in self.hourly.find({"source": source, "hour": {"$gte": since}},
+                                              {"_id": 0}).sort("hour", ASCENDING)]
+        turns = sum(row["turns"] for row in series)
+        unanswered = sum(row["unanswered"] for row in series)
+        top_questions = [
+            {"question": row["question"], "count": row["count"], "examples": row.get("examples", []),
+             "last_asked": row["last_asked"].isoformat() if row.get("last_asked") else None}
+            for row in self.questions.find({"source": source}, {"centroid": 0}).sort("count", DESCENDING).limit(top_n)
+        ]
+        return {"document_source": source, "window_hours": hours, "turns": turns, "unanswered": unanswered,
+                "unanswered_rate": round(unanswered / turns, 3) if turns else None,
+                "hourly": series, "top_questions": top_questions}
+
+# --- 3. Backfill ---
+def backfill_from_legacy(db, batch_size: int = 500):
+    """
+    Imports turns logged before analytics existed (the `chat_sessions`
+    collection, one document per turn with a full history copy). Safe to run
+    more than once: already imported turns are skipped.
+    """
+    from bot_logic import NO_CONTEXT_MESSAGE
+
+    store = AnalyticsStore(db)
+    store.ensure_indexes()
+    batch, imported = [], 0
+    for legacy in db["chat_sessions"].find({}, {"chat_history": 0}):
+        batch.append({
+            "_id": str(legacy["_id"]), "session_id": legacy.get("session_id"),
+            "timestamp": legacy["timestamp"], "document_source": legacy.get("document_source", ""),
+            "user_message": legacy.get("user_message", ""), "bot_response": legacy.get("bot_response", ""),
+            "unanswered": legacy.get("bot_response") == NO_CONTEXT_MESSAGE,
+        })
+        if len(batch) >= batch_size:
+            store.write_turns(batch)
+            imported += len(batch)
+            batch = []
+            print(f"  - Imported {imported} turns...")
+    if batch:
+        store.write_turns(batch)
+        imported += len(batch)
+    print(f"--- Backfill complete: {imported} legacy turns processed. ---")
+
+if __name__ == "__main__":
+    from pymongo import MongoClient
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    backfill_from_legacy(MongoClient(os.getenv("MONGODB_URI"))["socratic_tutor_db"])
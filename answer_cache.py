@@ -0,0 +1,117 @@
+# answer_cache.py
+# Reuses a previous Socratic reply when a new question means the same thing
+# as one already answered: similar question embedding, same document, same
+# retrieved chunks and the same conversation depth.
+
+# --- 1. Imports ---
+import os
+import time
+import threading
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.92"))
+ANSWER_CACHE_SIZE_PER_SOURCE = int(os.getenv("ANSWER_CACHE_SIZE_PER_SOURCE", "512"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "3600"))
+# Replies depend on the conversation so far; by default only opening
+# questions (no prior turns) are cached.
+ANSWER_CACHE_MAX_HISTORY_DEPTH = int(os.getenv("ANSWER_CACHE_MAX_HISTORY_DEPTH", "0"))
+
+# --- 2. The SemanticAnswerCache Class ---
+# Compared by identity: entries.remove() must not compare the numpy vectors.
+@dataclass(eq=False)
+class _CachedAnswer:
+    vector: np.ndarray
+    chunk_ids: tuple
+    history_depth: int
+    response: str
+    expires_at: float
+    last_used: float
+
+class SemanticAnswerCache:
+    def __init__(self, similarity: float = ANSWER_CACHE_SIMILARITY,
+                 max_entries_per_source: int = ANSWER_CACHE_SIZE_PER_SOURCE,
+                 ttl_seconds: float = ANSWER_CACHE_TTL,
+                 max_history_depth: int = ANSWER_CACHE_MAX_HISTORY_DEPTH):
+        self.similarity = similarity
+        self.max_entries_per_source = max_entries_per_source
+        self.ttl_seconds = ttl_seconds
+        self.max_history_depth = max_history_depth
+        self._entries: Dict[str, List[_CachedAnswer]] = {}
+        self._matrices: Dict[str, np.ndarray] = {}  # stacked vectors, rebuilt lazily
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.stores = self.evictions = self.invalidations = 0
+
+    @staticmethod
+    def _unit(vector: Sequence[float]) -> np.ndarray:
+        array = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(array)
+        return array / norm if norm else array
+
+    def accepts(self, history_depth: int) -> bool:
+        return history_depth <= self.max_history_depth
+
+    def _expire(self, source: str, now: float):
+        entries = self._entries.get(source, [])
+        live = [entry for entry in entries if entry.expires_at > now]
+        if len(live) != len(entries):
+            self.evictions += len(entries) - len(live)
+            self._entries[source] = live
+            self._matrices.pop(source, None)
+
+    def lookup(self, source: str, query_vector: Sequence[float], chunk_ids: Sequence[str],
+               history_depth: int) -> Optional[str]:
+        """Returns a cached reply for an equivalent question, or None."""
+        if not self.accepts(history_depth):
+            return None
+        now = time.monotonic()
+        with self._lock:
+            self._expire(source, now)
+            entries = self._entries.get(source)
+            if not entries:
+                self.misses += 1
+                return None
+            matrix = self._matrices.get(source)
+            if matrix is None:
+                matrix = self._matrices[source] = np.vstack([entry.vector for entry in entries])
+            similarities = matrix @ self._unit(query_vector)
+            wanted_chunks = tuple(sorted(chunk_ids))
+            for index in np.argsort(-similarities):
+                if similarities[index] < self.similarity:
+                    break
+                entry = entries[index]
+                if entry.chunk_ids == wanted_chunks and entry.history_depth == history_depth:
+                    entry.last_used = now
+                    self.hits += 1
+                    return entry.response
+            self.misses += 1
+            return None
+
+    def store(self, source: str, query_vector: Sequence[float], chunk_ids: Sequence[str],
+              history_depth: int, response: str):
+        if not self.accepts(history_depth):
+            return
+        now = time.monotonic()
+        with self._lock:
+            entries = self._entries.setdefault(source, [])
+            if len(entries) >= self.max_entries_per_source:
+                entries.remove(min(entries, key=lambda entry: entry.last_used))
+                self.evictions += 1
+            entries.append(_CachedAnswer(self._unit(query_vector), tuple(sorted(chunk_ids)), history_depth,
+                                         response, now + self.ttl_seconds, now))
+            self._matrices.pop(source, None)
+            self.stores += 1
+
+    def invalidate_source(self, source: str):
+        with self._lock:
+            self.invalidations += len(self._entries.pop(source, []))
+            self._matrices.pop(source, None)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {"entries": sum(len(entries) for entries in self._entries.values()),
+                "similarity": self.similarity, "hits": self.hits, "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+                "stores": self.stores, "evictions": self.evictions, "invalidations": self.invalidations}
@@ -8,6 +8,8 @@ from werkzeug.utils import secure_filename
 
 # --- Standard Library Imports ---
 import os
+import uuid
+import atexit
 import datetime
 
 # --- Third-party Library Imports ---
@@ -15,8 +17,9 @@ from dotenv import load_dotenv
 
 # --- Local Application Imports ---
 from bot_logic import SocraticTutor
-from ingestion import process_and_store_pdf
-import chromadb
+from ingestion import simple_ingestion
+from chat_logger import ChatTurnLogger, make_text_file_sink
+from catalog import get_catalog
 
 # ==============================================================================
 # 2. INITIAL SETUP AND CONFIGURATION
@@ -44,24 +47,22 @@ if not API_KEY:
 # Initialize the SocraticTutor once when the app starts
 tutor = SocraticTutor(api_key=API_KEY)
 
+# Write-behind logger for chat turns; stopped at exit so queued turns are
+# written (or spooled) rather than lost with the daemon thread.
+chat_logger = ChatTurnLogger(make_text_file_sink("chat_log.txt"), name="chat_log_txt")
+chat_logger.start()
+atexit.register(chat_logger.stop)
+
 # ==============================================================================
 # 4. FLASK ROUTES
 # ==============================================================================
 
 @app.route('/get_documents', methods=['GET'])
 def get_documents():
-    """Lists all unique document sources from the database."""
+    """Lists all documents that are ready to chat about."""
     try:
-        client = chromadb.PersistentClient(path="db")
-        collection = client.get_or_create_collection(name="socratic_collection")
-        
-        # Get all items and extract the 'source' from metadata
-        items = collection.get()
-        if not items or not items['metadatas']:
-            return jsonify([])
-            
-        sources = sorted(list(set(item['source'] for item in items['metadatas'])))
-        return jsonify(sources)
+        # The catalog is kept in step with the vector store by ingestion
+        return jsonify(get_catalog().available_sources())
     except Exception as e:
         print(f"Error getting documents: {e}")
         return jsonify({"error": "Could not retrieve document list"}), 500
@@ -89,15 +90,12 @@ def chat():
 
 
     # --- ADDED: Logging Logic ---
-    # Append the conversation turn to a text file for instructor review
-    try:
-        with open("chat_log.txt", "a", encoding="utf-8") as log_file:
-            timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            log_file.write(f"--- Session Turn at {timestamp} ---\n")
-            log_file.write(f"User: {user_message}\n")
-            log_file.write(f"Bot: {bot_response}\n\n")
-    except Exception as e:
-        print(f"Error writing to log file: {e}")
+    # Queue the conversation turn; the logger appends it to chat_log.txt in
+    # batches for instructor review, off the request path.
+    chat_logger.log({
+        "timestamp": datetime.datetime.now().isoformat(),
+        "user_message": user_message, "bot_response": bot_response,
+    })
     # --- END of Logging Logic ---
 
     return jsonify({"response": bot_response})
@@ -120,11 +118,15 @@ def upload_file():
         if file and file.filename.endswith('.pdf'):
             filename = secure_filename(file.filename)
             filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            file.save(filepath)
+            # Saved under a temporary name first, so a half-written PDF never
+            # replaces the previous version.
+            tmp_path = f"{filepath}.{uuid.uuid4().hex}.tmp"
+            file.save(tmp_path)
+            os.replace(tmp_path, filepath)
 
             # Now, run the ingestion process on the newly uploaded file
             try:
-                process_and_store_pdf(filepath)
+                simple_ingestion(filepath)
                 flash(f"'{filename}' was successfully uploaded and processed!", 'success')
             except Exception as e:
                 flash(f"An error occurred during processing: {e}", 'error')
@@ -0,0 +1,402 @@
+# benchmark.py
+# Offline end-to-end benchmark. Runs without network or external services:
+# Gemini is replaced by a deterministic stub, the in-process vector store
+# stands in for Qdrant and an in-memory stand-in for MongoDB. Measures
+#   1. ingestion throughput (pages/sec, chunks/sec) for the PDFs in a folder,
+#   2. retrieval latency (p50/p95/p99), with and without the query embedding,
+#   3. /chat throughput and latency under N concurrent clients,
+# and writes the results as JSON so runs can be compared between releases.
+#
+# Usage: python benchmark.py [--pdf-folder uploads] [--questions FILE]
+#                            [--clients 8] [--requests-per-client 10] ...
+# The embedding model must already be in the local model cache.
+
+# --- 1. Imports ---
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import hashlib
+import argparse
+import datetime
+import platform
+import subprocess
+import tempfile
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+# --- 2. Stand-ins for External Services ---
+class _StubResponse:
+    def __init__(self, text: str):
+        self.text = text
+
+class _StubStream:
+    def __init__(self, text: str, delay: float):
+        self._words = text.split(" ")
+        self._delay = delay
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for i, word in enumerate(self._words):
+            await asyncio.sleep(self._delay / max(len(self._words), 1))
+            yield _StubResponse(word if i == 0 else " " + word)
+
+class StubModel:
+    """Replaces genai.GenerativeModel: a reply derived from the prompt, after a fixed delay."""
+    latency_seconds = 0.0
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    @staticmethod
+    def _reply(prompt: str) -> str:
+        digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        if "TOPICS:" in prompt:
+            return "TOPICS: Benchmark topic A, Benchmark topic B\nQUESTIONS:\n1. What is A?\n2. What is B?\n3. Why?"
+        return f"That's a great question! Look at the context again: what does it say about item {digest[:6]}?"
+
+    def generate_content(self, prompt: str, **kwargs) -> _StubResponse:
+        time.sleep(self.latency_seconds)
+        return _StubResponse(self._reply(prompt))
+
+    async def generate_content_async(self, prompt: str, stream: bool = False, **kwargs):
+        if stream:
+            return _StubStream(self._reply(prompt), self.latency_seconds)
+        await asyncio.sleep(self.latency_seconds)
+        return _StubResponse(self._reply(prompt))
+
+class _InMemoryCursor(list):
+    def sort(self, *args, **kwargs):
+        return self
+
+    def limit(self, count: int):
+        return _InMemoryCursor(self[:count])
+
+class InMemoryCollection:
+    """The part of the pymongo Collection API the app uses; writes are kept in a list."""
+    def __init__(self):
+        self.documents: List[dict] = []
+        self.bulk_operations = 0
+
+    def insert_one(self, document: dict):
+        self.documents.append(document)
+
+    def insert_many(self, documents: List[dict], ordered: bool = True):
+        self.documents.extend(documents)
+
+    def bulk_write(self, operations: list, ordered: bool = True):
+        self.bulk_operations += len(operations)
+
+    def create_index(self, *args, **kwargs):
+        return "benchmark_index"
+
+    @staticmethod
+    def _matches(document: dict, query: dict) -> bool:
+        for key, value in query.items():
+            if isinstance(value, dict) and "$in" in value:
+                if document.get(key) not in value["$in"]:
+                    return False
+            elif document.get(key) != value:
+                return False
+        return True
+
+    def find(self, query: Optional[dict] = None, projection: Optional[dict] = None) -> _InMemoryCursor:
+        query = query or {}
+        return _InMemoryCursor(document for document in self.documents if self._matches(document, query))
+
+    def update_many(self, query: dict, update: dict):
+        # Only $set: the analytics rollups use it to clear their pending flags.
+        for document in self.documents:
+            if self._matches(document, query):
+                document.update(update.get("$set", {}))
+
+class InMemoryMongoClient:
+    def __init__(self, *args, **kwargs):
+        self._databases = {}
+
+    def __getitem__(self, name: str):
+        return self._databases.setdefault(name, _InMemoryDatabase())
+
+    @property
+    def admin(self):
+        return self["admin"]
+
+    def close(self):
+        pass
+
+class _InMemoryDatabase:
+    def __init__(self):
+        self._collections = {}
+
+    def __getitem__(self, name: str) -> InMemoryCollection:
+        return self._collections.setdefault(name, InMemoryCollection())
+
+    def command(self, name: str):
+        return {"ok": 1}
+
+def install_stand_ins(data_dir: str, llm_latency_ms: float):
+    """Must run before any application module is imported (they read settings at import)."""
+    os.environ["TUTOR_DATA_DIR"] = data_dir
+    os.environ["VECTOR_STORE"] = "local"
+    os.environ.setdefault("GOOGLE_API_KEY", "benchmark")
+    os.environ.setdefault("MONGODB_URI", "mongodb://benchmark")
+    os.environ["PERSIST_SESSIONS"] = "0"
+
+    import pymongo
+    import google.generativeai as genai
+
+    pymongo.MongoClient = InMemoryMongoClient
+    StubModel.latency_seconds = llm_latency_ms / 1000.0
+    genai.GenerativeModel = StubModel
+    genai.configure = lambda *args, **kwargs: None
+    genai.get_model = lambda *args, **kwargs: None
+
+# --- 3. Helpers ---
+def percentiles(samples: List[float]) -> dict:
+    if not samples:
+        return {"count": 0}
+    values = np.asarray(samples) * 1000.0
+    return {"count": len(samples), "mean_ms": round(float(values.mean()), 3),
+            "p50_ms": round(float(np.percentile(values, 50)), 3),
+            "p95_ms": round(float(np.percentile(values, 95)), 3),
+            "p99_ms": round(float(np.percentile(values, 99)), 3),
+            "max_ms": round(float(values.max()), 3)}
+
+def load_questions(path: str) -> List[str]:
+    """Reads questions from a .txt file (one per line) or .jsonl (question/message/title field)."""
+    questions = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if path.endswith(".jsonl"):
+                record = json.loads(line)
+                line = record.get("question") or record.get("message") or record.get("title") or ""
+            if line:
+                questions.append(line)
+    return questions
+
+def generate_questions(sources: List[str], count: int, rng: random.Random) -> List[Tuple[str, str]]:
+    """Questions built from the ingested chunks (and section numbers, where the document has them)."""
+    from chunking import load_section_index
+    from manifests import DocumentManifest
+    from vector_store import get_vector_store
+
+    store = get_vector_store()
+    generated = []
+    per_source = max(count // max(len(sources), 1), 1)
+    for source in sources:
+        manifest = DocumentManifest.load(source)
+        point_ids = list(manifest.chunks) if manifest else []
+        sections = list(load_section_index(source) or {})
+        sample = rng.sample(point_ids, min(per_source, len(point_ids)))
+        for hit in store.get(source, sample):
+            if sections and rng.random() < 0.2:
+                generated.append((source, f"What does Section {rng.choice(sections)} say?"))
+                continue
+            words = hit.payload.get("text", "").split()
+            if len(words) >= 6:
+                start = rng.randrange(0, max(len(words) - 8, 1))
+                generated.append((source, f"What does the text say about {' '.join(words[start:start + 8])}?"))
+    rng.shuffle(generated)
+    return generated[:count]
+
+async def asgi_post(app, path: str, body: dict) -> Tuple[int, bytes]:
+    """Calls an ASGI app in-process, without an HTTP server or client library."""
+    payload = json.dumps(body).encode("utf-8")
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+        "scheme": "http", "path": path, "raw_path": path.encode("ascii"), "query_string": b"", "root_path": "",
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(payload)).encode("ascii"))],
+        "client": ("127.0.0.1", 0), "server": ("benchmark", 80),
+    }
+    messages = [{"type": "http.request", "body": payload, "more_body": False}]
+    status, chunks = 0, []
+
+    async def receive():
+        if messages:
+            return messages.pop(0)
+        await asyncio.Future()  # the client never disconnects
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        elif message["type"] == "http.response.body":
+            chunks.append(message.get("body", b""))
+
+    await app(scope, receive, send)
+    return status, b"".join(chunks)
+
+# --- 4. Benchmarks ---
+def bench_ingestion(pdf_paths: List[str]) -> dict:
+    from ingestion import simple_ingestion
+    from pdf_extraction import get_page_count
+
+    documents, total_pages, total_chunks, total_seconds = [], 0, 0, 0.0
+    for pdf_path in pdf_paths:
+        pages = get_page_count(pdf_path)
+        start = time.perf_counter()
+        result = simple_ingestion(pdf_path, progress=lambda *args: None)
+        seconds = time.perf_counter() - start
+        # A second run of an unchanged document exercises the incremental path.
+        start = time.perf_counter()
+        simple_ingestion(pdf_path, progress=lambda *args: None)
+        reingest_seconds = time.perf_counter() - start
+        documents.append({"source": result["source"], "pages": pages, "chunks": result["chunks"],
+                          "seconds": round(seconds, 3), "reingest_seconds": round(reingest_seconds, 3),
+                          "pages_per_sec": round(pages / seconds, 2), "chunks_per_sec": round(result["chunks"] / seconds, 2)})
+        total_pages += pages
+        total_chunks += result["chunks"]
+        total_seconds += seconds
+    return {"documents": documents, "pages": total_pages, "chunks": total_chunks,
+            "seconds": round(total_seconds, 3),
+            "pages_per_sec": round(total_pages / total_seconds, 2) if total_seconds else None,
+            "chunks_per_sec": round(total_chunks / total_seconds, 2) if total_seconds else None}
+
+def bench_retrieval(tutor, questions: List[Tuple[str, str]], n_results: int) -> dict:
+    from embeddings import get_embedding_service
+
+    service = get_embedding_service()
+    end_to_end, store_only = [], []
+    for source, question in questions:
+        # Cold caches, so every query pays for embedding and search.
+        tutor.retrieval_cache.clear()
+        tutor.query_embedding_cache.clear()
+        start = time.perf_counter()
+        tutor._search(question, source, n_results)
+        end_to_end.append(time.perf_counter() - start)
+
+        vector = service.encode([question])[0].tolist()
+        start = time.perf_counter()
+        tutor.vector_store.search(source, vector, n_results)
+        store_only.append(time.perf_counter() - start)
+    return {"end_to_end": percentiles(end_to_end), "vector_search": percentiles(store_only),
+            "vector_store": tutor.vector_store.backend}
+
+async def bench_chat(app, questions: List[Tuple[str, str]], clients: int, requests_per_client: int,
+                     use_answer_cache: bool) -> dict:
+    latencies, errors = [], 0
+
+    async def client(client_index: int):
+        nonlocal errors
+        session_id = None
+        for i in range(requests_per_client):
+            source, question = questions[(client_index * requests_per_client + i) % len(questions)]
+            body = {"message": question, "document_source": source, "session_id": session_id,
+                    "bypass_cache": not use_answer_cache}
+            start = time.perf_counter()
+            status, response = await asgi_post(app, "/chat", body)
+            latencies.append(time.perf_counter() - start)
+            if status != 200:
+                errors += 1
+                continue
+            session_id = json.loads(response).get("session_id")
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client(i) for i in range(clients)))
+    seconds = time.perf_counter() - start
+    return {"clients": clients, "requests": len(latencies), "errors": errors, "seconds": round(seconds, 3),
+            "requests_per_sec": round(len(latencies) / seconds, 2) if seconds else None,
+            "latency": percentiles(latencies)}
+
+# --- 5. Main ---
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark of ingestion, retrieval and chat.")
+    parser.add_argument("--pdf-folder", default="uploads")
+    parser.add_argument("--questions", help=".txt (one per line) or .jsonl file; generated from the documents if omitted")
+    parser.add_argument("--num-questions", type=int, default=200)
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--requests-per-client", type=int, default=10)
+    parser.add_argument("--llm-latency-ms", type=float, default=0.0, help="simulated Gemini latency per call")
+    parser.add_argument("--use-answer-cache", action="store_true")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="results file (default: benchmark_results/benchmark-<time>.json)")
+    parser.add_argument("--data-dir", help="working data folder (default: a fresh temporary folder)")
+    args = parser.parse_args()
+
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    pdf_paths = sorted(os.path.join(args.pdf_folder, name) for name in os.listdir(args.pdf_folder)
+                       if name.lower().endswith(".pdf"))
+    if not pdf_paths:
+        sys.exit(f"No PDFs found in {args.pdf_folder}")
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix="tutor-benchmark-")
+    install_stand_ins(data_dir, args.llm_latency_ms)
+    rng = random.Random(args.seed)
+
+    import main as web_app
+    from bot_logic import N_RESULTS
+    from embeddings import embedding_stats
+
+    print(f"--- Benchmark: {len(pdf_paths)} PDFs, data in {data_dir} ---")
+    print("Step 1: Ingestion...")
+    ingestion = bench_ingestion(pdf_paths)
+    print(f"  - {ingestion['pages_per_sec']} pages/sec, {ingestion['chunks_per_sec']} chunks/sec")
+
+    sources = [document["source"] for document in ingestion["documents"]]
+    if args.questions:
+        questions = [(sources[i % len(sources)], question)
+                     for i, question in enumerate(load_questions(args.questions))][:args.num_questions]
+    else:
+        questions = generate_questions(sources, args.num_questions, rng)
+    if not questions:
+        sys.exit("No questions to replay.")
+
+    print(f"Step 2: Retrieval ({len(questions)} questions)...")
+    retrieval = bench_retrieval(web_app.tutor, questions, N_RESULTS)
+    print(f"  - p50 {retrieval['end_to_end']['p50_ms']} ms, p99 {retrieval['end_to_end']['p99_ms']} ms")
+
+    print(f"Step 3: /chat with {args.clients} concurrent clients...")
+
+    async def run_chat():
+        await web_app.start_background_services()
+        # Chat answers 503 until the background warm-up has finished.
+        while not web_app.warm_up_state["ready"]:
+            if web_app.warm_up_state["error"]:
+                raise RuntimeError(f"Warm-up failed: {web_app.warm_up_state['error']}")
+            await asyncio.sleep(0.05)
+        try:
+            return await bench_chat(web_app.app, questions, args.clients, args.requests_per_client,
+                                    args.use_answer_cache)
+        finally:
+            await web_app.stop_background_services()
+    chat = asyncio.run(run_chat())
+    print(f"  - {chat['requests_per_sec']} requests/sec, p95 {chat['latency'].get('p95_ms')} ms, "
+          f"{chat['errors']} errors")
+    # Stopping the services flushed the chat logger; every turn must have
+    # been folded into the rollups, or the logging cost above is understated.
+    turns = web_app.analytics_store.turns.documents
+    rolled_up = sum(1 for turn in turns if turn["counted"] and turn["clustered"])
+    chat["logged_turns"] = len(turns)
+    if rolled_up != len(turns):
+        raise RuntimeError(f"Analytics rollups ran for {rolled_up} of {len(turns)} logged turns.")
+
+    results = {
+        "timestamp": datetime.datetime.now().isoformat(), "git_commit": _git_commit(),
+        "environment": {"python": platform.python_version(), "platform": platform.platform(),
+                        "cpu_count": os.cpu_count(), "embedding": embedding_stats()},
+        "config": {**vars(args), "n_results": N_RESULTS, "questions_replayed": len(questions)},
+        "ingestion": ingestion, "retrieval": retrieval, "chat": chat,
+        "caches": web_app.tutor.cache_stats(),
+    }
+    output = args.output or os.path.join(
+        "benchmark_results", f"benchmark-{datetime.datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2, default=str)
+    print(f"--- Results written to {output} ---")
+
+if __name__ == "__main__":
+    main()
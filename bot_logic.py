@@ -1,9 +1,60 @@
 # bot_logic.py
 
 # --- 1. Imports ---
-import google.generativeai as genai
-from sentence_transformers import SentenceTransformer
-from qdrant_client import QdrantClient, models
+import os
+import time
+import asyncio
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from answer_cache import SemanticAnswerCache
+from caching import LRUCache, normalize_query
+from catalog import get_catalog
+from chunking import find_section_references, load_section_index
+from context_packing import pack_context
+from embeddings import get_embedding_service
+from metrics import REGISTRY, TOKEN_BUCKETS, log
+from resources import GEMINI_REQUEST_OPTIONS, get_resources
+from sessions import fit_history
+from sparse_index import load_sparse_index
+from tokens import estimate_tokens
+from vector_store import SearchHit
+
+# Chunks sent to the LLM per chat turn. Hybrid retrieval ranks the right
+# chunks higher than dense search alone, so fewer are needed.
+N_RESULTS = int(os.getenv("N_RESULTS", "4"))
+# Dense + BM25 retrieval fused with reciprocal rank fusion (0 = dense only).
+HYBRID_RETRIEVAL = os.getenv("HYBRID_RETRIEVAL", "1") == "1"
+# Candidates taken from each retriever before fusion.
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "20"))
+RRF_K = 60
+# Chat turns allowed to run concurrently per worker process (async path).
+MAX_CONCURRENT_CHATS = int(os.getenv("MAX_CONCURRENT_CHATS", "16"))
+
+QUERY_EMBEDDING_CACHE_SIZE = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "4096"))
+QUERY_EMBEDDING_CACHE_TTL = float(os.getenv("QUERY_EMBEDDING_CACHE_TTL", "3600"))
+RETRIEVAL_CACHE_SIZE = int(os.getenv("RETRIEVAL_CACHE_SIZE", "4096"))
+RETRIEVAL_CACHE_TTL = float(os.getenv("RETRIEVAL_CACHE_TTL", "600"))
+
+NO_CONTEXT_MESSAGE = "I couldn't find specific information about that in the selected document. Perhaps try rephrasing your question or exploring a different topic?"
+LLM_ERROR_MESSAGE = "I'm sorry, I encountered an error while trying to formulate a response. Please try again."
+
+# Per-stage latency of a chat turn: embed, vector_search, bm25_search,
+# section_lookup, fetch, retrieval (all of the above, cached or not),
+# context_packing, prompt, llm, llm_first_token and turn (the whole turn).
+STAGE_SECONDS = REGISTRY.histogram("tutor_stage_seconds", "Time spent in each stage of a chat turn.", ["stage"])
+CHAT_TURNS = REGISTRY.counter("tutor_chat_turns_total", "Chat turns by how they were answered.", ["outcome"])
+PROMPT_TOKENS = REGISTRY.histogram("tutor_prompt_tokens", "Estimated tokens per prompt sent to the LLM.",
+                                   buckets=TOKEN_BUCKETS)
+RESPONSE_TOKENS = REGISTRY.histogram("tutor_response_tokens", "Estimated tokens per LLM reply.",
+                                     buckets=TOKEN_BUCKETS)
+
+def reciprocal_rank_fusion(rankings: List[List[str]], k: int = RRF_K) -> List[Tuple[str, float]]:
+    """Merges ranked ID lists: each list adds 1 / (k + rank) to an ID's score."""
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, point_id in enumerate(ranking, start=1):
+            scores[point_id] = scores.get(point_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
 
 # --- 2. The SocraticTutor Class ---
 class SocraticTutor:
@@ -12,14 +63,27 @@ class SocraticTutor:
         Initializes the Socratic Tutor, setting up connections to the LLM and vector database.
         """
         # --- LLM Configuration ---
-        genai.configure(api_key=api_key)
-        self.model = genai.GenerativeModel('gemini-pro-latest')
+        # Clients are shared process-wide (see resources.py). Nothing heavy
+        # is loaded here; warm_up() does that, off the startup path.
+        self.resources = get_resources()
+        self.resources.use_api_key(api_key)
         self.collection_name = collection_name
         
         # --- Vector DB and Embedding Model Configuration ---
-        self.embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
-        # Connect to the running Qdrant Docker container
-        self.qdrant_client = QdrantClient(host="localhost", port=6333)
+        # Shared with ingestion, so a warm model also serves uploads.
+        self.embedding_service = get_embedding_service()
+        # Qdrant or the in-process store, depending on VECTOR_STORE
+        self.vector_store = self.resources.vector_store(collection_name)
+        self._chat_semaphore: Optional[asyncio.Semaphore] = None
+
+        # --- Hot-path Caches ---
+        self.query_embedding_cache = LRUCache(QUERY_EMBEDDING_CACHE_SIZE, QUERY_EMBEDDING_CACHE_TTL)
+        self.retrieval_cache = LRUCache(RETRIEVAL_CACHE_SIZE, RETRIEVAL_CACHE_TTL)
+        self.answer_cache = SemanticAnswerCache()
+        self._source_generations: Dict[str, int] = {}
+        self.context_stats = {"requests": 0, "chunks_retrieved": 0, "chunks_used": 0, "passages": 0,
+                              "tokens": 0, "tokens_saved": 0}
+        get_catalog().add_listener(self.invalidate_source)
         
         # --- The Core Socratic Prompt ---
         # This is our final, most effective prompt for beginner-friendly, guided responses.
@@ -54,64 +118,392 @@ class SocraticTutor:
         Your Simple, Friendly, Guiding Question (like the GOOD example):
         """
 
-    def _retrieve_context(self, query: str, document_source: str, n_results: int = 5) -> str:
+    @property
+    def model(self):
+        return self.resources.gemini_model()
+
+    def warm_up(self):
         """
-        Searches Qdrant for the most relevant text chunks for a given query,
-        filtered by a specific document source.
+        Loads what the first chat turn would otherwise wait for: the embedding
+        model (plus one encode), the Gemini SDK and the vector store client.
         """
-        query_embedding = self.embedding_model.encode([query])
-        
-        # Search Qdrant using a filter on the 'source' metadata
-        search_result = self.qdrant_client.search(
-            collection_name=self.collection_name,
-            query_vector=query_embedding[0].tolist(), # Use the vectorized query
-            query_filter=models.Filter(
-                must=[
-                    models.FieldCondition(
-                        key="source",
-                        match=models.MatchValue(value=document_source),
-                    )
-                ]
-            ),
-            limit=n_results
-        )
-        
-        # Combine the text from the retrieved chunks into a single context string
-        context = "\n\n".join([hit.payload["text"] for hit in search_result])
-        return context
+        self.embedding_service.warm_up()
+        self.resources.gemini_model()
+        self.vector_store.ping()
+
+    # --- Query Embedding and Retrieval (cached) ---
+    def _embed_query(self, query: str) -> List[float]:
+        key = normalize_query(query)
+        vector = self.query_embedding_cache.get(key)
+        if vector is None:
+            with STAGE_SECONDS.time(stage="embed"):
+                vector = self.embedding_service.encode([query])[0].tolist()
+            self.query_embedding_cache.put(key, vector)
+        return vector
+
+    async def _aembed_query(self, query: str) -> List[float]:
+        key = normalize_query(query)
+        vector = self.query_embedding_cache.get(key)
+        if vector is None:
+            with STAGE_SECONDS.time(stage="embed"):
+                vector = (await self.embedding_service.aencode([query]))[0].tolist()
+            self.query_embedding_cache.put(key, vector)
+        return vector
+
+    def cached_query_embedding(self, query: str) -> Optional[List[float]]:
+        """The query's embedding if it was computed recently; never encodes."""
+        return self.query_embedding_cache.get(normalize_query(query))
+
+    def _retrieval_key(self, query: str, document_source: str, n_results: int) -> tuple:
+        # The source's generation is part of the key, so a search that was
+        # in flight while the document was re-ingested can never be served.
+        return (document_source, self._source_generations.get(document_source, 0),
+                normalize_query(query), n_results)
+
+    @staticmethod
+    def _hits_to_dicts(search_result: List[SearchHit]) -> List[dict]:
+        return [{"id": hit.id, "score": hit.score, **hit.payload} for hit in search_result]
+
+    def _vector_search(self, document_source: str, vector: List[float], limit: int) -> List[SearchHit]:
+        with STAGE_SECONDS.time(stage="vector_search"):
+            return self.vector_store.search(document_source, vector, limit)
 
-    def generate_response(self, student_question: str, chat_history: list, document_source: str) -> str:
+    async def _avector_search(self, document_source: str, vector: List[float], limit: int) -> List[SearchHit]:
+        with STAGE_SECONDS.time(stage="vector_search"):
+            return await self.vector_store.asearch(document_source, vector, limit)
+
+    def _fetch(self, document_source: str, point_ids: List[str]) -> List[SearchHit]:
+        with STAGE_SECONDS.time(stage="fetch"):
+            return self.vector_store.get(document_source, point_ids)
+
+    @staticmethod
+    def _sparse_search(query: str, document_source: str, limit: int) -> List[Tuple[str, float]]:
+        with STAGE_SECONDS.time(stage="bm25_search"):
+            index = load_sparse_index(document_source)
+            return index.search(query, limit) if index is not None else []
+
+    @staticmethod
+    def _fuse(dense: List[SearchHit], sparse: List[Tuple[str, float]], section_ids: List[str], n_results: int):
         """
-        Generates a complete Socratic response by retrieving context and calling the LLM.
+        Returns the fused top (id, score) pairs and the IDs whose payloads
+        still need fetching. Chunks of a cited section are one more ranking.
         """
-        # 1. Retrieve relevant context from Qdrant
-        context = self._retrieve_context(student_question, document_source)
-        
-        # If no relevant context is found, return a helpful message
-        if not context.strip():
-            return "I couldn't find specific information about that in the selected document. Perhaps try rephrasing your question or exploring a different topic?"
+        rankings = [[hit.id for hit in dense], [point_id for point_id, _ in sparse]]
+        if section_ids:
+            rankings.insert(0, section_ids)
+        fused = reciprocal_rank_fusion([ranking for ranking in rankings if ranking])[:n_results]
+        dense_ids = {hit.id for hit in dense}
+        return fused, [point_id for point_id, _ in fused if point_id not in dense_ids]
+
+    @staticmethod
+    def _fused_hits(fused: List[Tuple[str, float]], payloads: Dict[str, dict],
+                    section_ids: List[str] = ()) -> List[dict]:
+        hits = []
+        for point_id, score in fused:
+            if point_id in payloads:
+                hit = {"id": point_id, "score": score, **payloads[point_id]}
+                if point_id in section_ids:
+                    hit["retrieval"] = "section"
+                hits.append(hit)
+        return hits
+
+    @staticmethod
+    def _section_lookup(query: str, document_source: str, n_results: int) -> List[str]:
+        """Point IDs of the sections a question cites ("Section 183"), from the document's section index."""
+        references = find_section_references(query)
+        if not references:
+            return []
+        with STAGE_SECONDS.time(stage="section_lookup"):
+            sections = load_section_index(document_source)
+        if not sections:
+            return []
+        point_ids = []
+        for label in references:
+            for point_id in sections.get(label, {}).get("point_ids", []):
+                if point_id not in point_ids:
+                    point_ids.append(point_id)
+        return point_ids[:n_results]
+
+    @staticmethod
+    def _cites_section(question: str) -> bool:
+        """
+        Questions citing a section skip the answer cache: "section 183" and
+        "section 184" embed almost alike but need different answers.
+        """
+        return bool(find_section_references(question))
+
+    def _pack_context(self, hits: List[dict]) -> str:
+        """Merges, orders and budgets the retrieved chunks; records the tokens saved."""
+        with STAGE_SECONDS.time(stage="context_packing"):
+            packed = pack_context(hits)
+        stats = self.context_stats
+        stats["requests"] += 1
+        stats["chunks_retrieved"] += len(hits)
+        stats["chunks_used"] += packed.chunks_used
+        stats["passages"] += packed.passages
+        stats["tokens"] += packed.tokens
+        stats["tokens_saved"] += packed.tokens_saved
+        return packed.text
+
+    def _search(self, query: str, document_source: str, n_results: int) -> List[dict]:
+        """
+        Finds the most relevant text chunks for a query within a document:
+        dense (vector) and BM25 results fused by rank, or dense only. The
+        chunks of a section the question cites ("Section 183") join the
+        fusion as a ranking of their own rather than replacing it.
+        """
+        key = self._retrieval_key(query, document_source, n_results)
+        hits = self.retrieval_cache.get(key)
+        if hits is not None:
+            return hits
+        section_ids = self._section_lookup(query, document_source, n_results)
+        vector = self._embed_query(query)
+        if HYBRID_RETRIEVAL or section_ids:
+            dense = self._vector_search(document_source, vector, max(n_results, HYBRID_CANDIDATES))
+            sparse = self._sparse_search(query, document_source, HYBRID_CANDIDATES) if HYBRID_RETRIEVAL else []
+            fused, missing = self._fuse(dense, sparse, section_ids, n_results)
+            payloads = {hit.id: hit.payload for hit in dense}
+            if missing:
+                payloads.update({hit.id: hit.payload for hit in self._fetch(document_source, missing)})
+            hits = self._fused_hits(fused, payloads, section_ids)
+        else:
+            hits = self._hits_to_dicts(self._vector_search(document_source, vector, n_results))
+        self.retrieval_cache.put(key, hits)
+        return hits
+
+    async def _asearch(self, query: str, document_source: str, n_results: int) -> List[dict]:
+        """Async variant of _search; dense and BM25 searches run concurrently."""
+        key = self._retrieval_key(query, document_source, n_results)
+        hits = self.retrieval_cache.get(key)
+        if hits is not None:
+            return hits
 
-        # 2. Format the conversation history for the prompt
+        async def dense_search(limit: int) -> List[SearchHit]:
+            return await self._avector_search(document_source, await self._aembed_query(query), limit)
+
+        async def nothing() -> list:
+            return []
+
+        cites_section = self._cites_section(query)
+        if HYBRID_RETRIEVAL or cites_section:
+            # BM25 and the section index (read from disk) run in threads
+            # while the query is embedded and searched.
+            dense, sparse, section_ids = await asyncio.gather(
+                dense_search(max(n_results, HYBRID_CANDIDATES)),
+                asyncio.to_thread(self._sparse_search, query, document_source, HYBRID_CANDIDATES)
+                if HYBRID_RETRIEVAL else nothing(),
+                asyncio.to_thread(self._section_lookup, query, document_source, n_results)
+                if cites_section else nothing()
+            )
+            fused, missing = self._fuse(dense, sparse, section_ids, n_results)
+            payloads = {hit.id: hit.payload for hit in dense}
+            if missing:
+                fetched = await asyncio.to_thread(self._fetch, document_source, missing)
+                payloads.update({hit.id: hit.payload for hit in fetched})
+            hits = self._fused_hits(fused, payloads, section_ids)
+        else:
+            hits = self._hits_to_dicts(await dense_search(n_results))
+        self.retrieval_cache.put(key, hits)
+        return hits
+
+    def _retrieve_context(self, query: str, document_source: str, n_results: int = N_RESULTS) -> str:
+        # Combine the text from the retrieved chunks into a single context string
+        with STAGE_SECONDS.time(stage="retrieval"):
+            hits = self._search(query, document_source, n_results)
+        return self._pack_context(hits)
+
+    def invalidate_source(self, document_source: str, entry: Optional[dict] = None):
+        """Drops cached retrievals for a document; registered as a catalog listener."""
+        self._source_generations[document_source] = self._source_generations.get(document_source, 0) + 1
+        self.retrieval_cache.invalidate_where(lambda key: key[0] == document_source)
+        self.answer_cache.invalidate_source(document_source)
+
+    def cache_stats(self) -> dict:
+        return {"query_embeddings": self.query_embedding_cache.stats(),
+                "retrieval": self.retrieval_cache.stats(),
+                "answers": self.answer_cache.stats(),
+                "context": dict(self.context_stats)}
+
+    def _build_prompt(self, context: str, student_question: str, chat_history: list,
+                      history_summary: str = "") -> str:
+        start = time.perf_counter()
+        # Format the conversation history for the prompt (within the history token budget)
         history_lines = []
-        for msg in chat_history:
+        if history_summary:
+            history_lines.append(f"(Summary of the earlier conversation: {history_summary})")
+        for msg in fit_history(chat_history, history_summary):
             if 'user' in msg:
                 history_lines.append(f"Student: {msg['user']}")
             if 'bot' in msg:
                 history_lines.append(f"Tutor: {msg['bot']}")
         formatted_history = "\n".join(history_lines)
         
-        # 3. Create the final prompt
         prompt = self.socratic_prompt_template.format(
             context=context,
             chat_history=formatted_history,
             student_question=student_question
         )
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage="prompt")
+        PROMPT_TOKENS.observe(estimate_tokens(prompt))
+        return prompt
+
+    @staticmethod
+    def _record_turn(outcome: str, reply: Optional[str] = None, started: Optional[float] = None):
+        CHAT_TURNS.inc(outcome=outcome)
+        if reply is not None:
+            RESPONSE_TOKENS.observe(estimate_tokens(reply))
+        if started is not None:
+            STAGE_SECONDS.observe(time.perf_counter() - started, stage="turn")
+
+    def generate_response(self, student_question: str, chat_history: list, document_source: str,
+                          use_answer_cache: bool = True) -> str:
+        """
+        Generates a complete Socratic response by retrieving context and calling the LLM.
+        """
+        started = time.perf_counter()
+        # 1. Retrieve relevant context from the vector store
+        with STAGE_SECONDS.time(stage="retrieval"):
+            hits = self._search(student_question, document_source, N_RESULTS)
+        context = self._pack_context(hits)
+        
+        # If no relevant context is found, return a helpful message
+        if not context.strip():
+            self._record_turn("no_context", started=started)
+            return NO_CONTEXT_MESSAGE
+
+        # 2. Reuse the reply to an equivalent earlier question, if there is one
+        # (not for questions citing a section; see _cites_section)
+        cache_args = None
+        if use_answer_cache and not self._cites_section(student_question) and self.answer_cache.accepts(len(chat_history)):
+            cache_args = (document_source, self._embed_query(student_question),
+                          [hit["id"] for hit in hits], len(chat_history))
+            cached = self.answer_cache.lookup(*cache_args)
+            if cached is not None:
+                self._record_turn("answer_cache", started=started)
+                return cached
+
+        # 3. Create the final prompt
+        prompt = self._build_prompt(context, student_question, chat_history)
         
         # 4. Call the LLM to generate the Socratic question
         try:
-            response = self.model.generate_content(prompt)
+            with STAGE_SECONDS.time(stage="llm"):
+                response = self.model.generate_content(prompt, request_options=GEMINI_REQUEST_OPTIONS)
+            if cache_args:
+                self.answer_cache.store(*cache_args, response.text)
+            self._record_turn("llm", response.text, started)
             return response.text
         except Exception as e:
-            print(f"Error during LLM generation: {e}")
-            return "I'm sorry, I encountered an error while trying to formulate a response. Please try again."
+            log(f"Error during LLM generation: {e}")
+            self._record_turn("llm_error", started=started)
+            return LLM_ERROR_MESSAGE
+
+    def _get_chat_semaphore(self) -> asyncio.Semaphore:
+        if self._chat_semaphore is None:
+            self._chat_semaphore = asyncio.Semaphore(MAX_CONCURRENT_CHATS)
+        return self._chat_semaphore
+
+    async def _aprepare(self, student_question: str, chat_history: list, document_source: str,
+                        use_answer_cache: bool):
+        """
+        Retrieves context and checks the answer cache.
+        Returns (context, cached_reply, cache_args).
+        """
+        with STAGE_SECONDS.time(stage="retrieval"):
+            hits = await self._asearch(student_question, document_source, N_RESULTS)
+        context = self._pack_context(hits)
+        # Questions citing a section skip the answer cache (see _cites_section).
+        if (not context.strip() or not use_answer_cache or self._cites_section(student_question)
+                or not self.answer_cache.accepts(len(chat_history))):
+            return context, None, None
+        cache_args = (document_source, await self._aembed_query(student_question),
+                      [hit["id"] for hit in hits], len(chat_history))
+        return context, self.answer_cache.lookup(*cache_args), cache_args
+
+    async def agenerate_response(self, student_question: str, chat_history: list, document_source: str,
+                                 use_answer_cache: bool = True, history_summary: str = "") -> str:
+        """
+        Async variant of generate_response for the web server. At most
+        MAX_CONCURRENT_CHATS turns run at once; the rest wait their turn.
+        """
+        async with self._get_chat_semaphore():
+            started = time.perf_counter()
+            context, cached, cache_args = await self._aprepare(
+                student_question, chat_history, document_source, use_answer_cache)
+            if not context.strip():
+                self._record_turn("no_context", started=started)
+                return NO_CONTEXT_MESSAGE
+            if cached is not None:
+                self._record_turn("answer_cache", started=started)
+                return cached
 
+            prompt = self._build_prompt(context, student_question, chat_history, history_summary)
+            try:
+                with STAGE_SECONDS.time(stage="llm"):
+                    response = await self.model.generate_content_async(prompt, request_options=GEMINI_REQUEST_OPTIONS)
+                if cache_args:
+                    self.answer_cache.store(*cache_args, response.text)
+                self._record_turn("llm", response.text, started)
+                return response.text
+            except Exception as e:
+                log(f"Error during LLM generation: {e}")
+                self._record_turn("llm_error", started=started)
+                return LLM_ERROR_MESSAGE
+
+    async def astream_response(self, student_question: str, chat_history: list, document_source: str,
+                               use_answer_cache: bool = True, history_summary: str = "") -> AsyncIterator[str]:
+        """
+        Streaming variant of agenerate_response: yields pieces of the reply as
+        the LLM produces them, so the first words arrive right after retrieval.
+        """
+        async with self._get_chat_semaphore():
+            started = time.perf_counter()
+            context, cached, cache_args = await self._aprepare(
+                student_question, chat_history, document_source, use_answer_cache)
+            if not context.strip():
+                self._record_turn("no_context", started=started)
+                yield NO_CONTEXT_MESSAGE
+                return
+            if cached is not None:
+                self._record_turn("answer_cache", started=started)
+                yield cached
+                return
+
+            prompt = self._build_prompt(context, student_question, chat_history, history_summary)
+            parts = []
+            llm_started = time.perf_counter()
+            try:
+                response = await self.model.generate_content_async(
+                    prompt, stream=True, request_options=GEMINI_REQUEST_OPTIONS)
+                async for chunk in response:
+                    if chunk.text:
+                        if not parts:
+                            STAGE_SECONDS.observe(time.perf_counter() - llm_started, stage="llm_first_token")
+                        parts.append(chunk.text)
+                        yield chunk.text
+            except Exception as e:
+                log(f"Error during LLM generation: {e}")
+                self._record_turn("llm_error", started=started)
+                # Only replace the reply if nothing was shown yet
+                if not parts:
+                    yield LLM_ERROR_MESSAGE
+                return
+            STAGE_SECONDS.observe(time.perf_counter() - llm_started, stage="llm")
+            self._record_turn("llm", "".join(parts), started)
+            if cache_args and parts:
+                self.answer_cache.store(*cache_args, "".join(parts))
+
+    async def asummarize_history(self, previous_summary: str, turns: list) -> str:
+        """Folds older conversation turns into a short rolling summary (used by the session store)."""
+        lines = [f"Previous summary: {previous_summary}"] if previous_summary else []
+        for msg in turns:
+            if 'user' in msg:
+                lines.append(f"Student: {msg['user']}")
+            if 'bot' in msg:
+                lines.append(f"Tutor: {msg['bot']}")
+        prompt = (
+            "Summarize this tutoring conversation in at most 80 words. Keep the topics, section numbers "
+            "and facts the student has already worked out, and any open question.\n\n" + "\n".join(lines)
+        )
+        response = await self.model.generate_content_async(prompt, request_options=GEMINI_REQUEST_OPTIONS)
+        return response.text.strip()
@@ -0,0 +1,66 @@
+# caching.py
+# Small in-process caches used on the chat hot path.
+
+# --- 1. Imports ---
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+# --- 2. Helpers ---
+def normalize_query(text: str) -> str:
+    """Cache key form of a question: case and whitespace do not change the answer."""
+    return " ".join(text.lower().split())
+
+_MISSING = object()
+
+# --- 3. The LRUCache Class ---
+class LRUCache:
+    """A thread-safe LRU cache with an optional time-to-live and hit/miss counters."""
+    def __init__(self, max_entries: int, ttl_seconds: Optional[float] = None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = self.invalidations = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            item = self._entries.get(key, _MISSING)
+            if item is not _MISSING and (item[0] is None or item[0] > time.monotonic()):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return item[1]
+            if item is not _MISSING:
+                del self._entries[key]
+            self.misses += 1
+            return default
+
+    def put(self, key: Hashable, value: Any):
+        expires_at = time.monotonic() + self.ttl_seconds if self.ttl_seconds else None
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate_where(self, predicate: Callable[[Hashable], bool]) -> int:
+        """Drops every entry whose key matches; returns how many were dropped."""
+        with self._lock:
+            stale = [key for key in self._entries if predicate(key)]
+            for key in stale:
+                del self._entries[key]
+            self.invalidations += len(stale)
+            return len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {"entries": len(self._entries), "max_entries": self.max_entries,
+                "hits": self.hits, "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+                "evictions": self.evictions, "invalidations": self.invalidations}
@@ -0,0 +1,166 @@
+# catalog.py
+# The list of known documents and their ingestion state, kept in memory and
+# mirrored to a small JSON file. Replaces scanning the vector database to
+# find out which documents exist.
+
+# --- 1. Imports ---
+import os
+import json
+import datetime
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+from config import data_dir
+
+STATUS_PROCESSING = "processing"
+STATUS_READY = "ready"
+STATUS_FAILED = "failed"
+
+# --- 2. The DocumentCatalog Class ---
+class DocumentCatalog:
+    """
+    Every change bumps `version`, which doubles as the ETag of the document
+    list so polling clients can be answered with 304 Not Modified.
+    """
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or os.path.join(data_dir(), "catalog.json")
+        self._lock = threading.Lock()
+        self._entries = {}
+        self.version = 0
+        # False until documents already in the vector store (ingested before
+        # the catalog existed) have been added; see seed_from_store().
+        self.seeded = False
+        # Called with (source, entry) when a document's stored content may have changed.
+        self._listeners: List[Callable[[str, dict], None]] = []
+        self._load()
+
+    # --- Persistence ---
+    def _load(self):
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self._entries = {entry["source"]: entry for entry in data["documents"]}
+            self.version = data["version"]
+            self.seeded = data.get("seeded", False)
+            return
+        # First start with a catalog: rebuild it from the ingestion manifests.
+        manifest_folder = data_dir("manifests")
+        for name in os.listdir(manifest_folder):
+            if not name.endswith(".json"):
+                continue
+            with open(os.path.join(manifest_folder, name), "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+            self._entries[manifest["source"]] = {
+                "source": manifest["source"], "status": STATUS_READY, "available": True,
+                "chunk_count": len(manifest["chunks"]), "content_hash": manifest.get("content_hash"),
+                "ingested_at": manifest.get("updated_at"), "error": None,
+            }
+        if self._entries:
+            self.version = 1
+            self._save()
+
+    def _save(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": self.version, "seeded": self.seeded,
+                       "documents": list(self._entries.values())}, f)
+        os.replace(tmp_path, self.path)
+
+    def _update(self, source: str, **fields) -> dict:
+        with self._lock:
+            entry = self._entries.setdefault(source, {
+                "source": source, "status": STATUS_PROCESSING, "available": False,
+                "chunk_count": 0, "content_hash": None, "ingested_at": None, "error": None,
+            })
+            entry.update(fields)
+            self.version += 1
+            self._save()
+            return dict(entry)
+
+    def add_listener(self, callback: Callable[[str, dict], None]):
+        """Registers a callback fired after a document finishes (or fails) ingestion."""
+        with self._lock:
+            self._listeners.append(callback)
+
+    def _notify(self, source: str, entry: dict) -> dict:
+        with self._lock:
+            listeners = list(self._listeners)
+        for callback in listeners:
+            try:
+                callback(source, entry)
+            except Exception as e:
+                print(f"!!! Catalog listener failed for {source}: {e}")
+        return entry
+
+    def seed_from_store(self, source_counts: Dict[str, int]):
+        """
+        Adds documents found in the vector store but missing from the catalog
+        (ingested before it or its manifests existed). Runs once: afterwards
+        ingestion keeps the two in step.
+        """
+        with self._lock:
+            added = 0
+            for source, count in source_counts.items():
+                if source not in self._entries:
+                    self._entries[source] = {
+                        "source": source, "status": STATUS_READY, "available": True,
+                        "chunk_count": count, "content_hash": None, "ingested_at": None, "error": None,
+                    }
+                    added += 1
+            if added:
+                self.version += 1
+            self.seeded = True
+            self._save()
+        if added:
+            print(f"  - Added {added} document(s) from the vector store to the catalog.")
+
+    # --- State Changes (called by ingestion) ---
+    def mark_processing(self, source: str) -> dict:
+        return self._update(source, status=STATUS_PROCESSING, error=None)
+
+    def mark_ready(self, source: str, chunk_count: int, content_hash: str) -> dict:
+        entry = self._update(source, status=STATUS_READY, available=True, chunk_count=chunk_count,
+                             content_hash=content_hash, ingested_at=datetime.datetime.now().isoformat())
+        return self._notify(source, entry)
+
+    def mark_failed(self, source: str, error: str) -> dict:
+        # A failed incremental ingestion may still have changed some points.
+        return self._notify(source, self._update(source, status=STATUS_FAILED, error=error))
+
+    # --- Queries ---
+    @property
+    def etag(self) -> str:
+        return f'"catalog-{self.version}"'
+
+    def get(self, source: str) -> Optional[dict]:
+        with self._lock:
+            entry = self._entries.get(source)
+            return dict(entry) if entry else None
+
+    def available_sources(self) -> List[str]:
+        """Documents that can be chatted with (a previous version may be re-ingesting)."""
+        return self.available_sources_with_etag()[1]
+
+    def entries(self) -> List[dict]:
+        return self.entries_with_etag()[1]
+
+    # Read under the same lock as the list, so a response never pairs an
+    # older list with a newer ETag (which would turn stale data into 304s).
+    def available_sources_with_etag(self) -> Tuple[str, List[str]]:
+        with self._lock:
+            return self.etag, sorted(source for source, entry in self._entries.items() if entry["available"])
+
+    def entries_with_etag(self) -> Tuple[str, List[dict]]:
+        with self._lock:
+            return self.etag, [dict(self._entries[source]) for source in sorted(self._entries)]
+
+# --- 3. Shared Instance ---
+_catalog: Optional[DocumentCatalog] = None
+_catalog_lock = threading.Lock()
+
+def get_catalog() -> DocumentCatalog:
+    global _catalog
+    with _catalog_lock:
+        if _catalog is None:
+            _catalog = DocumentCatalog()
+        return _catalog
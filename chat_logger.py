@@ -0,0 +1,203 @@
+# chat_logger.py
+# Write-behind logging of chat turns. Requests only put a record on a
+# bounded in-memory queue; a background thread writes records to the
+# backend in bulk. While the backend is unreachable, batches are spooled to
+# local JSONL segments and replayed once it is back.
+
+# --- 1. Imports ---
+import os
+import json
+import time
+import queue
+import datetime
+import threading
+from typing import Callable, List, Optional
+
+from config import data_dir
+from metrics import REGISTRY
+
+LOG_QUEUE_SIZE = int(os.getenv("CHAT_LOG_QUEUE_SIZE", "10000"))
+LOG_BATCH_SIZE = int(os.getenv("CHAT_LOG_BATCH_SIZE", "100"))
+LOG_FLUSH_INTERVAL = float(os.getenv("CHAT_LOG_FLUSH_INTERVAL", "2.0"))
+# How long to wait before trying a failed backend again.
+LOG_RETRY_INTERVAL = float(os.getenv("CHAT_LOG_RETRY_INTERVAL", "30"))
+SPOOL_SEGMENT_RECORDS = 5000
+
+FLUSH_SECONDS = REGISTRY.histogram("chat_log_flush_seconds", "Time to write one batch of chat turns to the backend.",
+                                   ["logger", "result"])
+
+# A sink writes a batch of records or raises.
+Sink = Callable[[List[dict]], None]
+
+# --- 2. Sinks ---
+def make_mongo_sink(collection) -> Sink:
+    """Bulk-inserts into a MongoDB collection. Replays are idempotent because records carry their own _id."""
+    from pymongo.errors import BulkWriteError
+
+    def write(records: List[dict]):
+        try:
+            collection.insert_many(records, ordered=False)
+        except BulkWriteError as e:
+            # Duplicate keys just mean a replayed record was already stored.
+            if any(error.get("code") != 11000 for error in e.details.get("writeErrors", [])):
+                raise
+    return write
+
+def make_text_file_sink(path: str) -> Sink:
+    """Appends turns to a plain-text log in the format of the original chat_log.txt."""
+    def write(records: List[dict]):
+        with open(path, "a", encoding="utf-8") as log_file:
+            for record in records:
+                timestamp = datetime.datetime.fromisoformat(record["timestamp"]).strftime("%Y-%m-%d %H:%M:%S")
+                log_file.write(f"--- Session Turn at {timestamp} ---\n")
+                log_file.write(f"User: {record['user_message']}\n")
+                log_file.write(f"Bot: {record['bot_response']}\n\n")
+    return write
+
+# --- 3. The ChatTurnLogger Class ---
+class ChatTurnLogger:
+    def __init__(self, sink: Sink, name: str = "chat_turns", max_queue: int = LOG_QUEUE_SIZE,
+                 batch_size: int = LOG_BATCH_SIZE, flush_interval: float = LOG_FLUSH_INTERVAL,
+                 retry_interval: float = LOG_RETRY_INTERVAL):
+        self.sink = sink
+        self.name = name
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retry_interval = retry_interval
+        self.spool_folder = data_dir("spool", name)
+        self._queue: "queue.Queue[dict]" = queue.Queue(maxsize=max_queue)
+        self._spool_lock = threading.Lock()
+        self._segment_file = None
+        self._segment_records = 0
+        self._backend_down_until = 0.0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.counters = {"enqueued": 0, "written": 0, "flushes": 0, "failed_flushes": 0,
+                         "spooled": 0, "replayed": 0, "overflowed": 0}
+        self.last_flush_ms: Optional[float] = None
+        # A segment still open when the process died is complete up to its
+        # last fsync; close it so it gets replayed.
+        for name in os.listdir(self.spool_folder):
+            if name.endswith(".jsonl.open"):
+                path = os.path.join(self.spool_folder, name)
+                os.replace(path, path[:-len(".open")])
+
+    # --- Public API ---
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="chat-logger", daemon=True)
+            self._thread.start()
+
+    def log(self, record: dict):
+        """Queues a record without blocking. If the queue is full it goes straight to the spool."""
+        try:
+            self._queue.put_nowait(record)
+            self.counters["enqueued"] += 1
+        except queue.Full:
+            self.counters["overflowed"] += 1
+            self._spool([record])
+
+    def stop(self, timeout: float = 10.0):
+        """Flushes what is queued (or spools it) and stops the writer thread."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        with self._spool_lock:
+            self._close_segment()
+
+    def stats(self) -> dict:
+        return {**self.counters, "queue_depth": self._queue.qsize(), "queue_capacity": self._queue.maxsize,
+                "spool_segments": len(self._segments()), "backend_up": self._backend_up(),
+                "last_flush_ms": self.last_flush_ms}
+
+    # --- Writer Thread ---
+    def _run(self):
+        while not self._stop.is_set() or not self._queue.empty():
+            batch = self._take_batch()
+            if batch:
+                self._flush(batch)
+            elif self._backend_up():
+                self._replay_one_segment()
+
+    def _take_batch(self) -> List[dict]:
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or (self._stop.is_set() and self._queue.empty()):
+                break
+            try:
+                batch.append(self._queue.get(timeout=min(remaining, 0.5)))
+            except queue.Empty:
+                continue
+        return batch
+
+    def _backend_up(self) -> bool:
+        return time.monotonic() >= self._backend_down_until
+
+    def _flush(self, batch: List[dict]):
+        if not self._backend_up():
+            self._spool(batch)
+            return
+        start = time.perf_counter()
+        try:
+            # The sink may add fields (e.g. pymongo's _id), so hand it copies.
+            self.sink([dict(record) for record in batch])
+        except Exception as e:
+            print(f"!!! Chat log backend unavailable, spooling {len(batch)} records: {e}")
+            FLUSH_SECONDS.observe(time.perf_counter() - start, logger=self.name, result="failed")
+            self.counters["failed_flushes"] += 1
+            self._backend_down_until = time.monotonic() + self.retry_interval
+            self._spool(batch)
+            return
+        elapsed = time.perf_counter() - start
+        FLUSH_SECONDS.observe(elapsed, logger=self.name, result="ok")
+        self.last_flush_ms = round(elapsed * 1000, 2)
+        self.counters["flushes"] += 1
+        self.counters["written"] += len(batch)
+
+    # --- Spool ---
+    def _segments(self) -> List[str]:
+        return sorted(name for name in os.listdir(self.spool_folder) if name.endswith(".jsonl"))
+
+    def _close_segment(self):
+        if self._segment_file is not None:
+            self._segment_file.close()
+            os.replace(self._segment_file.name, self._segment_file.name[:-len(".open")])
+            self._segment_file, self._segment_records = None, 0
+
+    def _spool(self, records: List[dict]):
+        with self._spool_lock:
+            if self._segment_file is None:
+                name = f"segment-{time.time_ns()}.jsonl.open"
+                self._segment_file = open(os.path.join(self.spool_folder, name), "a", encoding="utf-8")
+            for record in records:
+                self._segment_file.write(json.dumps(record, default=str) + "\n")
+            self._segment_file.flush()
+            os.fsync(self._segment_file.fileno())
+            self._segment_records += len(records)
+            self.counters["spooled"] += len(records)
+            if self._segment_records >= SPOOL_SEGMENT_RECORDS:
+                self._close_segment()
+
+    def _replay_one_segment(self):
+        with self._spool_lock:
+            # Close the active segment so it can be replayed too.
+            self._close_segment()
+        segments = self._segments()
+        if not segments:
+            return
+        path = os.path.join(self.spool_folder, segments[0])
+        with open(path, "r", encoding="utf-8") as f:
+            records = [json.loads(line) for line in f if line.strip()]
+        try:
+            for start in range(0, len(records), self.batch_size):
+                self.sink(records[start:start + self.batch_size])
+        except Exception as e:
+            print(f"!!! Chat log replay failed, will retry later: {e}")
+            self._backend_down_until = time.monotonic() + self.retry_interval
+            return
+        os.remove(path)
+        self.counters["replayed"] += len(records)
+        print(f"Replayed {len(records)} spooled chat turns.")
@@ -0,0 +1,304 @@
+# chunking.py
+# Structure-aware chunking for statutes and similar documents. Chunks never
+# cross a section heading (unless the section is tiny, e.g. a table of
+# contents line), and every chunk carries the chapter, section and page it
+# belongs to. Ingestion also stores a section-number index per document,
+# so the chunks of a section cited in a question ("Section 183") are found
+# by a dictionary lookup. Numbered lines only count as sections in
+# documents that look like statutes; elsewhere "1. Introduction" is just a
+# list item.
+
+# --- 1. Imports ---
+import os
+import re
+import json
+import bisect
+import urllib.parse
+from typing import Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+from caching import LRUCache
+from config import data_dir
+from pdf_extraction import PageOffsetMap, PageText
+
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 150
+# How much page text is buffered before it is split into chunks.
+SPLIT_WINDOW_CHARS = 20000
+# A heading closer than this to the previous one does not start a new chunk.
+MIN_SEGMENT_CHARS = 250
+# Chunks returned for one section by the lookup index.
+MAX_CHUNKS_PER_SECTION = 8
+# Numbered headings are treated as sections once this many statute markers
+# (CHAPTER or SCHEDULE headings, or headings written "Section 12.") are seen.
+STATUTE_MIN_MARKERS = 3
+
+class Chunk(NamedTuple):
+    index: int
+    text: str
+    char_start: int
+    page_number: Optional[int]
+    section: Optional[str] = None        # e.g. "183" or "2A"
+    section_title: Optional[str] = None
+    chapter: Optional[str] = None        # e.g. "CHAPTER XIII" or "THE SECOND SCHEDULE"
+
+# --- 2. Heading Detection ---
+_CHAPTER_RE = re.compile(r"^[ \t]*(CHAPTER[ \t]+(?:[IVXLCDM]+|\d+)[A-Z]?)\b", re.M)
+_SCHEDULE_RE = re.compile(
+    r"^[ \t]*((?:THE[ \t]+)?(?:(?:FIRST|SECOND|THIRD|FOURTH|FIFTH|SIXTH|SEVENTH|EIGHTH|NINTH|TENTH)[ \t]+)?SCHEDULE)\b", re.M)
+# "183. Driving at excessive speed, etc.—(1) Whoever ..." or "Section 183. ..."
+_SECTION_RE = re.compile(r"^[ \t]*(Section[ \t]+)?(\d{1,4}[A-Z]{0,3})\.[ \t]+([A-Z][^\n]{2,200})", re.M)
+# A section cited in a question: "section 183", "sec. 66A", "s. 2".
+_REFERENCE_RE = re.compile(r"\b(?:section|sec\.?|s\.)\s*(\d{1,4}[a-z]{0,3})\b", re.I)
+
+class Heading(NamedTuple):
+    position: int  # absolute character offset
+    kind: str      # "chapter" or "section"
+    label: str
+    title: Optional[str] = None
+
+def _section_title(text: str) -> str:
+    # The title runs up to the dash (or full stop) that starts the body.
+    return re.split(r"\s*[—–]|\.\s", text, maxsplit=1)[0].strip(" .-")[:120]
+
+class DocumentStructure:
+    """
+    Headings found while streaming a document, and the chapter/section in
+    effect at a given offset. Passed to iter_chunks; afterwards `headings`
+    holds every heading in order (used to build the section index).
+    Section headings are only kept once `is_statute` is set (see
+    STATUTE_MIN_MARKERS); chapter headings always are. Sections seen
+    before that are held back and added when it is.
+    """
+    def __init__(self):
+        self.headings: List[Heading] = []
+        self._positions: List[int] = []  # heading positions, for bisect
+        self._pending_sections: List[Heading] = []
+        self.statute_markers = 0
+        self._markers_until = -1
+        self.is_statute = False
+        self._applied = 0
+        self.chapter: Optional[str] = None
+        self.section: Optional[str] = None
+        self.section_title: Optional[str] = None
+
+    def scan(self, text: str, base_offset: int):
+        """Registers headings in text (starting at base_offset) that are past the ones already known."""
+        known_until = self.headings[-1].position if self.headings else -1
+        found = []
+        for match in _CHAPTER_RE.finditer(text):
+            found.append(Heading(base_offset + match.start(), "chapter", " ".join(match.group(1).split())))
+        for match in _SCHEDULE_RE.finditer(text):
+            found.append(Heading(base_offset + match.start(), "chapter", " ".join(match.group(1).split())))
+        sections = [(match, Heading(base_offset + match.start(), "section", match.group(2),
+                                    _section_title(match.group(3))))
+                    for match in _SECTION_RE.finditer(text)]
+        new = [heading for heading in found if heading.position > known_until]
+        # Text is rescanned as the buffer carries over, so each marker is
+        # counted at its position once.
+        markers = [heading.position for heading in found] + [
+            heading.position for match, heading in sections if match.group(1)]
+        self.statute_markers += sum(1 for position in markers if position > self._markers_until)
+        self._markers_until = max(markers + [self._markers_until])
+        self.is_statute = self.is_statute or self.statute_markers >= STATUTE_MIN_MARKERS
+        if not self.is_statute:
+            pending_until = self._pending_sections[-1].position if self._pending_sections else -1
+            self._pending_sections += [heading for _, heading in sections if heading.position > pending_until]
+            self._add(new)
+            return
+        new += [heading for _, heading in sections if heading.position > known_until]
+        if self._pending_sections:
+            # The markers came after these sections (e.g. the first CHAPTER
+            # heading is pages in); they may sit before headings already known.
+            seen = {heading.position for heading in new}
+            new += [heading for heading in self._pending_sections if heading.position not in seen]
+            self._pending_sections = []
+        self._add(new)
+
+    def _add(self, new: List[Heading]):
+        if not new:
+            return
+        new.sort()
+        if not self.headings or new[0].position > self._positions[-1]:
+            self.headings.extend(new)
+            self._positions.extend(heading.position for heading in new)
+            return
+        # Headings inserted before ones already applied: replay, so the
+        # chapter/section in effect accounts for them.
+        applied_until = self.headings[self._applied - 1].position if self._applied else -1
+        self.headings = sorted(self.headings + new)
+        self._positions = [heading.position for heading in self.headings]
+        applied = bisect.bisect_right(self._positions, applied_until)
+        self._applied = 0
+        self.chapter = self.section = self.section_title = None
+        while self._applied < applied:
+            self._apply_next()
+
+    def positions_between(self, start: int, end: int) -> List[int]:
+        return self._positions[bisect.bisect_right(self._positions, start):bisect.bisect_left(self._positions, end)]
+
+    def _apply_next(self):
+        heading = self.headings[self._applied]
+        if heading.kind == "chapter":
+            self.chapter, self.section, self.section_title = heading.label, None, None
+        else:
+            self.section, self.section_title = heading.label, heading.title
+        self._applied += 1
+
+    def advance_to(self, offset: int, lookahead: int = 0):
+        """
+        Applies every heading at or before offset. If a chapter heading sits
+        right at offset, a section heading within `lookahead` characters
+        after it is applied too (a chapter usually opens with its first section).
+        """
+        while self._applied < len(self.headings) and self.headings[self._applied].position <= offset:
+            self._apply_next()
+        if (lookahead and self._applied and self._applied < len(self.headings)
+                and self.headings[self._applied - 1].kind == "chapter"
+                and self.headings[self._applied - 1].position == offset
+                and self.headings[self._applied].kind == "section"
+                and self.headings[self._applied].position <= offset + lookahead):
+            self._apply_next()
+
+# --- 3. Chunking ---
+def iter_chunks(pages: Iterable[PageText], offset_map: PageOffsetMap,
+                chunk_size: int = CHUNK_SIZE, chunk_overlap: int = CHUNK_OVERLAP,
+                window_chars: int = SPLIT_WINDOW_CHARS,
+                structure: Optional[DocumentStructure] = None) -> Iterator[Chunk]:
+    """
+    Splits streamed pages into chunks without holding the whole document.
+    Text is buffered up to window_chars and cut at section headings; each
+    segment is split on its own, so chunks stay inside one section. The last
+    (possibly incomplete) segment is carried over to the following pages.
+    """
+    # Imported here: langchain is slow to import and only ingestion splits text.
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    structure = structure if structure is not None else DocumentStructure()
+    buffer, buffer_start, index = "", 0, 0
+
+    def split_segment(start: int, end: int) -> List[Tuple[str, int]]:
+        """Splits buffer[start:end]; returns (piece, absolute offset) pairs."""
+        text = buffer[start:end]
+        pieces, cursor = [], 0
+        for piece in text_splitter.split_text(text):
+            position = text.find(piece, cursor)
+            if position < 0:
+                position = cursor
+            pieces.append((piece, buffer_start + start + position))
+            cursor = position + 1
+        return pieces
+
+    def segment_bounds() -> List[int]:
+        bounds = [0]
+        for position in structure.positions_between(buffer_start, buffer_start + len(buffer)):
+            if position - buffer_start - bounds[-1] >= MIN_SEGMENT_CHARS:
+                bounds.append(position - buffer_start)
+        return bounds
+
+    def make_chunk(i: int, piece: str, char_start: int) -> Chunk:
+        structure.advance_to(char_start, MIN_SEGMENT_CHARS)
+        return Chunk(i, piece, char_start, offset_map.page_for_offset(char_start),
+                     structure.section, structure.section_title, structure.chapter)
+
+    for page in pages:
+        buffer += page.text
+        if len(buffer) < window_chars:
+            continue
+        structure.scan(buffer, buffer_start)
+        bounds = segment_bounds()
+        # Every segment but the last is complete.
+        for start, end in zip(bounds, bounds[1:]):
+            for piece, char_start in split_segment(start, end):
+                yield make_chunk(index, piece, char_start)
+                index += 1
+        carry = bounds[-1]
+        pieces = split_segment(carry, len(buffer))
+        if len(pieces) >= 2:
+            for piece, char_start in pieces[:-1]:
+                yield make_chunk(index, piece, char_start)
+                index += 1
+            carry = pieces[-1][1] - buffer_start
+        buffer_start += carry
+        buffer = buffer[carry:]
+
+    if buffer.strip():
+        structure.scan(buffer, buffer_start)
+        bounds = segment_bounds() + [len(buffer)]
+        for start, end in zip(bounds, bounds[1:]):
+            for piece, char_start in split_segment(start, end):
+                yield make_chunk(index, piece, char_start)
+                index += 1
+
+# --- 4. Section Index ---
+def _index_path(source: str) -> str:
+    return os.path.join(data_dir("sections"), urllib.parse.quote(source, safe="") + ".json")
+
+class SectionIndexBuilder:
+    """Collects chunk positions during ingestion; save() maps each section number to its chunks."""
+    def __init__(self):
+        self.starts: List[int] = []
+        self.ends: List[int] = []
+        self.point_ids: List[str] = []
+        self.pages: List[Optional[int]] = []
+
+    def add(self, point_id: str, chunk: Chunk):
+        self.starts.append(chunk.char_start)
+        self.ends.append(chunk.char_start + len(chunk.text))
+        self.point_ids.append(point_id)
+        self.pages.append(chunk.page_number)
+
+    def save(self, source: str, structure: DocumentStructure):
+        document_end = max(self.ends, default=0)
+        headings = structure.headings
+        sections = {}
+        for i, heading in enumerate(headings):
+            if heading.kind != "section":
+                continue
+            end = headings[i + 1].position if i + 1 < len(headings) else document_end
+            # A number can appear more than once (table of contents, schedules);
+            # the longest occurrence is the section itself.
+            if heading.label in sections and sections[heading.label]["length"] >= end - heading.position:
+                continue
+            first = max(bisect.bisect_right(self.starts, heading.position) - 1, 0)
+            chunk_ids = [j for j in range(first, len(self.starts))
+                         if self.starts[j] < end and self.ends[j] > heading.position][:MAX_CHUNKS_PER_SECTION]
+            if not chunk_ids:
+                continue
+            sections[heading.label] = {
+                "title": heading.title, "length": end - heading.position,
+                "page": self.pages[chunk_ids[0]], "point_ids": [self.point_ids[j] for j in chunk_ids],
+            }
+        path = _index_path(source)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"source": source, "statute": structure.is_statute, "sections": sections}, f)
+        os.replace(tmp_path, path)
+        print(f"  - Section index: {len(sections)} sections.")
+
+_loaded = LRUCache(64)
+
+def load_section_index(source: str) -> Optional[dict]:
+    """Returns {section number: {"title", "page", "point_ids", ...}}, or None if the document has none."""
+    path = _index_path(source)
+    if not os.path.exists(path):
+        return None
+    # Keyed by modification time, so a re-ingested document is reloaded.
+    key = (source, os.path.getmtime(path))
+    sections = _loaded.get(key)
+    if sections is None:
+        with open(path, "r", encoding="utf-8") as f:
+            index = json.load(f)
+        # Indexes written before statute detection have no flag and are kept.
+        sections = index["sections"] if index.get("statute", True) else {}
+        _loaded.invalidate_where(lambda cached_key: cached_key[0] == source)
+        _loaded.put(key, sections)
+    return sections
+
+def find_section_references(question: str) -> List[str]:
+    """Section numbers cited in a question, in order ("section 66a" -> "66A")."""
+    references = []
+    for match in _REFERENCE_RE.finditer(question):
+        label = match.group(1).upper()
+        if label not in references:
+            references.append(label)
+    return references
@@ -0,0 +1,19 @@
+# config.py
+# Settings shared by the ingestion pipeline and the web app.
+
+# --- 1. Imports ---
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# --- 2. Local Storage ---
+# Root folder for everything the app persists next to the vector store
+# (ingestion manifests, caches, catalogs). Safe to delete; it is rebuilt.
+DATA_DIR = os.getenv("TUTOR_DATA_DIR", "tutor_data")
+
+def data_dir(*parts: str) -> str:
+    """Returns (and creates) a folder under DATA_DIR."""
+    path = os.path.join(DATA_DIR, *parts)
+    os.makedirs(path, exist_ok=True)
+    return path
@@ -0,0 +1,112 @@
+# context_packing.py
+# Turns retrieved chunks into the CONTEXT part of the prompt. Chunks overlap
+# (CHUNK_OVERLAP) and arrive in relevance order, so joining them as-is
+# repeats text and scrambles the reading order. Here overlapping and
+# touching chunks are merged into passages, passages are put in document
+# order, and the whole context is kept within a token budget.
+
+# --- 1. Imports ---
+import os
+from typing import List, NamedTuple, Optional
+
+from tokens import CHARS_PER_TOKEN, estimate_tokens
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1000"))
+PASSAGE_SEPARATOR = "\n\n"
+# Chunks this close are one passage; the splitter trims the whitespace between them.
+MERGE_GAP_CHARS = 3
+
+class PackedContext(NamedTuple):
+    text: str
+    chunks_used: int
+    passages: int
+    tokens: int
+    naive_tokens: int  # tokens if the hits had simply been joined
+
+    @property
+    def tokens_saved(self) -> int:
+        return max(self.naive_tokens - self.tokens, 0)
+
+class _Passage:
+    def __init__(self, hit: dict, text: str):
+        self.start: Optional[int] = hit.get("char_start")
+        self.text = text
+        self.hit = hit  # first chunk; its section and page label the passage
+
+    @property
+    def end(self) -> Optional[int]:
+        return None if self.start is None else self.start + len(self.text)
+
+    def absorb(self, other: "_Passage") -> bool:
+        """Appends a passage that overlaps or touches this one; False if they are apart."""
+        if self.start is None or other.start is None or other.start > self.end + MERGE_GAP_CHARS:
+            return False
+        if other.start > self.end:
+            self.text += " " * (other.start - self.end) + other.text
+            return True
+        overlap = self.end - other.start
+        if overlap >= len(other.text):
+            return True  # already contained
+        # Only merge if the texts really agree on the overlapping span.
+        if overlap and self.text[-overlap:] != other.text[:overlap]:
+            return False
+        self.text += other.text[overlap:]
+        return True
+
+def _label(hit: dict) -> str:
+    parts = []
+    if hit.get("section"):
+        title = f": {hit['section_title']}" if hit.get("section_title") else ""
+        parts.append(f"Section {hit['section']}{title}")
+    if hit.get("page"):
+        parts.append(f"page {hit['page']}")
+    return f"[{', '.join(parts)}]\n" if parts else ""
+
+def _new_chars(span: tuple, taken: List[tuple]) -> int:
+    """Characters of span not already covered by the taken spans."""
+    start, end = span
+    covered, cursor = 0, start
+    for taken_start, taken_end in sorted(taken):
+        # cursor skips parts already counted, since taken spans may overlap each other
+        overlap_start, overlap_end = max(cursor, taken_start), min(end, taken_end)
+        if overlap_end > overlap_start:
+            covered += overlap_end - overlap_start
+            cursor = overlap_end
+    return end - start - covered
+
+def pack_context(hits: List[dict], token_budget: int = CONTEXT_TOKEN_BUDGET) -> PackedContext:
+    """
+    Builds the context from hits given best first. Chunks are admitted in
+    relevance order while their new (non-overlapping) text fits the budget,
+    then merged and ordered by position in the document.
+    """
+    naive_tokens = estimate_tokens(PASSAGE_SEPARATOR.join(hit["text"] for hit in hits))
+    budget_chars = token_budget * CHARS_PER_TOKEN
+    chosen, spans, used = [], [], 0
+    for hit in hits:
+        text = hit["text"]
+        start = hit.get("char_start")
+        span = (start, start + len(text)) if start is not None else None
+        new_chars = _new_chars(span, spans) if span else len(text)
+        if used + new_chars > budget_chars:
+            if chosen:
+                continue  # a shorter, less relevant chunk may still fit
+            # Always send something: the best chunk, cut to the budget.
+            text = text[:budget_chars]
+            span = (start, start + len(text)) if start is not None else None
+            new_chars = len(text)
+        chosen.append(_Passage(hit, text))
+        if span:
+            spans.append(span)
+        used += new_chars
+
+    # Document order; chunks without a position keep their relevance order at the end.
+    positioned = sorted((passage for passage in chosen if passage.start is not None), key=lambda p: p.start)
+    passages: List[_Passage] = []
+    for passage in positioned:
+        if not passages or not passages[-1].absorb(passage):
+            passages.append(passage)
+    passages += [passage for passage in chosen if passage.start is None]
+
+    text = PASSAGE_SEPARATOR.join(_label(passage.hit) + passage.text for passage in passages)
+    return PackedContext(text, len(chosen), len(passages), estimate_tokens(text), naive_tokens)
@@ -1,19 +1,28 @@
 # debug_extraction.py
-from ingestion import extract_text_from_pdf
+from pdf_extraction import PageOffsetMap, iter_pdf_pages
 
 # --- IMPORTANT: Change this to the exact name of your PDF file ---
 PDF_FILENAME = "Motor_Vehicles_Act_1988_with_Amendments_2019.pdf"
 # -------------------------------------------------------------
 
-filepath = f"uploads/{PDF_FILENAME}"
+def main():
+    filepath = f"uploads/{PDF_FILENAME}"
 
-print(f"--- EXTRACTING TEXT FROM {filepath} ---")
-raw_text = extract_text_from_pdf(filepath)
-print("--- EXTRACTION COMPLETE ---")
+    print(f"--- EXTRACTING TEXT FROM {filepath} ---")
+    offset_map = PageOffsetMap()
+    # Save the extracted text page by page so you can inspect it (and see which
+    # page each passage came from) without holding the whole document in memory.
+    with open("extracted_text.txt", "w", encoding="utf-8") as f:
+        for page in iter_pdf_pages(filepath, offset_map):
+            f.write(f"\n===== PAGE {page.page_number} (char offset {page.char_start}) =====\n")
+            f.write(page.text)
+    print("--- EXTRACTION COMPLETE ---")
+    print(f"Extracted {len(offset_map.page_numbers)} pages, {offset_map.total_chars} characters.")
 
-# Save the extracted text to a file so you can inspect it
-with open("extracted_text.txt", "w", encoding="utf-8") as f:
-    f.write(raw_text)
+    print("\nSuccessfully extracted text and saved it to 'extracted_text.txt'.")
+    print("Open that file and search it to see how the computer sees your PDF.")
 
-print("\nSuccessfully extracted text and saved it to 'extracted_text.txt'.")
-print("Open that file and search it to see how the computer sees your PDF.")
\ No newline at end of file
+# Large PDFs are extracted by a pool of spawned processes, which re-import
+# this script; the guard keeps them from running it again.
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,6 @@
 # debug_retrieval.py
-import chromadb
-from sentence_transformers import SentenceTransformer
+from embeddings import get_embedding_service
+from vector_store import get_vector_store
 
 # --- CONFIGURATION ---
 # The question we are testing
@@ -19,36 +19,32 @@ print(f"Inside document: '{DOCUMENT_SOURCE}'\n")
 
 try:
     # 1. Initialize models and database connection
-    embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
-    client = chromadb.PersistentClient(path="db")
-    collection = client.get_or_create_collection(name="socratic_collection")
+    embedding_service = get_embedding_service()
+    store = get_vector_store("socratic_collection")
+    print(f"Using the '{store.backend}' vector store.\n")
 
     # 2. Embed the user's question
     print("Step 1: Creating embedding for the user's question...")
-    query_embedding = embedding_model.encode([USER_QUESTION])
+    query_embedding = embedding_service.encode([USER_QUESTION])[0]
     print("Embedding created successfully.\n")
 
     # 3. Query the database with the metadata filter
     print(f"Step 2: Querying the database for the top {NUM_RESULTS} most relevant chunks...")
-    results = collection.query(
-        query_embeddings=query_embedding,
-        n_results=NUM_RESULTS,
-        where={"source": DOCUMENT_SOURCE}
-    )
+    results = store.search(DOCUMENT_SOURCE, query_embedding.tolist(), NUM_RESULTS)
     print("Query complete.\n")
 
     # 4. Analyze and print the results
-    if not results or not results['documents'] or not results['documents'][0]:
+    if not results:
         print("---!!! CRITICAL FAILURE !!!---")
         print("The query returned ZERO results. This means either:")
         print("  a) The database is empty or does not contain this document source.")
         print("  b) There was a fundamental error during ingestion.")
-        print("\nACTION: Delete your 'db' folder and run 'python ingestion.py' again carefully.")
+        print("\nACTION: Re-ingest the document with 'python ingestion.py' and check the VECTOR_STORE setting.")
     else:
         print("--- RETRIEVAL RESULTS ---")
-        for i, doc in enumerate(results['documents'][0]):
-            print(f"\n--- Result {i+1} ---")
-            print(doc)
+        for i, hit in enumerate(results):
+            print(f"\n--- Result {i+1} (score {hit.score:.3f}, page {hit.payload.get('page')}) ---")
+            print(hit.payload.get("text", ""))
             print("-" * 20)
 
 except Exception as e:
@@ -0,0 +1,187 @@
+# embedding_cache.py
+# A persistent, size-bounded cache of chunk embeddings. Vectors live in a
+# memory-mapped array on disk; a small JSON index maps a hash of
+# (backend, model name, normalized text) to a row of that array. The
+# backend is part of the key because the int8 ONNX export gives slightly
+# different vectors than the PyTorch model.
+
+# --- 1. Imports ---
+import os
+import re
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+from config import data_dir
+from embeddings import EMBEDDING_BACKEND, EmbeddingService, get_embedding_service
+
+CACHE_MAX_MB = int(os.getenv("EMBEDDING_CACHE_MAX_MB", "256"))
+CACHE_DTYPE = os.getenv("EMBEDDING_CACHE_DTYPE", "float16")  # or float32
+# The index is rewritten after this many new entries (and on flush()).
+INDEX_FLUSH_EVERY = 1024
+
+# --- 2. Helpers ---
+def normalize_text(text: str) -> str:
+    return re.sub(r"\s+", " ", text).strip()
+
+def cache_key(model_name: str, text: str, backend: str = EMBEDDING_BACKEND) -> str:
+    return hashlib.sha256(f"{backend}\0{model_name}\0{normalize_text(text)}".encode("utf-8")).hexdigest()[:32]
+
+# --- 3. The EmbeddingCache Class ---
+class EmbeddingCache:
+    """
+    LRU cache of embeddings for one model and backend. Rows of the memory-mapped array are
+    reused once the configured size is reached, evicting the least recently
+    used entries. The backing file is only created on the first write.
+    """
+    def __init__(self, model_name: str, backend: str = EMBEDDING_BACKEND,
+                 max_bytes: int = CACHE_MAX_MB * 1024 * 1024, dtype: str = CACHE_DTYPE):
+        self.model_name = model_name
+        self.backend = backend
+        self.max_bytes = max_bytes
+        self.dtype = np.dtype(dtype)
+        self.folder = data_dir("embedding_cache", re.sub(r"[^A-Za-z0-9_.-]", "_", f"{model_name}-{backend}"))
+        self.vectors_path = os.path.join(self.folder, "vectors.bin")
+        self.index_path = os.path.join(self.folder, "index.json")
+        # The key stored next to each row guards against an index that is
+        # older than the vectors (e.g. after a crash between flushes).
+        self.row_keys_path = os.path.join(self.folder, "row_keys.bin")
+        self._lock = threading.Lock()
+        self._slots: "OrderedDict[str, int]" = OrderedDict()  # key -> row, oldest first
+        self._free_rows: List[int] = []
+        self._vectors: Optional[np.memmap] = None
+        self._row_keys: Optional[np.memmap] = None
+        self.dimension: Optional[int] = None
+        self.capacity = 0
+        self._dirty = 0
+        self.hits = self.misses = self.evictions = 0
+        self._load()
+
+    def _open(self, dimension: int, mode: str):
+        self.dimension = dimension
+        self.capacity = max(1, self.max_bytes // (dimension * self.dtype.itemsize))
+        self._vectors = np.memmap(self.vectors_path, dtype=self.dtype, mode=mode,
+                                  shape=(self.capacity, dimension))
+        # Raw bytes: an "S16" array would strip trailing NUL bytes from keys.
+        self._row_keys = np.memmap(self.row_keys_path, dtype=np.uint8, mode=mode, shape=(self.capacity, 16))
+
+    def _load(self):
+        if not all(os.path.exists(path) for path in (self.index_path, self.vectors_path, self.row_keys_path)):
+            return
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                index = json.load(f)
+            if index["dtype"] != self.dtype.name or index["max_bytes"] != self.max_bytes:
+                print(f"  - Embedding cache settings changed for '{self.model_name}'; starting empty.")
+                return
+            self._open(index["dimension"], "r+")
+            self._slots = OrderedDict((key, row) for key, row in index["entries"])
+            used = set(self._slots.values())
+            self._free_rows = [row for row in range(self.capacity - 1, -1, -1) if row not in used]
+        except Exception as e:
+            print(f"!!! Could not load embedding cache, starting empty: {e}")
+            self._slots, self._vectors, self._row_keys, self.dimension = OrderedDict(), None, None, None
+
+    def _write_index(self):
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"model_name": self.model_name, "backend": self.backend, "dimension": self.dimension,
+                       "dtype": self.dtype.name, "max_bytes": self.max_bytes,
+                       "entries": list(self._slots.items())}, f)
+        os.replace(tmp_path, self.index_path)
+        self._dirty = 0
+
+    def get_many(self, texts: Sequence[str]) -> List[Optional[np.ndarray]]:
+        """Returns a float32 vector for each cached text, None for misses."""
+        results: List[Optional[np.ndarray]] = []
+        with self._lock:
+            for text in texts:
+                key = cache_key(self.model_name, text, self.backend)
+                row = self._slots.get(key) if self._vectors is not None else None
+                if row is not None and self._row_keys[row].tobytes() != bytes.fromhex(key):
+                    del self._slots[key]
+                    self._free_rows.append(row)
+                    row = None
+                if row is None:
+                    self.misses += 1
+                    results.append(None)
+                    continue
+                self._slots.move_to_end(key)
+                self.hits += 1
+                results.append(np.array(self._vectors[row], dtype=np.float32))
+        return results
+
+    def put_many(self, texts: Sequence[str], vectors: np.ndarray):
+        """Stores vectors for texts, evicting least recently used rows when full."""
+        if len(texts) == 0:
+            return
+        with self._lock:
+            if self._vectors is None:
+                self._open(vectors.shape[1], "w+")
+                self._free_rows = list(range(self.capacity - 1, -1, -1))
+            for text, vector in zip(texts, vectors):
+                key = cache_key(self.model_name, text, self.backend)
+                row = self._slots.get(key)
+                if row is None:
+                    if self._free_rows:
+                        row = self._free_rows.pop()
+                    else:
+                        _, row = self._slots.popitem(last=False)
+                        self.evictions += 1
+                    self._slots[key] = row
+                    self._dirty += 1
+                else:
+                    self._slots.move_to_end(key)
+                self._vectors[row] = vector
+                self._row_keys[row] = np.frombuffer(bytes.fromhex(key), dtype=np.uint8)
+            if self._dirty >= INDEX_FLUSH_EVERY:
+                self._flush_locked()
+
+    def flush(self):
+        """Persists the vectors and index to disk."""
+        with self._lock:
+            if self._vectors is None or not self._dirty:
+                return
+            self._flush_locked()
+
+    def _flush_locked(self):
+        self._vectors.flush()
+        self._row_keys.flush()
+        self._write_index()
+
+    def stats(self) -> dict:
+        return {"model_name": self.model_name, "backend": self.backend, "entries": len(self._slots), "capacity": self.capacity,
+                "dtype": self.dtype.name, "hits": self.hits, "misses": self.misses,
+                "evictions": self.evictions}
+
+# --- 4. Shared Instances ---
+_caches = {}
+_caches_lock = threading.Lock()
+
+def get_embedding_cache(model_name: str, backend: str = EMBEDDING_BACKEND) -> EmbeddingCache:
+    with _caches_lock:
+        cache = _caches.get((model_name, backend))
+        if cache is None:
+            cache = EmbeddingCache(model_name, backend)
+            _caches[(model_name, backend)] = cache
+        return cache
+
+def encode_with_cache(texts: Sequence[str], service: Optional[EmbeddingService] = None) -> np.ndarray:
+    """
+    Encodes texts, taking vectors from the on-disk cache where possible.
+    The model is only loaded (and called) for texts that are not cached.
+    """
+    service = service or get_embedding_service()
+    cache = get_embedding_cache(service.model_name, service.backend)
+    vectors = cache.get_many(texts)
+    missing = [i for i, vector in enumerate(vectors) if vector is None]
+    if missing:
+        fresh = service.encode([texts[i] for i in missing])
+        cache.put_many([texts[i] for i in missing], fresh)
+        for i, vector in zip(missing, fresh):
+            vectors[i] = vector
+    return np.vstack(vectors).astype(np.float32, copy=False)
@@ -0,0 +1,245 @@
+# embeddings.py
+
+# --- 1. Imports ---
+import os
+import queue
+import asyncio
+import itertools
+import threading
+import time
+from concurrent.futures import Future
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+EMBEDDING_MODEL_NAME = os.getenv("EMBEDDING_MODEL_NAME", "all-MiniLM-L6-v2")
+# "torch" (sentence-transformers) or "onnx" (int8-quantized export, see onnx_embeddings.py).
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch").lower()
+# Threads one encode may use (0 = the library default, usually every core).
+EMBEDDING_INTRA_OP_THREADS = int(os.getenv("EMBEDDING_INTRA_OP_THREADS", "0"))
+# Texts per forward pass inside one encode.
+ENCODE_BATCH_SIZE = 32
+# Dynamic batching: small requests (chat queries) waiting at the same time
+# are encoded together, up to this many texts...
+EMBEDDING_MAX_BATCH = int(os.getenv("EMBEDDING_MAX_BATCH", "64"))
+# ...after waiting this long for more to arrive (0 = only merge requests
+# that queued up while the previous batch was running).
+EMBEDDING_BATCH_WAIT_MS = float(os.getenv("EMBEDDING_BATCH_WAIT_MS", "0"))
+# Requests with more texts than this (ingestion batches) run on their own,
+# after any waiting queries.
+SMALL_REQUEST_TEXTS = 8
+# Queue priorities: chat queries, then bulk (ingestion), then background
+# work nobody waits on (analytics question clustering).
+PRIORITY_QUERY, PRIORITY_BULK, PRIORITY_BACKGROUND = 0, 1, 2
+
+# --- 2. Encoders ---
+class TorchEncoder:
+    """The sentence-transformers model on PyTorch; the reference for the ONNX backend."""
+    backend = "torch"
+
+    def __init__(self, model_name: str, threads: int = EMBEDDING_INTRA_OP_THREADS):
+        # Imported here: torch takes seconds to import.
+        import torch
+        from sentence_transformers import SentenceTransformer
+
+        if threads:
+            torch.set_num_threads(threads)
+        self.model = SentenceTransformer(model_name)
+        self.dimension = self.model.get_sentence_embedding_dimension()
+        self.parameter_bytes = sum(p.numel() * p.element_size() for p in self.model.parameters())
+
+    def encode(self, texts: Sequence[str], batch_size: int = ENCODE_BATCH_SIZE) -> np.ndarray:
+        return self.model.encode(list(texts), batch_size=batch_size, convert_to_numpy=True)
+
+def load_encoder(model_name: str, backend: str = EMBEDDING_BACKEND):
+    if backend == "torch":
+        return TorchEncoder(model_name)
+    if backend == "onnx":
+        from onnx_embeddings import OnnxEncoder
+        return OnnxEncoder(model_name)
+    raise ValueError(f"Unknown EMBEDDING_BACKEND: {backend!r} (expected 'torch' or 'onnx')")
+
+# --- 3. Dynamic Batching ---
+class MicroBatcher:
+    """
+    Runs every encode on one worker thread (HuggingFace fast tokenizers are
+    not safe to call from several threads at once). Small requests waiting
+    together share one forward pass and go ahead of bulk requests, so a chat
+    query never waits behind more than the ingestion batch already running.
+    Background requests run alone, once nothing else is waiting.
+    """
+    def __init__(self, encode_batch, max_batch: int = EMBEDDING_MAX_BATCH,
+                 wait_seconds: float = EMBEDDING_BATCH_WAIT_MS / 1000.0):
+        self.encode_batch = encode_batch
+        self.max_batch = max_batch
+        self.wait_seconds = wait_seconds
+        # (priority, sequence, texts, future); small requests have PRIORITY_QUERY
+        self._queue: "queue.PriorityQueue[tuple]" = queue.PriorityQueue()
+        self._sequence = itertools.count()
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self.batches = 0
+        self.requests = 0
+
+    def submit(self, texts: Sequence[str], background: bool = False) -> Future:
+        future = Future()
+        texts = list(texts)
+        if background:
+            priority = PRIORITY_BACKGROUND
+        else:
+            priority = PRIORITY_QUERY if len(texts) <= SMALL_REQUEST_TEXTS else PRIORITY_BULK
+        self._queue.put((priority, next(self._sequence), texts, future))
+        if self._thread is None:
+            with self._start_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="embed-batcher", daemon=True)
+                    self._thread.start()
+        return future
+
+    def _collect(self) -> List[tuple]:
+        first = self._queue.get()
+        pending, total = [first], len(first[2])
+        if first[0] != PRIORITY_QUERY:
+            return pending  # bulk and background requests run alone
+        deadline = time.monotonic() + self.wait_seconds
+        while total < self.max_batch:
+            try:
+                remaining = deadline - time.monotonic()
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item[0] != PRIORITY_QUERY or total + len(item[2]) > self.max_batch:
+                self._queue.put(item)  # keeps its place (same sequence number)
+                break
+            pending.append(item)
+            total += len(item[2])
+        return pending
+
+    def _run(self):
+        # Nothing may escape this loop: if the worker died, every later
+        # encode would wait forever on a future nobody completes.
+        while True:
+            try:
+                self._run_once()
+            except Exception as e:
+                print(f"!!! Embedding batcher error: {e}")
+
+    def _run_once(self):
+        # Requests whose caller gave up (e.g. a cancelled aencode()) are
+        # dropped here; a cancelled future cannot take a result.
+        pending = [item for item in self._collect() if item[3].set_running_or_notify_cancel()]
+        if not pending:
+            return
+        texts = [text for _, _, request_texts, _ in pending for text in request_texts]
+        try:
+            vectors = self.encode_batch(texts)
+        except Exception as e:
+            for _, _, _, future in pending:
+                future.set_exception(e)
+            return
+        self.batches += 1
+        self.requests += len(pending)
+        offset = 0
+        for _, _, request_texts, future in pending:
+            future.set_result(vectors[offset:offset + len(request_texts)])
+            offset += len(request_texts)
+
+# --- 4. The EmbeddingService Class ---
+class EmbeddingService:
+    """
+    Owns the single embedding model used by the whole process (PyTorch or
+    the quantized ONNX export, per EMBEDDING_BACKEND). The model is loaded
+    once (on first use or via load()) and shared by the ingestion background
+    tasks and the SocraticTutor.
+    """
+    def __init__(self, model_name: str = EMBEDDING_MODEL_NAME, backend: str = EMBEDDING_BACKEND):
+        self.model_name = model_name
+        self.backend = backend
+        self._encoder = None
+        self._load_lock = threading.Lock()
+        self.load_seconds: Optional[float] = None
+        self.parameter_bytes: int = 0
+        self.encode_calls = 0
+        self.encoded_texts = 0
+        self._batcher = MicroBatcher(self._encode_batch)
+
+    @property
+    def is_loaded(self) -> bool:
+        return self._encoder is not None
+
+    def load(self):
+        """Loads the model if needed and returns its encoder. Safe to call from any thread."""
+        if self._encoder is not None:
+            return self._encoder
+        with self._load_lock:
+            if self._encoder is None:
+                print(f"--- Loading embedding model '{self.model_name}' ({self.backend}) ---")
+                start = time.perf_counter()
+                encoder = load_encoder(self.model_name, self.backend)
+                self.load_seconds = time.perf_counter() - start
+                self.parameter_bytes = encoder.parameter_bytes
+                self._encoder = encoder
+                print(f"  - Loaded in {self.load_seconds:.2f}s "
+                      f"({self.parameter_bytes / (1024 * 1024):.1f} MB of weights).")
+        return self._encoder
+
+    def warm_up(self):
+        """Loads the model and runs one encode, so the first real query pays for neither."""
+        self.load()
+        self.encode(["warm-up"])
+
+    @property
+    def dimension(self) -> int:
+        return self.load().dimension
+
+    def _encode_batch(self, texts: List[str]) -> np.ndarray:
+        embeddings = self.load().encode(texts)
+        self.encode_calls += 1
+        self.encoded_texts += len(texts)
+        return np.asarray(embeddings, dtype=np.float32)
+
+    def encode(self, texts: Sequence[str], background: bool = False) -> np.ndarray:
+        """
+        Encodes a list of texts into a 2-D float32 array. Background encodes
+        wait until no query or ingestion batch is queued.
+        """
+        if not len(texts):
+            return np.zeros((0, self.dimension), dtype=np.float32)
+        return self._batcher.submit(texts, background).result()
+
+    async def aencode(self, texts: Sequence[str]) -> np.ndarray:
+        """Async variant of encode(); waits for the batcher without blocking the event loop."""
+        if not len(texts):
+            return np.zeros((0, self.dimension), dtype=np.float32)
+        return await asyncio.wrap_future(self._batcher.submit(texts))
+
+    def stats(self) -> dict:
+        """Returns load time and memory figures for monitoring."""
+        return {
+            "model_name": self.model_name,
+            "backend": self.backend,
+            "loaded": self.is_loaded,
+            "load_seconds": self.load_seconds,
+            "parameter_mb": round(self.parameter_bytes / (1024 * 1024), 1),
+            "encode_calls": self.encode_calls,
+            "encoded_texts": self.encoded_texts,
+            "batched_requests": self._batcher.requests,
+        }
+
+# --- 5. Process-wide Registry ---
+_services = {}
+_registry_lock = threading.Lock()
+
+def get_embedding_service(model_name: str = EMBEDDING_MODEL_NAME) -> EmbeddingService:
+    """Returns the shared EmbeddingService for a model, creating it on first request."""
+    with _registry_lock:
+        service = _services.get(model_name)
+        if service is None:
+            service = EmbeddingService(model_name)
+            _services[model_name] = service
+        return service
+
+def embedding_stats() -> List[dict]:
+    """Returns stats for every embedding model registered in this process."""
+    with _registry_lock:
+        return [service.stats() for service in _services.values()]
@@ -2,64 +2,255 @@
 
 # --- 1. Imports ---
 import os
+import time
 import uuid
-import fitz  # PyMuPDF
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from sentence_transformers import SentenceTransformer
-from qdrant_client import QdrantClient, models
-from qdrant_client.http.models import Distance, VectorParams, PointStruct
-
-# --- 2. Core Functions ---
-def extract_text_from_pdf(pdf_path: str) -> str:
-    """Extracts all text from a given PDF file."""
-    doc = fitz.open(pdf_path)
-    text = ""
-    for page in doc:
-        text += page.get_text()
-    doc.close()
-    return text
-
-def simple_ingestion(pdf_path: str, collection_name: str = "socratic_collection"):
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+
+from catalog import get_catalog
+from chunking import Chunk, DocumentStructure, SectionIndexBuilder, iter_chunks
+from embeddings import get_embedding_service
+from embedding_cache import encode_with_cache, get_embedding_cache
+from manifests import DocumentManifest, chunk_hash
+from metrics import REGISTRY
+from pdf_extraction import PageOffsetMap, get_page_count, iter_pdf_pages
+from sparse_index import SparseIndexBuilder
+from vector_store import get_vector_store
+
+# --- 2. Pipeline Settings ---
+# Chunks embedded (and upserted) together.
+EMBED_BATCH_SIZE = int(os.getenv("INGEST_EMBED_BATCH_SIZE", "64"))
+# Upsert requests allowed to be outstanding while the next batch is embedded.
+MAX_INFLIGHT_UPSERTS = int(os.getenv("INGEST_MAX_INFLIGHT_UPSERTS", "2"))
+
+# progress(stage, done, total) is called once per batch; total may be None.
+ProgressCallback = Callable[[str, int, Optional[int]], None]
+
+# Stages: extract_chunk (per batch), embed (per batch), upsert (per batch),
+# finalize (deletes and index files) and document (the whole ingestion).
+INGEST_STAGE_SECONDS = REGISTRY.histogram("ingestion_stage_seconds", "Time spent in each ingestion stage.", ["stage"])
+INGEST_DOCUMENTS = REGISTRY.counter("ingestion_documents_total", "Documents ingested, by result.", ["status"])
+INGEST_PAGES = REGISTRY.counter("ingestion_pages_total", "PDF pages ingested.")
+INGEST_CHUNKS = REGISTRY.counter("ingestion_chunks_total", "Chunks ingested, by what had to be done with them.", ["kind"])
+
+# --- 3. Pipeline Stages ---
+# Chunking lives in chunking.py (structure-aware); iter_batches groups its output.
+def iter_batches(chunks: Iterable[Chunk], batch_size: int) -> Iterator[List[Chunk]]:
+    batch = []
+    for chunk in chunks:
+        batch.append(chunk)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+_DONE = object()
+
+def _timed(items: Iterable, stage: str) -> Iterator:
+    """Yields from items, recording how long each one took to produce."""
+    iterator = iter(items)
+    while True:
+        start = time.perf_counter()
+        item = next(iterator, _DONE)
+        INGEST_STAGE_SECONDS.observe(time.perf_counter() - start, stage=stage)
+        if item is _DONE:
+            return
+        yield item
+
+def _print_progress(stage: str, done: int, total: Optional[int]):
+    if stage == "upsert":
+        print(f"  - Upserted {done} chunks.")
+
+# --- 4. Core Functions ---
+# Payload fields that can change while the chunk text stays the same.
+POSITION_FIELDS = ("chunk_index", "char_start", "page", "section", "section_title", "chapter")
+
+def _point_id(filename: str, content_hash: str, occurrence: int) -> str:
+    # IDs depend on the chunk content, not its position, so an edit early in
+    # the document does not change the IDs of every chunk after it.
+    return str(uuid.uuid5(uuid.NAMESPACE_DNS, f"{filename}-{content_hash}-{occurrence}"))
+
+def _load_trusted_manifest(filename: str, store) -> Optional[DocumentManifest]:
+    """
+    The manifest of the last ingestion, if the store still holds what it
+    lists. A wiped or recreated collection (with data/manifests kept) would
+    otherwise make every chunk look unchanged, and nothing would be stored.
+    """
+    manifest = DocumentManifest.load(filename)
+    if manifest is None:
+        return None
+    stored = store.count(filename)
+    if stored != len(manifest.chunks):
+        print(f"  - The vector store holds {stored} of {len(manifest.chunks)} chunks listed for "
+              f"{filename}; ignoring the manifest and ingesting in full.")
+        return None
+    return manifest
+
+def simple_ingestion(pdf_path: str, collection_name: str = "socratic_collection",
+                     batch_size: int = EMBED_BATCH_SIZE,
+                     max_inflight_upserts: int = MAX_INFLIGHT_UPSERTS,
+                     progress: Optional[ProgressCallback] = None) -> dict:
+    """
+    Ingests a PDF and keeps the document catalog in step: the document is
+    marked processing, then ready (with its chunk count and content hash) or
+    failed.
+    """
+    filename = os.path.basename(pdf_path)
+    catalog = get_catalog()
+    catalog.mark_processing(filename)
+    try:
+        with INGEST_STAGE_SECONDS.time(stage="document"):
+            result = _ingest_pdf(pdf_path, collection_name, batch_size, max_inflight_upserts, progress)
+    except Exception as e:
+        print(f"!!! Ingestion failed for {filename}: {e}")
+        INGEST_DOCUMENTS.inc(status="failed")
+        catalog.mark_failed(filename, str(e))
+        raise
+    INGEST_DOCUMENTS.inc(status="ready")
+    catalog.mark_ready(filename, result["chunks"], result["content_hash"])
+    return result
+
+def _ingest_pdf(pdf_path: str, collection_name: str, batch_size: int, max_inflight_upserts: int,
+                progress: Optional[ProgressCallback]) -> dict:
     """
     Performs a fast, simple ingestion without any AI-based enrichment.
-    Finishes in seconds.
+    Extraction, chunking, batched embedding and batched upserts are pipelined,
+    so memory stays bounded by a few batches regardless of the PDF size.
+
+    Ingestion is incremental: chunks already stored for this document (same
+    content hash) are not re-embedded, chunks that only moved get a payload
+    update, and chunks that no longer exist are deleted.
     """
     print(f"\n--- Starting SIMPLE ingestion for {pdf_path} ---")
     filename = os.path.basename(pdf_path)
-    raw_text = extract_text_from_pdf(pdf_path)
-    
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=150)
-    all_chunks = text_splitter.split_text(raw_text)
-    
-    print(f"  - Split into {len(all_chunks)} chunks.")
-    
-    embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
-    embeddings = embedding_model.encode(all_chunks)
-    
-    qdrant_client = QdrantClient(host="localhost", port=6333)
+    progress = progress or _print_progress
+    embedding_service = get_embedding_service()
+    embedding_cache = get_embedding_cache(embedding_service.model_name, embedding_service.backend)
+    store = get_vector_store(collection_name)
+    # A warm cache already knows the vector size, so the model need not load.
+    store.ensure_collection(embedding_cache.dimension or embedding_service.dimension)
 
-    try:
-        # Check if collection exists. If not, create it.
-        qdrant_client.get_collection(collection_name=collection_name)
-    except Exception:
-        print(f"  - Collection '{collection_name}' not found. Creating it...")
-        qdrant_client.create_collection(
-            collection_name=collection_name,
-            vectors_config=VectorParams(size=embeddings.shape[1], distance=Distance.COSINE),
-        )
-    
-    # Use deterministic IDs based on file and chunk index
-    ids = [str(uuid.uuid5(uuid.NAMESPACE_DNS, f"{filename}-{i}")) for i, _ in enumerate(all_chunks)]
-
-    qdrant_client.upsert(
-        collection_name=collection_name,
-        points=[
-            PointStruct(
-                id=ids[i],
-                vector=vector.tolist(),
-                payload={"text": chunk, "source": filename}
-            ) for i, (chunk, vector) in enumerate(zip(all_chunks, embeddings))
-        ],
-        wait=True
-    )
-    print(f"--- SIMPLE ingestion complete for {filename} ---")
\ No newline at end of file
+    old_manifest = _load_trusted_manifest(filename, store)
+    if old_manifest is None:
+        # Nothing is known about points stored for this source (e.g. by an
+        # older, index-keyed ingestion), so clear them before a full ingest.
+        store.delete_source(filename)
+    old_chunks = old_manifest.chunks if old_manifest else {}
+    new_manifest = DocumentManifest(filename)
+    # Rebuilt from every chunk (changed or not); tokenizing is cheap.
+    sparse_index = SparseIndexBuilder()
+    section_index = SectionIndexBuilder()
+    structure = DocumentStructure()
+    document_hash = hashlib.sha256()
+    occurrences: Dict[str, int] = {}
+
+    page_total = get_page_count(pdf_path)
+    offset_map = PageOffsetMap()
+    chunks = iter_chunks(iter_pdf_pages(pdf_path, offset_map), offset_map, structure=structure)
+
+    def upsert_batch(changed: List[tuple], embeddings, moved: Dict[str, dict]) -> int:
+        with INGEST_STAGE_SECONDS.time(stage="upsert"):
+            if changed:
+                store.upsert(
+                    filename,
+                    [point_id for point_id, _ in changed],
+                    embeddings,
+                    [{"text": chunk.text, "source": filename, "chunk_index": chunk.index,
+                      "char_start": chunk.char_start, "page": chunk.page_number, "section": chunk.section,
+                      "section_title": chunk.section_title, "chapter": chunk.chapter} for _, chunk in changed]
+                )
+            if moved:
+                store.set_payloads(filename, moved)
+        return len(changed)
+
+    chunk_count = embedded = upserted = moved_count = 0
+    inflight = deque()
+    with ThreadPoolExecutor(max_workers=max(1, max_inflight_upserts)) as upsert_pool:
+        # Extraction and chunking run lazily, while the next batch is pulled.
+        for batch in _timed(iter_batches(chunks, batch_size), "extract_chunk"):
+            chunk_count += len(batch)
+            progress("extract", len(offset_map.page_numbers), page_total)
+            progress("chunk", chunk_count, None)
+
+            changed, moved = [], {}
+            for chunk in batch:
+                content_hash = chunk_hash(chunk.text)
+                document_hash.update(content_hash.encode("ascii"))
+                occurrence = occurrences.get(content_hash, 0)
+                occurrences[content_hash] = occurrence + 1
+                point_id = _point_id(filename, content_hash, occurrence)
+                position = {"chunk_index": chunk.index, "char_start": chunk.char_start, "page": chunk.page_number,
+                            "section": chunk.section, "section_title": chunk.section_title, "chapter": chunk.chapter}
+                new_manifest.chunks[point_id] = {"hash": content_hash, **position}
+                sparse_index.add(point_id, chunk.text)
+                section_index.add(point_id, chunk)
+
+                stored = old_chunks.get(point_id)
+                if stored is None:
+                    changed.append((point_id, chunk))
+                elif any(stored.get(field) != position[field] for field in POSITION_FIELDS):
+                    moved[point_id] = position
+
+            embeddings = None
+            if changed:
+                with INGEST_STAGE_SECONDS.time(stage="embed"):
+                    embeddings = encode_with_cache([chunk.text for _, chunk in changed], embedding_service)
+                embedded += len(changed)
+            progress("embed", embedded, None)
+            if not changed and not moved:
+                continue
+            moved_count += len(moved)
+
+            # Block on the oldest upsert once the in-flight limit is reached.
+            while len(inflight) >= max_inflight_upserts:
+                upserted += inflight.popleft().result()
+                progress("upsert", upserted, None)
+            inflight.append(upsert_pool.submit(upsert_batch, changed, embeddings, moved))
+
+        while inflight:
+            upserted += inflight.popleft().result()
+            progress("upsert", upserted, embedded)
+
+    finalize_started = time.perf_counter()
+    stale_ids = [point_id for point_id in old_chunks if point_id not in new_manifest.chunks]
+    if stale_ids:
+        store.delete(filename, stale_ids)
+    store.flush(filename)
+
+    sparse_index.save(filename)
+    section_index.save(filename, structure)
+    new_manifest.content_hash = document_hash.hexdigest()
+    new_manifest.save()
+    embedding_cache.flush()
+    INGEST_STAGE_SECONDS.observe(time.perf_counter() - finalize_started, stage="finalize")
+
+    INGEST_PAGES.inc(len(offset_map.page_numbers))
+    INGEST_CHUNKS.inc(embedded, kind="embedded")
+    INGEST_CHUNKS.inc(moved_count, kind="moved")
+    INGEST_CHUNKS.inc(len(stale_ids), kind="deleted")
+    INGEST_CHUNKS.inc(chunk_count - embedded - moved_count, kind="unchanged")
+
+    progress("extract", len(offset_map.page_numbers), page_total)
+    print(f"  - {chunk_count} chunks from {len(offset_map.page_numbers)} pages: "
+          f"{embedded} embedded, {moved_count} moved, {len(stale_ids)} deleted, "
+          f"{chunk_count - embedded - moved_count} unchanged.")
+    print(f"--- SIMPLE ingestion complete for {filename} ---")
+    return {"source": filename, "chunks": chunk_count, "embedded": embedded, "moved": moved_count,
+            "deleted": len(stale_ids), "content_hash": new_manifest.content_hash}
+
+def ingest_folder(folder: str, collection_name: str = "socratic_collection") -> List[dict]:
+    """Batch-ingests every PDF in a folder, e.g. to rebuild the vector store."""
+    results = []
+    for name in sorted(os.listdir(folder)):
+        if name.lower().endswith(".pdf"):
+            results.append(simple_ingestion(os.path.join(folder, name), collection_name))
+    return results
+
+if __name__ == "__main__":
+    import sys
+    ingest_folder(sys.argv[1] if len(sys.argv) > 1 else "uploads")
+    service = get_embedding_service()
+    print(get_embedding_cache(service.model_name, service.backend).stats())
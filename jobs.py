@@ -0,0 +1,206 @@
+# jobs.py
+# Runs PDF ingestion on a small, bounded worker pool (outside the web
+# server's event loop) and tracks each upload as a job with stage-level
+# progress that clients can poll or subscribe to.
+
+# --- 1. Imports ---
+import os
+import uuid
+import asyncio
+import datetime
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field, asdict
+from typing import Dict, List, Optional, Tuple
+
+from ingestion import simple_ingestion
+from starting_points import aensure_starting_points
+
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "1"))
+MAX_PENDING_JOBS = int(os.getenv("INGEST_MAX_PENDING_JOBS", "20"))
+# Finished jobs kept around for status queries.
+MAX_FINISHED_JOBS = 200
+STAGES = ("extract", "chunk", "embed", "upsert", "starting_points")
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_SUCCEEDED = "succeeded"
+JOB_FAILED = "failed"
+TERMINAL_STATUSES = (JOB_SUCCEEDED, JOB_FAILED)
+
+class JobQueueFull(Exception):
+    """Raised when too many ingestion jobs are already waiting."""
+
+# --- 2. The IngestionJob Record ---
+@dataclass
+class IngestionJob:
+    id: str
+    source: str
+    pdf_path: str
+    status: str = JOB_QUEUED
+    stage: Optional[str] = None
+    stages: Dict[str, dict] = field(default_factory=lambda: {s: {"done": 0, "total": None} for s in STAGES})
+    result: Optional[dict] = None
+    error: Optional[str] = None
+    created_at: str = field(default_factory=lambda: datetime.datetime.now().isoformat())
+    started_at: Optional[str] = None
+    finished_at: Optional[str] = None
+
+    def to_dict(self) -> dict:
+        data = asdict(self)
+        data.pop("pdf_path")
+        return data
+
+# --- 3. The JobManager Class ---
+class JobManager:
+    def __init__(self, max_workers: int = INGEST_WORKERS, max_pending: int = MAX_PENDING_JOBS):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ingest")
+        # Async follow-up work when there is no server loop (e.g. scripts).
+        self._background = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ingest-followup")
+        self.max_pending = max_pending
+        self._lock = threading.Lock()
+        self._jobs: "OrderedDict[str, IngestionJob]" = OrderedDict()
+        self._subscribers: Dict[str, List[Tuple[asyncio.AbstractEventLoop, asyncio.Queue]]] = {}
+        # One ingestion per source at a time, even with several workers.
+        self._source_locks: Dict[str, threading.Lock] = {}
+        # The web server's event loop; async stages (LLM calls) run on it.
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def attach_loop(self, loop: asyncio.AbstractEventLoop):
+        self._loop = loop
+
+    def _start_coroutine(self, coroutine) -> Future:
+        """
+        Starts a coroutine from a worker thread without waiting for it: on the
+        server loop when there is one, otherwise on a thread of its own.
+        """
+        if self._loop is not None and self._loop.is_running():
+            return asyncio.run_coroutine_threadsafe(coroutine, self._loop)
+        return self._background.submit(asyncio.run, coroutine)
+
+    def submit(self, pdf_path: str) -> IngestionJob:
+        """
+        Queues a PDF for ingestion and returns its job. If a job for the same
+        file is still queued, that job is returned instead: it has not read
+        the file yet, so it ingests this upload. A job that is already
+        running is followed by a new one once it has finished.
+        """
+        source = os.path.basename(pdf_path)
+        with self._lock:
+            for job in self._jobs.values():
+                if job.source == source and job.status == JOB_QUEUED:
+                    return job
+            pending = sum(1 for job in self._jobs.values() if job.status not in TERMINAL_STATUSES)
+            if pending >= self.max_pending:
+                raise JobQueueFull(f"{pending} ingestion jobs are already pending")
+            job = IngestionJob(id=uuid.uuid4().hex, source=source, pdf_path=pdf_path)
+            self._jobs[job.id] = job
+            self._prune()
+        self._executor.submit(self._run, job)
+        return job
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return job.to_dict() if job else None
+
+    def list(self) -> List[dict]:
+        with self._lock:
+            return [job.to_dict() for job in self._jobs.values()]
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._background.shutdown(wait=False, cancel_futures=True)
+
+    # --- Push Notifications ---
+    def subscribe(self, job_id: str) -> asyncio.Queue:
+        """Returns a queue that receives a job snapshot on every update. Call from the event loop."""
+        queue: asyncio.Queue = asyncio.Queue(maxsize=16)
+        with self._lock:
+            self._subscribers.setdefault(job_id, []).append((asyncio.get_running_loop(), queue))
+        return queue
+
+    def unsubscribe(self, job_id: str, queue: asyncio.Queue):
+        with self._lock:
+            subscribers = self._subscribers.get(job_id, [])
+            self._subscribers[job_id] = [(loop, q) for loop, q in subscribers if q is not queue]
+            if not self._subscribers[job_id]:
+                del self._subscribers[job_id]
+
+    @staticmethod
+    def _offer(queue: asyncio.Queue, snapshot: dict):
+        # Slow clients only need the latest state, so drop the oldest update.
+        if queue.full():
+            queue.get_nowait()
+        queue.put_nowait(snapshot)
+
+    def _publish(self, job: IngestionJob):
+        with self._lock:
+            snapshot = job.to_dict()
+            subscribers = list(self._subscribers.get(job.id, []))
+        for loop, queue in subscribers:
+            try:
+                loop.call_soon_threadsafe(self._offer, queue, snapshot)
+            except RuntimeError:
+                pass  # the subscriber's event loop has already closed
+
+    # --- Worker ---
+    def _run(self, job: IngestionJob):
+        with self._lock:
+            source_lock = self._source_locks.setdefault(job.source, threading.Lock())
+        # The job stays queued (and absorbs further uploads) while an earlier
+        # job for the same file is still running.
+        with source_lock:
+            self._ingest(job)
+
+    def _ingest(self, job: IngestionJob):
+        with self._lock:
+            job.status, job.started_at = JOB_RUNNING, datetime.datetime.now().isoformat()
+        self._publish(job)
+
+        def on_progress(stage: str, done: int, total: Optional[int]):
+            with self._lock:
+                job.stage = stage
+                job.stages[stage] = {"done": done, "total": total}
+            self._publish(job)
+
+        try:
+            result = simple_ingestion(job.pdf_path, progress=on_progress)
+            with self._lock:
+                job.status, job.result = JOB_SUCCEEDED, result
+                job.stages["starting_points"] = {"done": 0, "total": 1}
+        except Exception as e:
+            result = None
+            with self._lock:
+                job.status, job.error = JOB_FAILED, str(e)
+        if result is not None:
+            # Scheduled before the final update is published, so a client
+            # that asks for the starting points on "done" joins this run.
+            self._precompute_starting_points(job, result["content_hash"])
+        with self._lock:
+            job.finished_at = datetime.datetime.now().isoformat()
+        self._publish(job)
+
+    def _precompute_starting_points(self, job: IngestionJob, content_hash: str):
+        """
+        The document is already chat-ready; its welcome topics/questions are
+        generated in the background (LLM calls with retries can take minutes),
+        so the ingest worker moves on to the next upload. The chat page's
+        request for them joins this generation instead of starting another.
+        """
+        def finished(future: Future):
+            try:
+                future.result()
+            except Exception as e:
+                print(f"!!! Could not precompute starting points for {job.source}: {e}")
+            with self._lock:
+                job.stages["starting_points"] = {"done": 1, "total": 1}
+            self._publish(job)
+
+        self._start_coroutine(aensure_starting_points(job.pdf_path, content_hash)).add_done_callback(finished)
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.status in TERMINAL_STATUSES]
+        for job_id in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self._jobs[job_id]
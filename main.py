@@ -2,29 +2,44 @@
 
 # --- 1. Imports ---
 import os
+import json
+import asyncio
+import time
 import datetime
 import uuid
-import time
 import urllib.parse
-import google.generativeai as genai
-from typing import List, Dict, Any
+from contextlib import asynccontextmanager
+from typing import List, Dict, Any, Optional
 
-from fastapi import FastAPI, Request, UploadFile, File, BackgroundTasks
-from fastapi.responses import JSONResponse, RedirectResponse, Response
+from fastapi import FastAPI, Request, UploadFile, File
+from fastapi.responses import JSONResponse, PlainTextResponse, RedirectResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from pydantic import BaseModel
 from dotenv import load_dotenv
-from qdrant_client import QdrantClient
-from qdrant_client.http.exceptions import UnexpectedResponse
-from pymongo import MongoClient
 
 # --- 2. Local Application Imports ---
-from bot_logic import SocraticTutor
-from ingestion import simple_ingestion, extract_text_from_pdf
+from bot_logic import SocraticTutor, NO_CONTEXT_MESSAGE, STAGE_SECONDS
+from jobs import JobManager, JobQueueFull, TERMINAL_STATUSES
+from starting_points import aensure_starting_points
+from embeddings import embedding_stats
+from catalog import get_catalog
+from sessions import ChatSession, SessionStore
+from chat_logger import ChatTurnLogger
+from metrics import REGISTRY, current_request_id, new_request_id, reset_request_id, set_request_id
+from resources import get_resources
 # --- 3. Initial Application Setup ---
 load_dotenv()
-app = FastAPI(title="Socratic Tutor Bot API")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await start_background_services()
+    try:
+        yield
+    finally:
+        await stop_background_services()
+
+app = FastAPI(title="Socratic Tutor Bot API", lifespan=lifespan)
 
 templates = Jinja2Templates(directory="templates")
 app.mount("/static", StaticFiles(directory="templates"), name="static")
@@ -34,66 +49,81 @@ if not os.path.exists(UPLOAD_FOLDER):
     os.makedirs(UPLOAD_FOLDER)
 
 # --- 4. Database and AI Service Connections ---
+# Pooled clients with timeouts, shared by every request (see resources.py).
+# Nothing here connects or loads a model, so the server binds its port
+# right away; warm_up() does the slow part in the background.
 API_KEY = os.getenv("GOOGLE_API_KEY")
 if not API_KEY: raise ValueError("GOOGLE_API_KEY not found in .env file!")
-genai.configure(api_key=API_KEY)
+if not os.getenv("MONGODB_URI"): raise ValueError("MONGODB_URI not found in .env file!")
+resources = get_resources()
+# Turns are logged one document per turn (collection chat_turns) and rolled
+# up for instructor dashboards; chat_sessions holds turns logged before that.
+# The store is created by warm_up(), which also starts the logger.
+analytics_store = None
+
+def write_chat_turns(records: List[dict]):
+    analytics_store.write_turns(records)
 
-MONGO_URI = os.getenv("MONGODB_URI")
-if not MONGO_URI: raise ValueError("MONGODB_URI not found in .env file!")
-mongo_client = MongoClient(MONGO_URI)
-db = mongo_client["socratic_tutor_db"]
-sessions_collection = db["chat_sessions"]
+chat_logger = ChatTurnLogger(write_chat_turns)
 
 tutor = SocraticTutor(api_key=API_KEY)
+# Seconds between warm-up attempts if one fails (e.g. the model download).
+WARM_UP_RETRY_SECONDS = float(os.getenv("WARM_UP_RETRY_SECONDS", "10"))
+warm_up_state = {"ready": False, "attempts": 0, "seconds": None, "error": None}
+job_manager = JobManager()
+session_store = SessionStore(summarizer=tutor.asummarize_history)
+SESSION_COOKIE = "tutor_session"
+
+# --- Metrics ---
+HTTP_SECONDS = REGISTRY.histogram("http_request_duration_seconds", "Time to produce a response (headers, for streams).",
+                                  ["method", "route", "status"])
+REGISTRY.callback("tutor_cache_hits_total", "Lookups answered from each hot-path cache.", ["cache"],
+                  lambda: [((name,), stats.get("hits")) for name, stats in tutor.cache_stats().items()],
+                  kind="counter")
+REGISTRY.callback("tutor_cache_misses_total", "Lookups that missed each hot-path cache.", ["cache"],
+                  lambda: [((name,), stats.get("misses")) for name, stats in tutor.cache_stats().items()],
+                  kind="counter")
+REGISTRY.callback("tutor_cache_hit_ratio", "Hit rate of each hot-path cache since startup.", ["cache"],
+                  lambda: [((name,), stats.get("hit_rate")) for name, stats in tutor.cache_stats().items()])
+REGISTRY.callback("tutor_context_tokens_saved_total", "Prompt tokens saved by merging overlapping chunks.", [],
+                  lambda: [((), tutor.context_stats["tokens_saved"])], kind="counter")
+REGISTRY.callback("chat_log_queue_depth", "Chat turns waiting to be written.", [],
+                  lambda: [((), chat_logger.stats()["queue_depth"])])
+REGISTRY.callback("chat_log_records_total", "Chat turns by what happened to them.", ["state"],
+                  lambda: [((state,), chat_logger.counters[state]) for state in ("written", "spooled", "replayed", "overflowed")],
+                  kind="counter")
 
 # --- 5. Pydantic Models for API Data Validation ---
 class ChatRequest(BaseModel):
     message: str
-    history: List[Dict[str, Any]]
     document_source: str
+    # The conversation is kept server-side; history is only read from older
+    # clients that still send it, to seed a new session.
+    history: List[Dict[str, Any]] = []
+    session_id: Optional[str] = None
+    # Skip the semantic answer cache and always ask the LLM
+    bypass_cache: bool = False
+
+# --- 6. API Endpoints ---
+@app.middleware("http")
+async def request_context(request: Request, call_next):
+    # Every log line printed while handling the request carries this ID;
+    # clients may pass their own to correlate with their logs.
+    token = set_request_id(request.headers.get("x-request-id") or new_request_id())
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        response.headers["X-Request-ID"] = current_request_id()
+        return response
+    finally:
+        # The route template (not the raw path) keeps the label set small.
+        route = request.scope.get("route")
+        HTTP_SECONDS.observe(time.perf_counter() - start, method=request.method,
+                             route=getattr(route, "path", "unmatched"), status=status)
+        reset_request_id(token)
 
-# --- 6. Helper Function for Proactive Welcome Message ---
-def generate_starting_points(pdf_path: str, max_retries: int = 3) -> dict:
-    print(f"--- Generating starting points for {os.path.basename(pdf_path)} ---")
-    full_text = extract_text_from_pdf(pdf_path)
-    if len(full_text) > 200000: full_text = full_text[:200000]
-
-    model = genai.GenerativeModel('gemini-pro-latest')
-    prompt = f"""
-    Based on the following document text, please do two things:
-    1. Summarize the top 5-7 main topics discussed. Present this as a simple, comma-separated list.
-    2. Generate 3 open-ended, engaging questions a student might have about this text.
-    DOCUMENT TEXT: "{full_text}"
-    ---
-    Provide your response in a structured format. Example:
-    TOPICS: Topic A, Topic B, Topic C
-    QUESTIONS:
-    1. What is the significance of [Concept X]?
-    2. How does [Event Y] affect [Outcome Z]?
-    3. Can you explain the process of [Mechanism W]?
-    """
-    for attempt in range(max_retries):
-        try:
-            request_options = {'timeout': 300}
-            response = model.generate_content(prompt, request_options=request_options)
-            text = response.text
-            topics_line = next((line for line in text.split('\n') if line.startswith("TOPICS:")), "TOPICS: General Information")
-            questions_section = text.split("QUESTIONS:")[-1]
-            topics = topics_line.replace("TOPICS:", "").strip()
-            questions = [q.strip().lstrip('0123456789. ') for q in questions_section.split('\n') if q.strip()]
-            return {"topics": topics, "questions": questions[:3]}
-        except Exception as e:
-            print(f"--> Starting points generation attempt {attempt + 1}/{max_retries} failed.")
-            if attempt < max_retries - 1:
-                wait_time = 10 * (attempt + 1)
-                print(f"    ...retrying in {wait_time} seconds...")
-                time.sleep(wait_time)
-            else:
-                print("--> Max retries reached for starting points. Falling back to default.")
-                return {"topics": "General discussion", "questions": []}
-    return {"topics": "General discussion", "questions": []}
-
-# --- 7. API Endpoints ---
 @app.get("/", summary="Serve the main chat interface")
 async def serve_chat_page(request: Request):
     return templates.TemplateResponse("index.html", {"request": request})
@@ -103,67 +133,301 @@ async def serve_upload_page(request: Request):
     return templates.TemplateResponse("upload.html", {"request": request})
 
 @app.post("/upload", summary="Instantly handle PDF upload and queue processing")
-async def handle_file_upload(background_tasks: BackgroundTasks, file: UploadFile = File(...)):
+async def handle_file_upload(request: Request, file: UploadFile = File(...)):
     if not file.filename.endswith('.pdf'):
         return JSONResponse(content={"error": "Invalid file type"}, status_code=400)
 
     filepath = os.path.join(UPLOAD_FOLDER, file.filename)
-    with open(filepath, "wb") as buffer:
+    # Written to a temporary file first, so a job (or chat request) reading
+    # the previous version never sees a half-written PDF.
+    tmp_path = f"{filepath}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, "wb") as buffer:
         buffer.write(await file.read())
+    os.replace(tmp_path, filepath)
     
-    # Queue BOTH ingestion tasks to run in the background
-    background_tasks.add_task(simple_ingestion, filepath)
-    
+    # Queue the ingestion job on the bounded worker pool
+    try:
+        job = job_manager.submit(filepath)
+    except JobQueueFull as e:
+        return JSONResponse(content={"error": str(e)}, status_code=503)
+
+    if "application/json" in request.headers.get("accept", ""):
+        return JSONResponse(content={"job_id": job.id, "source": job.source}, status_code=202)
     # Instantly redirect with a "processing" status
-    redirect_url = f"/?doc={urllib.parse.quote(file.filename)}&status=processing"
-    return RedirectResponse(url=redirect_url, status_code=303)
+    redirect_url = f"/?doc={urllib.parse.quote(file.filename)}&status=processing&job={job.id}"
+    return RedirectResponse(url=redirect_url, status_code=303, headers={"X-Job-ID": job.id})
 
-@app.get("/get_documents", summary="Get a list of all processed documents")
-async def get_documents_list():
-    try:
-        qdrant_client = QdrantClient(host="localhost", port=6333)
+@app.get("/jobs", summary="List recent ingestion jobs")
+async def list_jobs():
+    return JSONResponse(content=job_manager.list())
+
+@app.get("/jobs/{job_id}", summary="Get the status and stage progress of an ingestion job")
+async def get_job(job_id: str):
+    job = job_manager.get(job_id)
+    if job is None:
+        return JSONResponse(content={"error": "Job not found"}, status_code=404)
+    return JSONResponse(content=job)
+
+@app.get("/jobs/{job_id}/events", summary="Stream ingestion job progress as Server-Sent Events")
+async def stream_job_events(job_id: str):
+    if job_manager.get(job_id) is None:
+        return JSONResponse(content={"error": "Job not found"}, status_code=404)
+
+    async def event_stream():
+        queue = job_manager.subscribe(job_id)
         try:
-            qdrant_client.get_collection(collection_name="socratic_collection")
-        except (UnexpectedResponse, Exception):
-            return JSONResponse(content=[])
-        scrolled_points, _ = qdrant_client.scroll(
-            collection_name="socratic_collection", limit=10000,
-            with_payload=["source"], with_vectors=False
-        )
-        if not scrolled_points: return JSONResponse(content=[])
-        sources = sorted(list(set(point.payload["source"] for point in scrolled_points)))
-        return JSONResponse(content=sources)
-    except Exception as e:
-        print(f"An unexpected error occurred in get_documents: {e}")
-        return JSONResponse(content=[])
-
-@app.get("/get_starting_points/{filename}", summary="Generate and get welcome topics/questions for a doc")
+            snapshot = job_manager.get(job_id)
+            while True:
+                event = "done" if snapshot["status"] in TERMINAL_STATUSES else "progress"
+                yield f"event: {event}\ndata: {json.dumps(snapshot)}\n\n"
+                if event == "done":
+                    break
+                try:
+                    snapshot = await asyncio.wait_for(queue.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    snapshot = job_manager.get(job_id)
+        finally:
+            job_manager.unsubscribe(job_id, queue)
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache"})
+
+def _catalog_response(request: Request, etag: str, content) -> Response:
+    # Clients revalidate with If-None-Match; unchanged catalogs cost a 304.
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(content=content, headers=headers)
+
+@app.get("/get_documents", summary="Get a list of all processed documents")
+async def get_documents_list(request: Request):
+    return _catalog_response(request, *get_catalog().available_sources_with_etag())
+
+@app.get("/documents", summary="Get the document catalog with ingestion status")
+async def get_document_catalog(request: Request):
+    return _catalog_response(request, *get_catalog().entries_with_etag())
+
+@app.get("/get_starting_points/{filename}", summary="Get the welcome topics/questions for a doc")
 async def get_starting_points_for_doc(filename: str):
     filepath = os.path.join(UPLOAD_FOLDER, filename)
     if not os.path.exists(filepath):
         return JSONResponse(content={"error": "File not found"}, status_code=404)
-    starting_points = generate_starting_points(filepath)
+    # Normally precomputed by the ingestion job; generated here (without
+    # blocking the event loop) only if this document version has none yet.
+    entry = get_catalog().get(filename)
+    starting_points = await aensure_starting_points(filepath, entry["content_hash"] if entry else None)
     return JSONResponse(content=starting_points)
 
+def log_chat_turn(session: ChatSession, request: ChatRequest, bot_response: str):
+    # Write-behind: this only queues the record; MongoDB is written in bulk
+    # by the logger thread (or spooled locally while it is unreachable).
+    # The history is not copied into each turn; turn_index orders a session.
+    # The question's embedding (already computed for retrieval) is passed
+    # on for the analytics clustering, and not stored.
+    chat_logger.log({
+        "_id": uuid.uuid4().hex, "request_id": current_request_id(),
+        "session_id": session.id, "turn_index": session.turn_count,
+        "timestamp": datetime.datetime.now().isoformat(),
+        "document_source": request.document_source, "user_message": request.message,
+        "bot_response": bot_response, "unanswered": bot_response == NO_CONTEXT_MESSAGE,
+        "question_vector": tutor.cached_query_embedding(request.message)
+    })
+
+def open_session(http_request: Request, request: ChatRequest) -> ChatSession:
+    session_id = request.session_id or http_request.cookies.get(SESSION_COOKIE)
+    session = session_store.get_or_create(session_id, request.document_source)
+    session_store.seed_history(session, request.history)
+    return session
+
+def set_session_cookie(response: Response, session: ChatSession):
+    # A browser-session cookie; the chat page also starts a new conversation
+    # on every load, so no hidden history outlives what the student can see.
+    response.set_cookie(SESSION_COOKIE, session.id, httponly=True, samesite="lax")
+
+@app.post("/chat/reset", summary="Start a new conversation (forget the current session's history)")
+async def reset_chat_session(http_request: Request):
+    session_store.end(http_request.cookies.get(SESSION_COOKIE))
+    response = JSONResponse(content={"status": "reset"})
+    response.delete_cookie(SESSION_COOKIE)
+    return response
+
 @app.post("/chat", summary="Process a user chat message")
-async def chat_endpoint(request: ChatRequest):
-    session_id = str(uuid.uuid4())
-    bot_response = tutor.generate_response(
+async def chat_endpoint(request: ChatRequest, http_request: Request):
+    not_ready = not_ready_response()
+    if not_ready is not None:
+        return not_ready
+    session = open_session(http_request, request)
+    chat_history, history_summary = list(session.turns), session.summary
+    bot_response = await tutor.agenerate_response(
         student_question=request.message,
-        chat_history=request.history,
-        document_source=request.document_source
+        chat_history=chat_history,
+        document_source=request.document_source,
+        use_answer_cache=not request.bypass_cache,
+        history_summary=history_summary
     )
+    session_store.append_turn(session, request.message, bot_response)
+    with STAGE_SECONDS.time(stage="log"):
+        log_chat_turn(session, request, bot_response)
+    response = JSONResponse(content={"response": bot_response, "session_id": session.id})
+    set_session_cookie(response, session)
+    return response
+
+@app.post("/chat/stream", summary="Process a user chat message, streaming the reply as Server-Sent Events")
+async def chat_stream_endpoint(request: ChatRequest, http_request: Request):
+    not_ready = not_ready_response()
+    if not_ready is not None:
+        return not_ready
+    session = open_session(http_request, request)
+    chat_history, history_summary = list(session.turns), session.summary
+
+    async def event_stream():
+        parts = []
+        try:
+            async for text in tutor.astream_response(
+                student_question=request.message,
+                chat_history=chat_history,
+                document_source=request.document_source,
+                use_answer_cache=not request.bypass_cache,
+                history_summary=history_summary
+            ):
+                parts.append(text)
+                yield f"event: token\ndata: {json.dumps({'text': text})}\n\n"
+        finally:
+            # A client that disconnects cancels this generator mid-stream;
+            # the turn is still recorded with whatever had been streamed.
+            bot_response = "".join(parts)
+            if bot_response:
+                session_store.append_turn(session, request.message, bot_response)
+                with STAGE_SECONDS.time(stage="log"):
+                    log_chat_turn(session, request, bot_response)
+        yield f"event: done\ndata: {json.dumps({'response': bot_response, 'session_id': session.id})}\n\n"
+
+    response = StreamingResponse(event_stream(), media_type="text/event-stream",
+                                 headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    set_session_cookie(response, session)
+    return response
+
+# --- Startup, Warm-up and Shutdown ---
+def warm_up():
+    """
+    The slow part of starting up, run in a thread once the server is
+    listening: import pymongo and start the chat logger, add documents that
+    are only in the vector store to the catalog (once), load the embedding
+    model with one dummy encode, and load the Gemini SDK and vector store client.
+    """
+    global analytics_store
+    start = time.perf_counter()
+    if analytics_store is None:
+        from analytics import AnalyticsStore
+        analytics_store = AnalyticsStore(resources.mongo_db())
+        chat_logger.start()
+    catalog = get_catalog()
+    if not catalog.seeded:
+        # Documents ingested before the catalog existed are only in the store.
+        catalog.seed_from_store(tutor.vector_store.source_counts())
+    tutor.warm_up()
+    warm_up_state.update(ready=True, seconds=round(time.perf_counter() - start, 2), error=None)
+    print(f"--- Warm-up complete in {warm_up_state['seconds']:.2f}s; accepting chat traffic ---")
+
+async def run_warm_up():
+    while not warm_up_state["ready"]:
+        warm_up_state["attempts"] += 1
+        try:
+            await asyncio.to_thread(warm_up)
+        except Exception as e:
+            warm_up_state["error"] = str(e)
+            print(f"!!! Warm-up failed, retrying in {WARM_UP_RETRY_SECONDS:.0f}s: {e}")
+            await asyncio.sleep(WARM_UP_RETRY_SECONDS)
+    # Report unreachable dependencies; features that need them fail fast
+    # until they are back.
+    for name, status in (await resources.probe()).items():
+        if not status["ok"]:
+            print(f"!!! {name} is not reachable: {status['error']}")
+
+_background_tasks = set()
+
+async def start_background_services():
+    # Must return quickly: the server only binds its port afterwards.
+    job_manager.attach_loop(asyncio.get_running_loop())
+    task = asyncio.create_task(run_warm_up())
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+async def stop_background_services():
+    for task in list(_background_tasks):
+        task.cancel()
+    job_manager.shutdown()
+    # Flushes queued chat turns while the Mongo client is still open.
+    await asyncio.to_thread(chat_logger.stop)
+    await resources.aclose()
+
+# Chat needs the vector store; MongoDB (chat logs are spooled while it is
+# down) and Gemini (a failed call gets an apology) do not gate readiness.
+READINESS_DEPENDENCIES = ("vector_store",)
+
+def not_ready_response() -> Optional[JSONResponse]:
+    """A 503 for chat requests that arrive before warm-up has finished."""
+    if warm_up_state["ready"]:
+        return None
+    return JSONResponse(content={"error": "The tutor is starting up, please retry shortly."},
+                        status_code=503, headers={"Retry-After": "2"})
+
+@app.get("/healthz", summary="Liveness: the process is up and serving requests")
+async def healthz():
+    return JSONResponse(content={"status": "alive"})
+
+@app.get("/readyz", summary="Readiness: warm-up is done and the vector store is reachable")
+async def readyz():
+    dependencies = await resources.probe(READINESS_DEPENDENCIES) if warm_up_state["ready"] else {}
+    ready = warm_up_state["ready"] and all(status["ok"] for status in dependencies.values())
+    return JSONResponse(content={"ready": ready, "warm_up": warm_up_state, "dependencies": dependencies},
+                        status_code=200 if ready else 503)
+
+@app.get("/dependency_status", summary="Probe MongoDB, the vector store and Gemini")
+async def dependency_status():
+    dependencies = await resources.probe()
+    ready = all(status["ok"] for status in dependencies.values())
+    return JSONResponse(content={"ready": ready, "dependencies": dependencies}, status_code=200 if ready else 503)
+
+@app.get("/embedding_status", summary="Report embedding model load time and memory")
+async def embedding_status():
+    return JSONResponse(content=embedding_stats())
+
+@app.get("/cache_status", summary="Report hit rates of the query, retrieval and answer caches")
+async def cache_status():
+    return JSONResponse(content=tutor.cache_stats())
+
+@app.get("/logging_status", summary="Report chat log queue depth, flushes and spool state")
+async def logging_status():
+    return JSONResponse(content=chat_logger.stats())
+
+@app.get("/analytics", summary="Per-document totals of chat turns and unanswered questions")
+async def analytics_overview():
+    if analytics_store is None:
+        return not_ready_response()
+    from pymongo.errors import PyMongoError
     try:
-        log_document = {
-            "session_id": session_id, "timestamp": datetime.datetime.now().isoformat(),
-            "document_source": request.document_source, "user_message": request.message,
-            "bot_response": bot_response, "chat_history": request.history
-        }
-        sessions_collection.insert_one(log_document)
-        print(f"Successfully logged chat turn to MongoDB.")
-    except Exception as e:
-        print(f"!!! Error logging to MongoDB: {e}")
-    return JSONResponse(content={"response": bot_response})
+        documents = await asyncio.to_thread(analytics_store.document_totals)
+    except PyMongoError as e:
+        return JSONResponse(content={"error": f"Analytics database unavailable: {e}"}, status_code=503)
+    return JSONResponse(content={"documents": documents})
+
+@app.get("/analytics/{filename}", summary="Hourly activity, unanswered rate and top questions for a document")
+async def analytics_for_doc(filename: str, hours: int = 168, top: int = 20):
+    if analytics_store is None:
+        return not_ready_response()
+    from pymongo.errors import PyMongoError
+    try:
+        report = await asyncio.to_thread(analytics_store.document_report, filename,
+                                         max(1, hours), max(1, min(top, 100)))
+    except PyMongoError as e:
+        return JSONResponse(content={"error": f"Analytics database unavailable: {e}"}, status_code=503)
+    return JSONResponse(content=report)
+
+@app.get("/metrics", summary="Latency histograms, counters and cache hit rates in Prometheus text format")
+async def metrics_endpoint():
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
 
 @app.get("/favicon.ico", include_in_schema=False)
 async def favicon():
@@ -0,0 +1,61 @@
+# manifests.py
+# A per-document record of which chunks are stored in the vector database,
+# keyed by a hash of each chunk's content. Lets re-ingestion skip unchanged
+# chunks and delete the ones that disappeared.
+
+# --- 1. Imports ---
+import os
+import json
+import hashlib
+import datetime
+import urllib.parse
+from typing import Dict, Optional
+
+from config import data_dir
+
+# --- 2. Helpers ---
+def chunk_hash(text: str) -> str:
+    """Content hash used to recognise a chunk across uploads."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def _manifest_path(source: str) -> str:
+    return os.path.join(data_dir("manifests"), urllib.parse.quote(source, safe="") + ".json")
+
+# --- 3. The DocumentManifest Class ---
+class DocumentManifest:
+    """
+    chunks maps point_id -> {"hash", "chunk_index", "char_start", "page"}.
+    content_hash is a hash over the ordered chunk hashes, i.e. of the
+    document as it was stored.
+    """
+    def __init__(self, source: str, chunks: Optional[Dict[str, dict]] = None,
+                 content_hash: Optional[str] = None, updated_at: Optional[str] = None):
+        self.source = source
+        self.chunks = chunks or {}
+        self.content_hash = content_hash
+        self.updated_at = updated_at
+
+    @classmethod
+    def load(cls, source: str) -> Optional["DocumentManifest"]:
+        """Returns the stored manifest for a document, or None if it was never ingested."""
+        path = _manifest_path(source)
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(data["source"], data["chunks"], data.get("content_hash"), data.get("updated_at"))
+
+    def save(self):
+        """Writes the manifest atomically so a crash never leaves a half-written file."""
+        self.updated_at = datetime.datetime.now().isoformat()
+        path = _manifest_path(self.source)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"source": self.source, "content_hash": self.content_hash,
+                       "updated_at": self.updated_at, "chunks": self.chunks}, f)
+        os.replace(tmp_path, path)
+
+    def delete(self):
+        path = _manifest_path(self.source)
+        if os.path.exists(path):
+            os.remove(path)
@@ -0,0 +1,180 @@
+# metrics.py
+# A small in-process metrics registry (counters, histograms and values read
+# at scrape time) rendered in the Prometheus text format for /metrics, plus
+# the request ID that ties log lines of one request together.
+
+# --- 1. Imports ---
+import time
+import uuid
+import threading
+import contextvars
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Seconds; chat stages range from sub-millisecond lookups to multi-second LLM calls.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+TOKEN_BUCKETS = (50, 100, 250, 500, 1000, 2000, 4000, 8000, 16000)
+
+# --- 2. Request IDs ---
+_request_id: contextvars.ContextVar = contextvars.ContextVar("request_id", default=None)
+
+def new_request_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+def set_request_id(request_id: Optional[str]):
+    return _request_id.set(request_id)
+
+def reset_request_id(token):
+    _request_id.reset(token)
+
+def current_request_id() -> Optional[str]:
+    return _request_id.get()
+
+def log(message: str):
+    """print() with the current request ID, so the lines of one request can be grepped together."""
+    request_id = current_request_id()
+    print(f"[{request_id}] {message}" if request_id else message)
+
+# --- 3. Metric Types ---
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def _header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = dict(self._values)
+        return self._header() + [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+                                 for key, value in sorted(values.items())]
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # key -> [count per bucket..., count above the last bucket, sum]
+        self._series: Dict[tuple, list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            # Counts per bucket here; made cumulative when rendered.
+            series[bisect_left(self.buckets, value)] += 1
+            series[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            series = {key: list(values) for key, values in self._series.items()}
+        lines = self._header()
+        for key, values in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), values):
+                cumulative += count
+                le = 'le="%s"' % _format_value(bound)
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(values[-1])}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+class CallbackMetric(_Metric):
+    """A gauge or counter whose values are read from elsewhere (e.g. cache stats) at scrape time."""
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str],
+                 read: Callable[[], Iterable[Tuple[Sequence[str], float]]], kind: str = "gauge"):
+        super().__init__(name, documentation, labelnames)
+        self.kind = kind
+        self.read = read
+
+    def render(self) -> List[str]:
+        try:
+            values = [(tuple(key), value) for key, value in self.read() if value is not None]
+        except Exception as e:
+            print(f"!!! Could not read metric {self.name}: {e}")
+            values = []
+        return self._header() + [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+                                 for key, value in values]
+
+# --- 4. The Registry ---
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        """Adds a metric; registering a name again returns the existing one (safe on module reload)."""
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def callback(self, name: str, documentation: str, labelnames: Sequence[str],
+                 read: Callable[[], Iterable[Tuple[Sequence[str], float]]], kind: str = "gauge") -> CallbackMetric:
+        with self._lock:
+            # Replaced rather than kept, so it reads from the newest object.
+            metric = self._metrics[name] = CallbackMetric(name, documentation, labelnames, read, kind)
+            return metric
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+REGISTRY = MetricsRegistry()
@@ -0,0 +1,326 @@
+# onnx_embeddings.py
+# CPU embedding backend for EMBEDDING_BACKEND=onnx: the sentence-transformers
+# model exported to ONNX, quantized to int8 and run with onnxruntime and the
+# Rust tokenizer, so serving needs no torch at all. Mean pooling and
+# normalization are done here in numpy, as the sentence-transformers
+# pipeline does them. Exports are checked for parity with the PyTorch model
+# (cosine agreement) before they are used.
+#
+# Usage: python onnx_embeddings.py export [--force]
+#        python onnx_embeddings.py parity [--texts FILE]
+#        python onnx_embeddings.py bench [--queries 200] [--bulk 512] [--threads N]
+# Export and parity need torch, sentence-transformers and onnx; serving
+# only needs onnxruntime and tokenizers, and never exports by itself.
+
+# --- 1. Imports ---
+import os
+import re
+import json
+import time
+import random
+import shutil
+import argparse
+import datetime
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+from config import data_dir
+from embeddings import EMBEDDING_INTRA_OP_THREADS, EMBEDDING_MODEL_NAME, ENCODE_BATCH_SIZE, TorchEncoder
+
+MODEL_FILE = "model-int8.onnx"
+CONFIG_FILE = "embedding_config.json"
+ONNX_OPSET = 14
+# An export is only used if it agrees this well with the PyTorch model.
+PARITY_MIN_MEAN_COSINE = float(os.getenv("ONNX_PARITY_MIN_MEAN_COSINE", "0.99"))
+PARITY_MIN_COSINE = float(os.getenv("ONNX_PARITY_MIN_COSINE", "0.97"))
+
+# Texts like the ones the tutor embeds: student questions and statute chunks.
+PARITY_TEXTS = [
+    "What is the fine for speeding?",
+    "Which section talks about driving without a licence?",
+    "Can the police seize my vehicle if the registration has expired?",
+    "What happens if a minor drives a motor vehicle?",
+    "Explain the penalty for not wearing a helmet.",
+    "Who is responsible for an accident caused by a defective vehicle?",
+    "183. Driving at excessive speed, etc.—(1) Whoever drives a motor vehicle in contravention of the "
+    "speed limits referred to in section 112 shall be punishable with a fine.",
+    "No person shall drive a motor vehicle in any public place unless he holds an effective driving "
+    "licence issued to him authorising him to drive the vehicle.",
+    "Every owner of a motor vehicle shall cause the vehicle to be registered by a registering authority.",
+    "The State Government may, by notification in the Official Gazette, make rules for the purpose of "
+    "carrying into effect the provisions of this Chapter.",
+    "CHAPTER XIII OFFENCES, PENALTIES AND PROCEDURE",
+    "Insurance of motor vehicles against third party risks is compulsory.",
+    "A learner's licence is valid for a period of six months from the date of issue.",
+    "Photosynthesis converts light energy into chemical energy stored in glucose.",
+    "The derivative of a constant is zero.",
+    "Who wrote the constitution and when did it come into force?",
+]
+
+def model_folder(model_name: str = EMBEDDING_MODEL_NAME) -> str:
+    return os.getenv("ONNX_MODEL_DIR") or data_dir("onnx", re.sub(r"[^A-Za-z0-9_.-]+", "_", model_name))
+
+# --- 2. Parity ---
+def _unit(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    return vectors / np.clip(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12, None)
+
+def check_parity(reference: np.ndarray, candidate: np.ndarray) -> dict:
+    """
+    Compares two encodings of the same texts: cosine similarity per text,
+    and how often each text's nearest neighbour is the same under both.
+    """
+    reference, candidate = _unit(reference), _unit(candidate)
+    cosines = np.sum(reference * candidate, axis=1)
+
+    def nearest(vectors: np.ndarray) -> np.ndarray:
+        similarities = vectors @ vectors.T
+        np.fill_diagonal(similarities, -np.inf)
+        return similarities.argmax(axis=1)
+
+    agreement = float(np.mean(nearest(reference) == nearest(candidate))) if len(cosines) > 2 else None
+    mean, minimum = float(cosines.mean()), float(cosines.min())
+    return {"texts": len(cosines), "mean_cosine": round(mean, 5), "min_cosine": round(minimum, 5),
+            "nearest_neighbour_agreement": agreement,
+            "passed": mean >= PARITY_MIN_MEAN_COSINE and minimum >= PARITY_MIN_COSINE}
+
+# --- 3. Export ---
+def export_model(model_name: str = EMBEDDING_MODEL_NAME, folder: Optional[str] = None,
+                 parity_texts: Sequence[str] = PARITY_TEXTS) -> dict:
+    """
+    Exports the transformer to ONNX, quantizes its weights to int8 (dynamic
+    quantization) and saves the tokenizer next to it. Everything is written
+    to a staging folder that replaces the export folder only once the parity
+    check has passed; if it fails, the previous export (if any) is kept as is.
+    """
+    import torch
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    folder = os.path.normpath(folder or model_folder(model_name))
+    staging = folder + ".tmp"
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+    print(f"--- Exporting '{model_name}' to ONNX (int8) in {folder} ---")
+    reference = TorchEncoder(model_name)
+    model = reference.model
+    pooling = model[1]
+    if not getattr(pooling, "pooling_mode_mean_tokens", False):
+        raise ValueError(f"{model_name} does not use mean pooling; only mean pooling is supported.")
+    normalize = any(type(module).__name__ == "Normalize" for module in model)
+    transformer = model[0].auto_model.eval()
+    tokenizer = model.tokenizer
+
+    sample = tokenizer(["export sample"], return_tensors="pt")
+    input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in sample]
+
+    class _LastHiddenState(torch.nn.Module):
+        def __init__(self, wrapped):
+            super().__init__()
+            self.wrapped = wrapped
+
+        def forward(self, *inputs):
+            return self.wrapped(**dict(zip(input_names, inputs))).last_hidden_state
+
+    fp32_path = os.path.join(staging, "model-fp32.onnx")
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names + ["last_hidden_state"]}
+    with torch.no_grad():
+        torch.onnx.export(_LastHiddenState(transformer), tuple(sample[name] for name in input_names), fp32_path,
+                          input_names=input_names, output_names=["last_hidden_state"],
+                          dynamic_axes=dynamic_axes, opset_version=ONNX_OPSET, do_constant_folding=True)
+    model_path = os.path.join(staging, MODEL_FILE)
+    quantize_dynamic(fp32_path, model_path, weight_type=QuantType.QInt8)
+    os.remove(fp32_path)
+    tokenizer.save_pretrained(staging)  # writes tokenizer.json for the Rust tokenizer
+
+    config = {"model_name": model_name, "dimension": reference.dimension, "max_length": model.max_seq_length,
+              "normalize": normalize, "exported_at": datetime.datetime.now().isoformat()}
+    candidate = OnnxEncoder.from_files(model_path, staging, config)
+    parity = check_parity(reference.encode(list(parity_texts)), candidate.encode(list(parity_texts)))
+    del candidate  # releases the model file before the folder is moved
+    print(f"  - Parity: mean cosine {parity['mean_cosine']}, min {parity['min_cosine']}, "
+          f"nearest-neighbour agreement {parity['nearest_neighbour_agreement']}")
+    if not parity["passed"]:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise RuntimeError(f"ONNX export of {model_name} failed the parity check: {parity}")
+    config["parity"] = parity
+    with open(os.path.join(staging, CONFIG_FILE), "w", encoding="utf-8") as f:
+        json.dump(config, f, indent=2)
+    # Model, tokenizer and config are swapped in together.
+    previous = folder + ".old"
+    shutil.rmtree(previous, ignore_errors=True)
+    if os.path.exists(folder):
+        os.replace(folder, previous)
+    os.replace(staging, folder)
+    shutil.rmtree(previous, ignore_errors=True)
+    print(f"  - Saved {os.path.getsize(os.path.join(folder, MODEL_FILE)) / (1024 * 1024):.1f} MB model.")
+    return config
+
+# --- 4. The OnnxEncoder Class ---
+class OnnxEncoder:
+    """Same interface as embeddings.TorchEncoder: encode(), dimension, parameter_bytes."""
+    backend = "onnx"
+
+    def __init__(self, model_name: str = EMBEDDING_MODEL_NAME, folder: Optional[str] = None,
+                 threads: int = EMBEDDING_INTRA_OP_THREADS):
+        folder = folder or model_folder(model_name)
+        if not os.path.exists(os.path.join(folder, CONFIG_FILE)):
+            # Exporting needs torch, which serving must not depend on.
+            raise FileNotFoundError(
+                f"No ONNX export of '{model_name}' in {folder}. Create one with "
+                f"'python onnx_embeddings.py export --model {model_name}' (needs torch), "
+                f"or set EMBEDDING_BACKEND=torch.")
+        with open(os.path.join(folder, CONFIG_FILE), "r", encoding="utf-8") as f:
+            config = json.load(f)
+        self._open(os.path.join(folder, MODEL_FILE), folder, config, threads)
+
+    @classmethod
+    def from_files(cls, model_path: str, folder: str, config: dict,
+                   threads: int = EMBEDDING_INTRA_OP_THREADS) -> "OnnxEncoder":
+        encoder = cls.__new__(cls)
+        encoder._open(model_path, folder, config, threads)
+        return encoder
+
+    def _open(self, model_path: str, folder: str, config: dict, threads: int):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+        # One encode at a time (see MicroBatcher), so no parallelism between ops.
+        options.inter_op_num_threads = 1
+        self.session = ort.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        self.input_names = [model_input.name for model_input in self.session.get_inputs()]
+        self.tokenizer = Tokenizer.from_file(os.path.join(folder, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=config["max_length"])
+        self.tokenizer.no_padding()  # padded per batch below, to the longest text in it
+        self.dimension = config["dimension"]
+        self.normalize = config["normalize"]
+        self.parameter_bytes = os.path.getsize(model_path)
+
+    def encode(self, texts: Sequence[str], batch_size: int = ENCODE_BATCH_SIZE) -> np.ndarray:
+        output = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        if not len(texts):
+            return output
+        encodings = self.tokenizer.encode_batch(list(texts))
+        # Texts of similar length are batched together, so little is padded.
+        order = sorted(range(len(encodings)), key=lambda i: len(encodings[i].ids))
+        for start in range(0, len(order), batch_size):
+            rows = order[start:start + batch_size]
+            width = max(len(encodings[i].ids) for i in rows)
+            feeds = {name: np.zeros((len(rows), width), dtype=np.int64)
+                     for name in ("input_ids", "attention_mask", "token_type_ids")}
+            for row, i in enumerate(rows):
+                encoding = encodings[i]
+                length = len(encoding.ids)
+                feeds["input_ids"][row, :length] = encoding.ids
+                feeds["attention_mask"][row, :length] = 1
+                feeds["token_type_ids"][row, :length] = encoding.type_ids
+            hidden = self.session.run(None, {name: feeds[name] for name in self.input_names})[0]
+            # Mean over the real (unpadded) tokens.
+            mask = feeds["attention_mask"][..., None].astype(np.float32)
+            output[rows] = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        return _unit(output) if self.normalize else output
+
+# --- 5. Benchmark ---
+def _bulk_texts(count: int, rng: random.Random) -> List[str]:
+    """Chunk-sized texts (~1000 characters, like ingestion chunks) made from the sample sentences."""
+    texts = []
+    for _ in range(count):
+        parts = []
+        while sum(len(part) + 1 for part in parts) < 1000:
+            parts.append(rng.choice(PARITY_TEXTS))
+        texts.append(" ".join(parts)[:1000])
+    return texts
+
+def ensure_export(model_name: str = EMBEDDING_MODEL_NAME):
+    """Exports the model unless an export exists; for the parity and bench commands."""
+    if not os.path.exists(os.path.join(model_folder(model_name), CONFIG_FILE)):
+        export_model(model_name)
+
+def benchmark(model_name: str = EMBEDDING_MODEL_NAME, queries: int = 200, bulk: int = 512,
+              threads: int = EMBEDDING_INTRA_OP_THREADS, seed: int = 7) -> dict:
+    """
+    Query latency (one short text per call, as in retrieval) and bulk
+    throughput (batches of chunks, as in ingestion) for both backends, plus
+    the parity of their embeddings on the bulk texts.
+    """
+    from benchmark import percentiles
+    from ingestion import EMBED_BATCH_SIZE
+
+    ensure_export(model_name)
+    rng = random.Random(seed)
+    query_texts = [rng.choice(PARITY_TEXTS[:6]) + f" ({i})" for i in range(queries)]
+    bulk_texts = _bulk_texts(bulk, rng)
+    results, vectors = {}, {}
+    for backend, load in (("torch", lambda: TorchEncoder(model_name, threads)),
+                          ("onnx", lambda: OnnxEncoder(model_name, threads=threads))):
+        start = time.perf_counter()
+        encoder = load()
+        load_seconds = time.perf_counter() - start
+        encoder.encode(["warm-up"])
+        latencies = []
+        for text in query_texts:
+            start = time.perf_counter()
+            encoder.encode([text])
+            latencies.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        vectors[backend] = np.concatenate([encoder.encode(bulk_texts[i:i + EMBED_BATCH_SIZE])
+                                           for i in range(0, len(bulk_texts), EMBED_BATCH_SIZE)])
+        seconds = time.perf_counter() - start
+        results[backend] = {"load_seconds": round(load_seconds, 2),
+                            "model_mb": round(encoder.parameter_bytes / (1024 * 1024), 1),
+                            "query": percentiles(latencies),
+                            "bulk_texts_per_sec": round(len(bulk_texts) / seconds, 1)}
+        print(f"  - {backend}: query p50 {results[backend]['query']['p50_ms']} ms, "
+              f"bulk {results[backend]['bulk_texts_per_sec']} texts/sec")
+    results["speedup"] = {
+        "query_p50": round(results["torch"]["query"]["p50_ms"] / results["onnx"]["query"]["p50_ms"], 2),
+        "bulk": round(results["onnx"]["bulk_texts_per_sec"] / results["torch"]["bulk_texts_per_sec"], 2),
+    }
+    results["parity"] = check_parity(vectors["torch"], vectors["onnx"])
+    return results
+
+# --- 6. Command Line ---
+def main():
+    parser = argparse.ArgumentParser(description="Export, check and benchmark the ONNX embedding backend.")
+    parser.add_argument("command", choices=["export", "parity", "bench"])
+    parser.add_argument("--model", default=EMBEDDING_MODEL_NAME)
+    parser.add_argument("--force", action="store_true", help="export even if an export exists")
+    parser.add_argument("--texts", help="file with one text per line for the parity check")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--bulk", type=int, default=512)
+    parser.add_argument("--threads", type=int, default=EMBEDDING_INTRA_OP_THREADS)
+    parser.add_argument("--output", help="where to write the benchmark JSON")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        if args.force or not os.path.exists(os.path.join(model_folder(args.model), CONFIG_FILE)):
+            export_model(args.model)
+        else:
+            print("An export already exists; use --force to replace it.")
+    elif args.command == "parity":
+        texts = PARITY_TEXTS
+        if args.texts:
+            with open(args.texts, "r", encoding="utf-8") as f:
+                texts = [line.strip() for line in f if line.strip()]
+        ensure_export(args.model)
+        parity = check_parity(TorchEncoder(args.model, args.threads).encode(texts),
+                              OnnxEncoder(args.model, threads=args.threads).encode(texts))
+        print(json.dumps(parity, indent=2))
+    else:
+        results = {"timestamp": datetime.datetime.now().isoformat(), "model": args.model,
+                   "threads": args.threads or os.cpu_count(),
+                   **benchmark(args.model, args.queries, args.bulk, args.threads)}
+        output = args.output or os.path.join(
+            "benchmark_results", f"embeddings-{datetime.datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+        os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+        with open(output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"Speedup: {results['speedup']}; parity: {results['parity']}")
+        print(f"--- Results written to {output} ---")
+
+if __name__ == "__main__":
+    main()
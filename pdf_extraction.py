@@ -0,0 +1,117 @@
+# pdf_extraction.py
+# Kept free of heavy imports (torch, qdrant, langchain) so that the worker
+# processes used for page-parallel extraction start quickly.
+
+# --- 1. Imports ---
+import os
+import bisect
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from multiprocessing import get_context
+from typing import Iterator, List, NamedTuple, Optional
+
+import fitz  # PyMuPDF
+
+# Documents with at least this many pages are extracted in a process pool.
+PARALLEL_PAGE_THRESHOLD = int(os.getenv("PDF_PARALLEL_PAGE_THRESHOLD", "64"))
+# Number of pages each worker task extracts in one go.
+PAGES_PER_TASK = 16
+
+# --- 2. Data Structures ---
+class PageText(NamedTuple):
+    page_number: int  # 1-based, as printed in PDF viewers
+    char_start: int   # offset of this page in the concatenated document text
+    text: str
+
+class PageOffsetMap:
+    """Maps character offsets in the concatenated document text back to page numbers."""
+    def __init__(self):
+        self.page_numbers: List[int] = []
+        self.char_starts: List[int] = []
+        self.total_chars = 0
+
+    def add_page(self, page_number: int, text: str) -> int:
+        """Records a page and returns its starting character offset."""
+        start = self.total_chars
+        self.page_numbers.append(page_number)
+        self.char_starts.append(start)
+        self.total_chars += len(text)
+        return start
+
+    def page_for_offset(self, offset: int) -> Optional[int]:
+        """Returns the page number containing the given character offset."""
+        index = bisect.bisect_right(self.char_starts, offset) - 1
+        if index < 0:
+            return None
+        return self.page_numbers[index]
+
+    def to_dict(self) -> dict:
+        return {"pages": self.page_numbers, "char_starts": self.char_starts, "total_chars": self.total_chars}
+
+# --- 3. Extraction Functions ---
+def _extract_page_range(pdf_path: str, start: int, stop: int) -> List[str]:
+    """Worker task: extracts the text of pages [start, stop) (0-based)."""
+    doc = fitz.open(pdf_path)
+    try:
+        return [doc[i].get_text() for i in range(start, stop)]
+    finally:
+        doc.close()
+
+def _iter_page_texts_serial(pdf_path: str) -> Iterator[str]:
+    doc = fitz.open(pdf_path)
+    try:
+        for page in doc:
+            yield page.get_text()
+    finally:
+        doc.close()
+
+def _iter_page_texts_parallel(pdf_path: str, page_count: int, max_workers: int) -> Iterator[str]:
+    ranges = iter([(start, min(start + PAGES_PER_TASK, page_count))
+                   for start in range(0, page_count, PAGES_PER_TASK)])
+    # 'spawn' avoids forking a process that already holds torch/threads.
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=get_context("spawn")) as pool:
+        # Only a small window of ranges is in flight, so finished pages never
+        # pile up faster than the consumer reads them.
+        pending = deque(pool.submit(_extract_page_range, pdf_path, start, stop)
+                        for start, stop in islice(ranges, max_workers * 2))
+        while pending:
+            texts = pending.popleft().result()
+            next_range = next(ranges, None)
+            if next_range is not None:
+                pending.append(pool.submit(_extract_page_range, pdf_path, *next_range))
+            yield from texts
+
+def get_page_count(pdf_path: str) -> int:
+    """Returns the number of pages without extracting any text."""
+    with fitz.open(pdf_path) as doc:
+        return doc.page_count
+
+def iter_pdf_pages(pdf_path: str, offset_map: Optional[PageOffsetMap] = None,
+                   max_workers: Optional[int] = None) -> Iterator[PageText]:
+    """
+    Streams a PDF page by page, in order. Large documents are extracted by a
+    process pool; pages are yielded as soon as their batch is ready so that
+    callers can start chunking before extraction finishes.
+    """
+    page_count = get_page_count(pdf_path)
+    if max_workers is None:
+        max_workers = min(4, os.cpu_count() or 1)
+
+    if page_count >= PARALLEL_PAGE_THRESHOLD and max_workers > 1:
+        page_texts = _iter_page_texts_parallel(pdf_path, page_count, max_workers)
+    else:
+        page_texts = _iter_page_texts_serial(pdf_path)
+
+    char_start = 0
+    for index, text in enumerate(page_texts):
+        page_number = index + 1
+        if offset_map is not None:
+            char_start = offset_map.add_page(page_number, text)
+        yield PageText(page_number, char_start, text)
+        if offset_map is None:
+            char_start += len(text)
+
+def extract_text_from_pdf(pdf_path: str) -> str:
+    """Extracts all text from a given PDF file."""
+    return "".join(page.text for page in iter_pdf_pages(pdf_path))
@@ -0,0 +1,155 @@
+# resources.py
+# The long-lived clients of the web app: MongoDB, Gemini and the vector
+# store. Each is created once per process and reused (their connection pools
+# persist across requests), every call has a timeout so a dependency that is
+# down fails fast, and the lifespan of main.py probes them on startup and
+# closes them on shutdown. Client libraries are imported on first use, so
+# importing this module (and main.py) stays fast.
+
+# --- 1. Imports ---
+import os
+import time
+import asyncio
+import threading
+from typing import Dict, Optional, Sequence
+
+from vector_store import VectorStore, aclose_vector_stores, get_vector_store
+
+GEMINI_MODEL_NAME = os.getenv("GEMINI_MODEL_NAME", "gemini-pro-latest")
+# Seconds before a Gemini request is abandoned.
+GEMINI_TIMEOUT = float(os.getenv("GEMINI_TIMEOUT", "60"))
+GEMINI_REQUEST_OPTIONS = {"timeout": GEMINI_TIMEOUT}
+# The Gemini probe is a real API call, so its result is reused for this long.
+GEMINI_PROBE_INTERVAL = float(os.getenv("GEMINI_PROBE_INTERVAL", "60"))
+
+MONGO_DB_NAME = "socratic_tutor_db"
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "50"))
+# Finding a server and opening a connection; the default (30s) would park
+# a worker for half a minute while MongoDB is down.
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "3000"))
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "10000"))
+
+# Each readiness probe gets this long before the dependency counts as down.
+PROBE_TIMEOUT = float(os.getenv("PROBE_TIMEOUT", "2"))
+
+# --- 2. The Resources Class ---
+class Resources:
+    """Creates each client on first use and hands out the same one afterwards."""
+    def __init__(self, mongo_uri: Optional[str] = None, api_key: Optional[str] = None):
+        self.mongo_uri = mongo_uri or os.getenv("MONGODB_URI")
+        self.api_key = api_key or os.getenv("GOOGLE_API_KEY")
+        self._lock = threading.Lock()
+        self._mongo_client = None
+        self._models: Dict[str, object] = {}
+        self._gemini_configured = False
+        self._gemini_probe: Optional[tuple] = None  # (checked_at, result)
+
+    # --- Clients ---
+    def mongo_client(self):
+        with self._lock:
+            if self._mongo_client is None:
+                if not self.mongo_uri:
+                    raise ValueError("MONGODB_URI not found in .env file!")
+                from pymongo import MongoClient
+                # The client keeps its own connection pool and connects lazily,
+                # so creating it does not wait for the server.
+                self._mongo_client = MongoClient(
+                    self.mongo_uri, maxPoolSize=MONGO_MAX_POOL_SIZE,
+                    serverSelectionTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+                    connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS, socketTimeoutMS=MONGO_SOCKET_TIMEOUT_MS,
+                )
+            return self._mongo_client
+
+    def mongo_db(self, name: str = MONGO_DB_NAME):
+        return self.mongo_client()[name]
+
+    def use_api_key(self, api_key: Optional[str]):
+        """Replaces the Gemini key from the environment; applied when Gemini is first used."""
+        with self._lock:
+            if api_key and api_key != self.api_key:
+                self.api_key, self._gemini_configured = api_key, False
+
+    def configure_gemini(self):
+        """Configures the Gemini SDK once."""
+        with self._lock:
+            if not self._gemini_configured:
+                if not self.api_key:
+                    raise ValueError("GOOGLE_API_KEY not found in .env file!")
+                import google.generativeai as genai
+                genai.configure(api_key=self.api_key)
+                self._gemini_configured = True
+
+    def gemini_model(self, name: str = GEMINI_MODEL_NAME):
+        """A shared GenerativeModel; pass GEMINI_REQUEST_OPTIONS to its calls for the timeout."""
+        self.configure_gemini()
+        with self._lock:
+            model = self._models.get(name)
+            if model is None:
+                import google.generativeai as genai
+                model = self._models[name] = genai.GenerativeModel(name)
+            return model
+
+    def vector_store(self, collection_name: str = "socratic_collection") -> VectorStore:
+        return get_vector_store(collection_name)
+
+    # --- Readiness Probes ---
+    def _ping_mongo(self):
+        self.mongo_client().admin.command("ping")
+
+    def _ping_gemini(self):
+        self.configure_gemini()
+        checked = self._gemini_probe
+        if checked is not None and time.monotonic() - checked[0] < GEMINI_PROBE_INTERVAL:
+            if checked[1] is not None:
+                raise RuntimeError(checked[1])
+            return
+        import google.generativeai as genai
+        try:
+            genai.get_model(f"models/{GEMINI_MODEL_NAME}", request_options={"timeout": PROBE_TIMEOUT})
+        except Exception as e:
+            self._gemini_probe = (time.monotonic(), str(e))
+            raise
+        self._gemini_probe = (time.monotonic(), None)
+
+    async def probe(self, names: Optional[Sequence[str]] = None) -> Dict[str, dict]:
+        """Checks the dependencies (all, or those named) concurrently: {name: {"ok", "ms", "error"?}}."""
+        checks = {"mongo": self._ping_mongo, "vector_store": lambda: self.vector_store().ping(),
+                  "gemini": self._ping_gemini}
+        if names is not None:
+            checks = {name: checks[name] for name in names}
+
+        async def run(check) -> dict:
+            start = time.perf_counter()
+            try:
+                # In a thread, so a hanging client cannot block the event loop.
+                await asyncio.wait_for(asyncio.to_thread(check), PROBE_TIMEOUT)
+                result = {"ok": True}
+            except asyncio.TimeoutError:
+                result = {"ok": False, "error": f"no answer within {PROBE_TIMEOUT}s"}
+            except Exception as e:
+                result = {"ok": False, "error": str(e)}
+            result["ms"] = round((time.perf_counter() - start) * 1000, 1)
+            return result
+
+        results = await asyncio.gather(*(run(check) for check in checks.values()))
+        return dict(zip(checks, results))
+
+    # --- Shutdown ---
+    async def aclose(self):
+        await aclose_vector_stores()
+        with self._lock:
+            client, self._mongo_client = self._mongo_client, None
+            self._models.clear()
+        if client is not None:
+            client.close()
+
+_resources: Optional[Resources] = None
+_resources_lock = threading.Lock()
+
+def get_resources() -> Resources:
+    """Returns the process-wide Resources."""
+    global _resources
+    with _resources_lock:
+        if _resources is None:
+            _resources = Resources()
+        return _resources
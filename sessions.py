@@ -0,0 +1,193 @@
+# sessions.py
+# Server-side chat sessions. The browser only keeps a session ID (cookie);
+# the conversation lives here, and older turns are folded into a rolling
+# summary so the history sent to the LLM stays within a fixed token budget.
+
+# --- 1. Imports ---
+import os
+import json
+import uuid
+import asyncio
+import datetime
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field, asdict
+from typing import Awaitable, Callable, List, Optional, Set
+
+from config import data_dir
+from metrics import log
+from tokens import estimate_tokens
+
+MAX_SESSIONS = int(os.getenv("MAX_SESSIONS", "10000"))
+# Sessions are mirrored to tutor_data/sessions when enabled, so they survive restarts.
+PERSIST_SESSIONS = os.getenv("PERSIST_SESSIONS", "0") == "1"
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "1200"))
+# Most recent turns always kept verbatim.
+MIN_RECENT_TURNS = 2
+# Fallback summary length (characters) when the LLM summarizer fails.
+FALLBACK_SUMMARY_CHARS = 1200
+
+Summarizer = Callable[[str, List[dict]], Awaitable[str]]
+
+# --- 2. The ChatSession Record ---
+@dataclass
+class ChatSession:
+    id: str
+    document_source: str
+    summary: str = ""
+    turns: List[dict] = field(default_factory=list)  # [{"user": ..., "bot": ...}, ...]
+    turn_count: int = 0  # all turns ever, including summarized ones
+    created_at: str = field(default_factory=lambda: datetime.datetime.now().isoformat())
+    updated_at: Optional[str] = None
+
+    def history_tokens(self) -> int:
+        return estimate_tokens(self.summary) + sum(
+            estimate_tokens(turn.get("user", "")) + estimate_tokens(turn.get("bot", "")) for turn in self.turns)
+
+def fit_history(turns: List[dict], summary: str = "", token_budget: int = HISTORY_TOKEN_BUDGET) -> List[dict]:
+    """
+    The most recent turns that fit in the budget next to the summary (at
+    least the last one). Compaction only runs after a reply, so a burst of
+    long turns can be over budget when the next prompt is built.
+    """
+    remaining = token_budget - estimate_tokens(summary)
+    kept = 0
+    for turn in reversed(turns):
+        remaining -= estimate_tokens(turn.get("user", "")) + estimate_tokens(turn.get("bot", ""))
+        if remaining < 0 and kept:
+            break
+        kept += 1
+    return turns[len(turns) - kept:]
+
+# --- 3. The SessionStore Class ---
+class SessionStore:
+    def __init__(self, summarizer: Optional[Summarizer] = None, max_sessions: int = MAX_SESSIONS,
+                 token_budget: int = HISTORY_TOKEN_BUDGET, persist: bool = PERSIST_SESSIONS):
+        self.summarizer = summarizer
+        self.max_sessions = max_sessions
+        self.token_budget = token_budget
+        self.folder = data_dir("sessions") if persist else None
+        self._sessions: "OrderedDict[str, ChatSession]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._compacting: Set[str] = set()
+        self._background_tasks: Set[asyncio.Task] = set()
+        self.compactions = 0
+
+    # --- Persistence ---
+    def _path(self, session_id: str) -> str:
+        return os.path.join(self.folder, session_id + ".json")
+
+    def _save(self, session: ChatSession):
+        if not self.folder:
+            return
+        tmp_path = self._path(session.id) + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(asdict(session), f)
+        os.replace(tmp_path, self._path(session.id))
+
+    def _load(self, session_id: str) -> Optional[ChatSession]:
+        if not self.folder or not session_id.isalnum() or not os.path.exists(self._path(session_id)):
+            return None
+        with open(self._path(session_id), "r", encoding="utf-8") as f:
+            return ChatSession(**json.load(f))
+
+    # --- Lookup ---
+    def get_or_create(self, session_id: Optional[str], document_source: str) -> ChatSession:
+        """
+        Returns the caller's session, or a new one if the ID is unknown.
+        Switching documents starts a fresh conversation under the same ID.
+        """
+        with self._lock:
+            session = self._sessions.get(session_id) if session_id else None
+            if session is None and session_id:
+                session = self._load(session_id)
+            if session is None:
+                session = ChatSession(id=uuid.uuid4().hex, document_source=document_source)
+            elif session.document_source != document_source:
+                session = ChatSession(id=session.id, document_source=document_source)
+            self._sessions[session.id] = session
+            self._sessions.move_to_end(session.id)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+            return session
+
+    def seed_history(self, session: ChatSession, history: List[dict]):
+        """Imports history sent by an older client into a fresh session."""
+        if session.turns or session.summary or not history:
+            return
+        turn: dict = {}
+        for msg in history:
+            if 'user' in msg and turn:
+                session.turns.append(turn)
+                turn = {}
+            turn.update({key: msg[key] for key in ('user', 'bot') if key in msg})
+        if turn:
+            session.turns.append(turn)
+        session.turn_count = len(session.turns)
+
+    def append_turn(self, session: ChatSession, user_message: str, bot_response: str):
+        """Records a finished turn and schedules compaction if the history is over budget."""
+        with self._lock:
+            session.turns.append({"user": user_message, "bot": bot_response})
+            session.turn_count += 1
+            session.updated_at = datetime.datetime.now().isoformat()
+            self._save(session)
+            # Marked here, not when the task starts, so turns appended before
+            # it runs do not schedule a second compaction of the same turns.
+            compact = session.history_tokens() > self.token_budget and session.id not in self._compacting
+            if compact:
+                self._compacting.add(session.id)
+        if compact:
+            # Compaction calls the LLM, so it runs after the reply has been sent.
+            task = asyncio.get_running_loop().create_task(self.compact(session))
+            self._background_tasks.add(task)
+            task.add_done_callback(self._background_tasks.discard)
+
+    def end(self, session_id: Optional[str]):
+        """Forgets a conversation (the student started a new one)."""
+        if not session_id:
+            return
+        with self._lock:
+            self._sessions.pop(session_id, None)
+            if self.folder and session_id.isalnum() and os.path.exists(self._path(session_id)):
+                os.remove(self._path(session_id))
+
+    # --- Compaction ---
+    async def compact(self, session: ChatSession):
+        """Folds the oldest turns into the rolling summary until half the budget is left."""
+        try:
+            with self._lock:
+                self._compacting.add(session.id)  # already set when scheduled by append_turn
+                keep = len(session.turns)
+                tokens = session.history_tokens()
+                while keep > MIN_RECENT_TURNS and tokens > self.token_budget // 2:
+                    oldest = session.turns[len(session.turns) - keep]
+                    tokens -= estimate_tokens(oldest.get("user", "")) + estimate_tokens(oldest.get("bot", ""))
+                    keep -= 1
+                folded = session.turns[:len(session.turns) - keep]
+                previous_summary = session.summary
+            if not folded:
+                return
+            summary = None
+            if self.summarizer is not None:
+                try:
+                    summary = await self.summarizer(previous_summary, folded)
+                except Exception as e:
+                    log(f"!!! History summarization failed, using a plain digest: {e}")
+            if not summary:
+                questions = "; ".join(turn.get("user", "") for turn in folded)
+                summary = f"{previous_summary} Earlier the student asked: {questions}".strip()
+            with self._lock:
+                # The head is kept: it holds the earlier summary, which
+                # already covers everything before these turns.
+                session.summary = summary[:FALLBACK_SUMMARY_CHARS]
+                # Turns appended while we were summarizing are kept.
+                session.turns = session.turns[len(folded):]
+                self.compactions += 1
+                self._save(session)
+        finally:
+            self._compacting.discard(session.id)
+
+    def stats(self) -> dict:
+        return {"sessions": len(self._sessions), "compactions": self.compactions,
+                "token_budget": self.token_budget, "persisted": bool(self.folder)}
@@ -0,0 +1,148 @@
+# sparse_index.py
+# A per-document BM25 index over the chunks, used next to dense retrieval
+# to catch lexical matches the embedding model misses (section numbers,
+# exact legal terms). Built during ingestion and stored as one compressed
+# .npz per document: a sorted vocabulary plus postings in CSR form.
+
+# --- 1. Imports ---
+import os
+import re
+import math
+import urllib.parse
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from caching import LRUCache
+from config import data_dir
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Loaded indexes kept in memory.
+SPARSE_INDEX_CACHE_SIZE = int(os.getenv("SPARSE_INDEX_CACHE_SIZE", "64"))
+
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+_STOPWORDS = frozenset("""
+a an and are as at be by can do does for from has have how i if in into is it its of on or
+shall that the their there these this to was what when where which who why will with would you your
+""".split())
+
+# --- 2. Tokenization ---
+def _stem(token: str) -> str:
+    """A very light suffix stripper: "speeding", "speeds" and "speed" all match."""
+    if token.isdigit():
+        return token
+    if token.endswith("ies") and len(token) > 4:
+        token = token[:-3] + "y"
+    elif token.endswith("s") and not token.endswith("ss") and len(token) > 3:
+        token = token[:-1]
+    # Applied repeatedly so the stem of "speed" is also the stem of "speeding".
+    while True:
+        for suffix in ("ing", "ed"):
+            if token.endswith(suffix) and len(token) - len(suffix) >= 3:
+                token = token[:-len(suffix)]
+                break
+        else:
+            return token
+
+def tokenize(text: str) -> List[str]:
+    return [_stem(token) for token in _TOKEN_PATTERN.findall(text.lower()) if token not in _STOPWORDS]
+
+# --- 3. Building ---
+class SparseIndexBuilder:
+    """Collects chunks during ingestion; save() writes the finished index."""
+    def __init__(self):
+        self.point_ids: List[str] = []
+        self.doc_lengths: List[int] = []
+        self.postings: Dict[str, List[Tuple[int, int]]] = {}
+
+    def add(self, point_id: str, text: str):
+        doc = len(self.point_ids)
+        tokens = tokenize(text)
+        self.point_ids.append(point_id)
+        self.doc_lengths.append(len(tokens))
+        for term, tf in Counter(tokens).items():
+            self.postings.setdefault(term, []).append((doc, tf))
+
+    def save(self, source: str):
+        vocab = sorted(self.postings)
+        offsets = np.zeros(len(vocab) + 1, dtype=np.int64)
+        docs, tfs = [], []
+        for i, term in enumerate(vocab):
+            postings = self.postings[term]
+            offsets[i + 1] = offsets[i] + len(postings)
+            docs.extend(doc for doc, _ in postings)
+            tfs.extend(tf for _, tf in postings)
+        path = _index_path(source)
+        tmp_path = path + ".tmp.npz"
+        np.savez_compressed(
+            tmp_path,
+            vocab=np.array(vocab, dtype=str), offsets=offsets,
+            docs=np.array(docs, dtype=np.int32), tfs=np.array(tfs, dtype=np.uint16),
+            doc_lengths=np.array(self.doc_lengths, dtype=np.int32),
+            point_ids=np.array(self.point_ids, dtype=str),
+        )
+        os.replace(tmp_path, path)
+        print(f"  - BM25 index: {len(self.point_ids)} chunks, {len(vocab)} terms.")
+
+def _index_path(source: str) -> str:
+    return os.path.join(data_dir("sparse"), urllib.parse.quote(source, safe="") + ".npz")
+
+# --- 4. Searching ---
+class SparseIndex:
+    def __init__(self, arrays):
+        self.vocab = arrays["vocab"]
+        self.offsets = arrays["offsets"]
+        self.docs = arrays["docs"]
+        self.tfs = arrays["tfs"].astype(np.float32)
+        self.point_ids = arrays["point_ids"]
+        doc_lengths = arrays["doc_lengths"].astype(np.float32)
+        average = float(doc_lengths.mean()) if len(doc_lengths) else 0.0
+        # The length part of the BM25 denominator, per chunk.
+        self.length_norm = BM25_K1 * (1 - BM25_B + BM25_B * doc_lengths / average) if average else doc_lengths
+
+    def _term_range(self, term: str) -> Optional[Tuple[int, int]]:
+        position = int(np.searchsorted(self.vocab, term))
+        if position < len(self.vocab) and self.vocab[position] == term:
+            return int(self.offsets[position]), int(self.offsets[position + 1])
+        return None
+
+    def search(self, query: str, limit: int) -> List[Tuple[str, float]]:
+        """Returns up to `limit` (point_id, bm25_score) pairs, best first."""
+        count = len(self.point_ids)
+        if not count or limit <= 0:
+            return []
+        scores = np.zeros(count, dtype=np.float32)
+        for term in set(tokenize(query)):
+            term_range = self._term_range(term)
+            if term_range is None:
+                continue
+            start, end = term_range
+            docs, tfs = self.docs[start:end], self.tfs[start:end]
+            idf = math.log(1 + (count - (end - start) + 0.5) / ((end - start) + 0.5))
+            scores[docs] += idf * tfs * (BM25_K1 + 1) / (tfs + self.length_norm[docs])
+        matched = np.flatnonzero(scores)
+        if not len(matched):
+            return []
+        if len(matched) > limit:
+            matched = matched[np.argpartition(-scores[matched], limit - 1)[:limit]]
+        matched = matched[np.argsort(-scores[matched])]
+        return [(str(self.point_ids[doc]), float(scores[doc])) for doc in matched]
+
+_loaded = LRUCache(SPARSE_INDEX_CACHE_SIZE)
+
+def load_sparse_index(source: str) -> Optional[SparseIndex]:
+    """Returns the document's index, or None if it was ingested before BM25 indexes existed."""
+    path = _index_path(source)
+    if not os.path.exists(path):
+        return None
+    # Keyed by modification time, so a re-ingested document is reloaded.
+    key = (source, os.path.getmtime(path))
+    index = _loaded.get(key)
+    if index is None:
+        with np.load(path) as arrays:
+            index = SparseIndex({name: arrays[name] for name in arrays.files})
+        _loaded.invalidate_where(lambda cached_key: cached_key[0] == source)
+        _loaded.put(key, index)
+    return index
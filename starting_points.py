@@ -0,0 +1,262 @@
+# starting_points.py
+# Welcome topics and suggested questions for a document. They are generated
+# once per version of the document (as the last ingestion stage) and stored
+# next to it, so the chat page can fetch them instantly.
+
+# --- 1. Imports ---
+import os
+import json
+import asyncio
+import hashlib
+import datetime
+import urllib.parse
+from typing import Dict, List, Optional, Tuple
+
+from chunking import iter_chunks
+from config import data_dir
+from manifests import chunk_hash
+from pdf_extraction import PageOffsetMap, iter_pdf_pages
+from resources import get_resources
+
+FALLBACK_STARTING_POINTS = {"topics": "General discussion", "questions": []}
+
+# --- 2. Map-reduce Generation ---
+# The document is summarized group by group (map), then the partial
+# summaries are merged into topics and questions (reduce). Every part of
+# the document is covered and each LLM call has a bounded prompt size.
+MAP_GROUP_CHARS = int(os.getenv("SUMMARY_GROUP_CHARS", "24000"))
+MAP_CONCURRENCY = int(os.getenv("SUMMARY_CONCURRENCY", "4"))
+SUMMARY_REQUESTS_PER_MINUTE = int(os.getenv("SUMMARY_REQUESTS_PER_MINUTE", "60"))
+# Partial summaries merged in one reduce call; more are merged in rounds.
+REDUCE_MAX_CHARS = 30000
+MAP_TIMEOUT_SECONDS = 120
+REDUCE_TIMEOUT_SECONDS = 300
+
+class RateLimiter:
+    """Spaces out request start times to at most `per_minute` per minute."""
+    def __init__(self, per_minute: int):
+        self.interval = 60.0 / per_minute if per_minute > 0 else 0.0
+        self._next_slot = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        async with self._lock:
+            loop = asyncio.get_running_loop()
+            delay = self._next_slot - loop.time()
+            self._next_slot = max(loop.time(), self._next_slot) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+def _collect_groups(pdf_path: str) -> List[Tuple[str, str]]:
+    """Re-chunks the PDF (no embedding) and groups chunks; returns (group_hash, text) pairs."""
+    offset_map = PageOffsetMap()
+    groups, texts, hashes, size = [], [], [], 0
+
+    def close_group():
+        group_hash = hashlib.sha256("".join(hashes).encode("ascii")).hexdigest()
+        groups.append((group_hash, "\n\n".join(texts)))
+
+    for chunk in iter_chunks(iter_pdf_pages(pdf_path, offset_map), offset_map):
+        if texts and size + len(chunk.text) > MAP_GROUP_CHARS:
+            close_group()
+            texts, hashes, size = [], [], 0
+        content_hash = chunk_hash(chunk.text)
+        texts.append(chunk.text)
+        hashes.append(content_hash)
+        size += len(chunk.text)
+        # Boundaries are content-defined (about 1 chunk in 8 may end a group
+        # once it is half full), so an edit early in the document only
+        # changes nearby groups and the rest keep their cached summaries.
+        if size >= MAP_GROUP_CHARS // 2 and int(content_hash[:4], 16) % 8 == 0:
+            close_group()
+            texts, hashes, size = [], [], 0
+    if texts:
+        close_group()
+    return groups
+
+def _summary_path(group_hash: str) -> str:
+    return os.path.join(data_dir("summaries"), group_hash + ".json")
+
+def _load_summary(group_hash: str) -> Optional[str]:
+    path = _summary_path(group_hash)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)["summary"]
+
+def _save_summary(group_hash: str, summary: str):
+    path = _summary_path(group_hash)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"summary": summary}, f)
+    os.replace(tmp_path, path)
+
+def _build_map_prompt(text: str) -> str:
+    return f"""
+    The following is one section of a longer course document.
+    List the main topics it covers as 3-5 short bullet points, then write one
+    open-ended question a student might have about it.
+    SECTION TEXT: "{text}"
+    ---
+    Keep the whole answer under 120 words.
+    """
+
+def _build_reduce_prompt(summaries: List[str], final: bool) -> str:
+    joined = "\n---\n".join(summaries)
+    if not final:
+        return f"""
+    The following are summaries of consecutive sections of a course document.
+    Merge them into a single summary of at most 8 bullet points and 3 questions.
+    SECTION SUMMARIES: "{joined}"
+    """
+    return f"""
+    The following are summaries of every section of a course document, in order.
+    Based on them, please do two things:
+    1. Summarize the top 5-7 main topics of the whole document. Present this as a simple, comma-separated list.
+    2. Generate 3 open-ended, engaging questions a student might have about this document.
+    SECTION SUMMARIES: "{joined}"
+    ---
+    Provide your response in a structured format. Example:
+    TOPICS: Topic A, Topic B, Topic C
+    QUESTIONS:
+    1. What is the significance of [Concept X]?
+    2. How does [Event Y] affect [Outcome Z]?
+    3. Can you explain the process of [Mechanism W]?
+    """
+
+def _parse_response(text: str) -> dict:
+    topics_line = next((line for line in text.split('\n') if line.startswith("TOPICS:")), "TOPICS: General Information")
+    questions_section = text.split("QUESTIONS:")[-1]
+    topics = topics_line.replace("TOPICS:", "").strip()
+    questions = [q.strip().lstrip('0123456789. ') for q in questions_section.split('\n') if q.strip()]
+    return {"topics": topics, "questions": questions[:3]}
+
+async def _call_llm(model, prompt: str, limiter: RateLimiter, timeout: int, max_retries: int) -> Optional[str]:
+    for attempt in range(max_retries):
+        await limiter.wait()
+        try:
+            response = await model.generate_content_async(prompt, request_options={'timeout': timeout})
+            return response.text
+        except Exception as e:
+            print(f"--> Summary request attempt {attempt + 1}/{max_retries} failed: {e}")
+            if attempt < max_retries - 1:
+                wait_time = 10 * (attempt + 1)
+                print(f"    ...retrying in {wait_time} seconds...")
+                await asyncio.sleep(wait_time)
+    return None
+
+async def agenerate_starting_points(pdf_path: str, max_retries: int = 3) -> Optional[dict]:
+    """
+    Asks the LLM for topics and questions using map-reduce over the chunks.
+    Retries wait with asyncio.sleep, so the event loop keeps serving other
+    requests. Returns None on failure, including when any section could not
+    be summarized: topics from part of the document must not be stored as
+    final. Summaries that did succeed are cached, so the next attempt only
+    asks for the missing ones.
+    """
+    print(f"--- Generating starting points for {os.path.basename(pdf_path)} ---")
+    groups = await asyncio.to_thread(_collect_groups, pdf_path)
+    model = get_resources().gemini_model()
+    limiter = RateLimiter(SUMMARY_REQUESTS_PER_MINUTE)
+    semaphore = asyncio.Semaphore(MAP_CONCURRENCY)
+
+    async def summarize_group(group_hash: str, text: str) -> Optional[str]:
+        # Partial summaries are cached by content, so unchanged sections of a
+        # re-uploaded (or duplicated) document cost nothing.
+        cached = _load_summary(group_hash)
+        if cached is not None:
+            return cached
+        async with semaphore:
+            summary = await _call_llm(model, _build_map_prompt(text), limiter, MAP_TIMEOUT_SECONDS, max_retries)
+        if summary:
+            _save_summary(group_hash, summary)
+        return summary
+
+    summaries = await asyncio.gather(*(summarize_group(group_hash, text) for group_hash, text in groups))
+    done = sum(1 for summary in summaries if summary)
+    print(f"  - Summarized {done}/{len(groups)} sections.")
+    if not summaries or done < len(summaries):
+        return None
+
+    # Merge in rounds until the summaries fit in one final prompt.
+    while sum(len(summary) for summary in summaries) > REDUCE_MAX_CHARS and len(summaries) > 1:
+        batches, batch, size = [], [], 0
+        for summary in summaries:
+            if batch and size + len(summary) > REDUCE_MAX_CHARS:
+                batches.append(batch)
+                batch, size = [], 0
+            batch.append(summary)
+            size += len(summary)
+        batches.append(batch)
+
+        async def merge(batch: List[str]) -> Optional[str]:
+            async with semaphore:
+                return await _call_llm(model, _build_reduce_prompt(batch, final=False), limiter,
+                                       MAP_TIMEOUT_SECONDS, max_retries)
+        merged = await asyncio.gather(*(merge(batch) for batch in batches))
+        if not all(merged):
+            print("--> Could not merge the section summaries.")
+            return None
+        if len(merged) >= len(summaries):
+            break
+        summaries = merged
+
+    text = await _call_llm(model, _build_reduce_prompt(summaries, final=True), limiter,
+                           REDUCE_TIMEOUT_SECONDS, max_retries)
+    if text is None:
+        print("--> Max retries reached for starting points.")
+        return None
+    return _parse_response(text)
+
+# --- 3. Storage ---
+def _store_path(source: str) -> str:
+    return os.path.join(data_dir("starting_points"), urllib.parse.quote(source, safe="") + ".json")
+
+def load_starting_points(source: str, content_hash: Optional[str]) -> Optional[dict]:
+    """Returns stored starting points if they were made from this version of the document."""
+    path = _store_path(source)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        stored = json.load(f)
+    if stored.get("content_hash") != content_hash:
+        return None
+    return {"topics": stored["topics"], "questions": stored["questions"]}
+
+def save_starting_points(source: str, content_hash: Optional[str], starting_points: dict):
+    path = _store_path(source)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"source": source, "content_hash": content_hash,
+                   "generated_at": datetime.datetime.now().isoformat(), **starting_points}, f)
+    os.replace(tmp_path, path)
+
+# --- 4. Get-or-generate ---
+# One generation per (source, content_hash) at a time; later callers await it.
+_inflight: Dict[tuple, asyncio.Task] = {}
+
+async def aensure_starting_points(pdf_path: str, content_hash: Optional[str]) -> dict:
+    """
+    Returns the stored starting points for this document version, generating
+    and storing them first if needed. Falls back to a generic welcome (which
+    is not stored, so a later call tries again) if generation fails.
+    """
+    source = os.path.basename(pdf_path)
+    stored = load_starting_points(source, content_hash)
+    if stored is not None:
+        return stored
+
+    key = (source, content_hash)
+    task = _inflight.get(key)
+    if task is None:
+        async def generate():
+            try:
+                result = await agenerate_starting_points(pdf_path)
+                if result is not None:
+                    save_starting_points(source, content_hash, result)
+                return result
+            finally:
+                _inflight.pop(key, None)
+        task = _inflight[key] = asyncio.create_task(generate())
+    result = await asyncio.shield(task)
+    return result or dict(FALLBACK_STARTING_POINTS)
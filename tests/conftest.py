@@ -0,0 +1,17 @@
+# tests/conftest.py
+# The app modules live at the repository root; tests import them directly.
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+@pytest.fixture
+def data_root(tmp_path, monkeypatch):
+    """Points data_dir() at a temporary folder, so tests never touch tutor_data."""
+    pytest.importorskip("dotenv")
+    import config
+    monkeypatch.setattr(config, "DATA_DIR", str(tmp_path))
+    return tmp_path
@@ -0,0 +1,99 @@
+# tests/test_analytics.py
+import datetime
+
+import pytest
+
+np = pytest.importorskip("numpy")
+mongomock = pytest.importorskip("mongomock")
+pytest.importorskip("pymongo")
+
+import analytics
+import embeddings
+from analytics import AnalyticsStore
+
+# Questions about speed embed close together; the licence question does not.
+VECTORS = {
+    "What is the fine for speeding?": [1.0, 0.1, 0.0],
+    "How much is the speeding fine?": [0.95, 0.15, 0.0],
+    "Who issues a driving licence?": [0.0, 0.2, 1.0],
+}
+
+class FakeEmbeddingService:
+    calls = []
+
+    def encode(self, texts, background=False):
+        self.calls.append((list(texts), background))
+        return np.array([VECTORS[text] for text in texts], dtype=np.float32)
+
+@pytest.fixture
+def store(monkeypatch):
+    FakeEmbeddingService.calls = []
+    monkeypatch.setattr(embeddings, "get_embedding_service", lambda: FakeEmbeddingService())
+    return AnalyticsStore(mongomock.MongoClient()["tutor"])
+
+def turn(i: int, question: str, source: str = "a.pdf", unanswered: bool = False, hour: int = 10) -> dict:
+    return {"_id": f"turn-{i}", "session_id": "s1", "turn_index": i, "document_source": source,
+            "timestamp": datetime.datetime(2026, 1, 5, hour, 30).isoformat(),
+            "user_message": question, "bot_response": "reply", "unanswered": unanswered,
+            "chat_history": [{"user": "not stored"}]}
+
+TURNS = [
+    turn(1, "What is the fine for speeding?"),
+    turn(2, "How much is the speeding fine?", unanswered=True),
+    turn(3, "Who issues a driving licence?", hour=11),
+    turn(4, "Who issues a driving licence?", source="b.pdf"),
+]
+
+def test_turns_are_stored_once_without_history(store):
+    store.write_turns(TURNS)
+    stored = store.turns.find_one({"_id": "turn-1"})
+    assert "chat_history" not in stored
+    assert store.turns.count_documents({}) == 4
+
+def test_rollups_count_turns_per_hour_and_document(store):
+    store.write_turns(TURNS)
+    hourly = {(row["source"], row["hour"]): (row["turns"], row["unanswered"]) for row in store.hourly.find()}
+    assert hourly == {("a.pdf", "2026-01-05T10:00"): (2, 1), ("a.pdf", "2026-01-05T11:00"): (1, 0),
+                      ("b.pdf", "2026-01-05T10:00"): (1, 0)}
+    totals = {row["document_source"]: (row["turns"], row["unanswered"]) for row in store.document_totals()}
+    assert totals == {"a.pdf": (3, 1), "b.pdf": (1, 0)}
+
+def test_similar_questions_share_a_cluster(store):
+    store.write_turns(TURNS)
+    clusters = {row["question"]: row["count"] for row in store.questions.find({"source": "a.pdf"})}
+    assert clusters == {"What is the fine for speeding?": 2, "Who issues a driving licence?": 1}
+
+def test_clusters_continue_after_a_restart(store):
+    store.write_turns(TURNS[:1])
+    restarted = AnalyticsStore(store.turns.database)
+    restarted.write_turns(TURNS[1:2])
+    assert [row["count"] for row in restarted.questions.find({"source": "a.pdf"})] == [2]
+
+def test_a_replayed_batch_is_counted_once(store):
+    store.write_turns(TURNS)
+    store.write_turns(TURNS)
+    assert store.turns.count_documents({}) == 4
+    assert {row["_id"]: row["turns"] for row in store.documents.find()} == {"a.pdf": 3, "b.pdf": 1}
+    assert sum(row["count"] for row in store.questions.find()) == 4
+
+def test_a_replay_applies_the_rollup_that_failed(store, monkeypatch):
+    def unavailable():
+        raise RuntimeError("embedding service down")
+
+    monkeypatch.setattr(embeddings, "get_embedding_service", unavailable)
+    with pytest.raises(RuntimeError):
+        store.write_turns(TURNS)
+    assert store.questions.count_documents({}) == 0
+    monkeypatch.setattr(embeddings, "get_embedding_service", lambda: FakeEmbeddingService())
+    store.write_turns(TURNS)
+    assert sum(row["count"] for row in store.questions.find()) == 4
+    assert {row["_id"]: row["turns"] for row in store.documents.find()} == {"a.pdf": 3, "b.pdf": 1}
+
+def test_questions_embedded_for_retrieval_are_not_encoded_again(store):
+    records = [dict(record, question_vector=VECTORS[record["user_message"]]) for record in TURNS[:3]]
+    store.write_turns(records + TURNS[3:])
+    assert "question_vector" not in store.turns.find_one({"_id": "turn-1"})
+    # Only the turn without a vector is encoded, behind any chat queries.
+    assert FakeEmbeddingService.calls == [(["Who issues a driving licence?"], True)]
+    clusters = {row["question"]: row["count"] for row in store.questions.find({"source": "a.pdf"})}
+    assert clusters == {"What is the fine for speeding?": 2, "Who issues a driving licence?": 1}
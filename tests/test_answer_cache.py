@@ -0,0 +1,61 @@
+# tests/test_answer_cache.py
+import pytest
+
+np = pytest.importorskip("numpy")
+
+import answer_cache
+from answer_cache import SemanticAnswerCache
+
+QUESTION = [1.0, 0.0, 0.0]
+PARAPHRASE = [0.98, 0.2, 0.0]  # cosine ~0.98
+OTHER = [0.0, 1.0, 0.0]
+
+def test_paraphrase_with_same_chunks_is_a_hit():
+    cache = SemanticAnswerCache(similarity=0.9)
+    cache.store("a.pdf", QUESTION, ["c2", "c1"], 0, "What does the text say?")
+    assert cache.lookup("a.pdf", PARAPHRASE, ["c1", "c2"], 0) == "What does the text say?"
+    assert (cache.hits, cache.misses) == (1, 0)
+
+def test_different_question_misses():
+    cache = SemanticAnswerCache(similarity=0.9)
+    cache.store("a.pdf", QUESTION, ["c1"], 0, "reply")
+    assert cache.lookup("a.pdf", OTHER, ["c1"], 0) is None
+
+def test_other_chunks_depth_or_document_miss():
+    cache = SemanticAnswerCache(similarity=0.9, max_history_depth=2)
+    cache.store("a.pdf", QUESTION, ["c1"], 0, "reply")
+    assert cache.lookup("a.pdf", QUESTION, ["c9"], 0) is None
+    assert cache.lookup("a.pdf", QUESTION, ["c1"], 1) is None
+    assert cache.lookup("b.pdf", QUESTION, ["c1"], 0) is None
+
+def test_deep_conversations_are_not_cached():
+    cache = SemanticAnswerCache(max_history_depth=0)
+    cache.store("a.pdf", QUESTION, ["c1"], 1, "reply")
+    assert cache.stores == 0
+    assert cache.lookup("a.pdf", QUESTION, ["c1"], 1) is None
+
+def test_least_recently_used_answer_is_evicted():
+    cache = SemanticAnswerCache(similarity=0.99, max_entries_per_source=2)
+    cache.store("a.pdf", QUESTION, ["c1"], 0, "first")
+    cache.store("a.pdf", OTHER, ["c1"], 0, "second")
+    cache.lookup("a.pdf", QUESTION, ["c1"], 0)
+    cache.store("a.pdf", [0.0, 0.0, 1.0], ["c1"], 0, "third")
+    assert cache.lookup("a.pdf", OTHER, ["c1"], 0) is None
+    assert cache.lookup("a.pdf", QUESTION, ["c1"], 0) == "first"
+    assert cache.evictions == 1
+
+def test_answers_expire(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(answer_cache.time, "monotonic", lambda: now[0])
+    cache = SemanticAnswerCache(ttl_seconds=60)
+    cache.store("a.pdf", QUESTION, ["c1"], 0, "reply")
+    now[0] += 61
+    assert cache.lookup("a.pdf", QUESTION, ["c1"], 0) is None
+
+def test_invalidate_source_drops_its_answers():
+    cache = SemanticAnswerCache()
+    cache.store("a.pdf", QUESTION, ["c1"], 0, "a reply")
+    cache.store("b.pdf", QUESTION, ["c1"], 0, "b reply")
+    cache.invalidate_source("a.pdf")
+    assert cache.lookup("a.pdf", QUESTION, ["c1"], 0) is None
+    assert cache.lookup("b.pdf", QUESTION, ["c1"], 0) == "b reply"
@@ -0,0 +1,79 @@
+# tests/test_caching.py
+import pytest
+
+from caching import LRUCache, normalize_query
+
+def test_get_put_and_counters():
+    cache = LRUCache(max_entries=2)
+    assert cache.get("a") is None
+    cache.put("a", 1)
+    assert cache.get("a") == 1
+    assert cache.get("b", "default") == "default"
+    assert (cache.hits, cache.misses) == (1, 2)
+    assert cache.stats()["hit_rate"] == pytest.approx(1 / 3, abs=1e-3)
+
+def test_least_recently_used_entry_is_evicted():
+    cache = LRUCache(max_entries=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    cache.get("a")
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == (1, 3)
+    assert cache.evictions == 1
+
+def test_entries_expire_after_their_ttl(monkeypatch):
+    import caching
+
+    now = [100.0]
+    monkeypatch.setattr(caching.time, "monotonic", lambda: now[0])
+    cache = LRUCache(max_entries=2, ttl_seconds=10)
+    cache.put("a", 1)
+    now[0] += 9
+    assert cache.get("a") == 1
+    now[0] += 2
+    assert cache.get("a") is None
+    assert cache.stats()["entries"] == 0
+
+def test_invalidate_where_drops_matching_keys():
+    cache = LRUCache(max_entries=10)
+    cache.put(("a.pdf", "q1"), 1)
+    cache.put(("a.pdf", "q2"), 2)
+    cache.put(("b.pdf", "q1"), 3)
+    assert cache.invalidate_where(lambda key: key[0] == "a.pdf") == 2
+    assert cache.get(("b.pdf", "q1")) == 3
+    assert cache.invalidations == 2
+
+def test_normalize_query_ignores_case_and_spacing():
+    assert normalize_query("  What is  Section 183?\n") == normalize_query("what is section 183?")
+
+# --- Retrieval cache invalidation in SocraticTutor ---
+def make_tutor():
+    """A tutor with only its caches set up; no model, LLM or vector store."""
+    bot_logic = pytest.importorskip("bot_logic")
+    tutor = bot_logic.SocraticTutor.__new__(bot_logic.SocraticTutor)
+    tutor.query_embedding_cache = LRUCache(10)
+    tutor.retrieval_cache = LRUCache(10)
+    tutor._source_generations = {}
+    answer_cache = pytest.importorskip("answer_cache")
+    tutor.answer_cache = answer_cache.SemanticAnswerCache()
+    return tutor
+
+def test_reingest_invalidates_cached_retrievals_of_that_source_only():
+    tutor = make_tutor()
+    key = tutor._retrieval_key("What is X?", "a.pdf", 4)
+    other = tutor._retrieval_key("What is X?", "b.pdf", 4)
+    tutor.retrieval_cache.put(key, ["old hit"])
+    tutor.retrieval_cache.put(other, ["b hit"])
+    tutor.invalidate_source("a.pdf")
+    assert tutor.retrieval_cache.get(tutor._retrieval_key("What is X?", "a.pdf", 4)) is None
+    assert tutor.retrieval_cache.get(other) == ["b hit"]
+
+def test_search_in_flight_during_reingest_is_never_served():
+    tutor = make_tutor()
+    # Key taken before the re-ingest finished; the result is stored after it.
+    key = tutor._retrieval_key("What is X?", "a.pdf", 4)
+    tutor.invalidate_source("a.pdf")
+    tutor.retrieval_cache.put(key, ["stale hit"])
+    assert tutor._retrieval_key("What is X?", "a.pdf", 4) != key
+    assert tutor.retrieval_cache.get(tutor._retrieval_key("What is X?", "a.pdf", 4)) is None
@@ -0,0 +1,71 @@
+# tests/test_catalog.py
+import pytest
+
+pytest.importorskip("dotenv")
+
+from catalog import DocumentCatalog
+from manifests import DocumentManifest
+
+def test_every_change_gives_a_new_etag(data_root):
+    catalog = DocumentCatalog()
+    etag, sources = catalog.available_sources_with_etag()
+    assert sources == []
+    catalog.mark_processing("a.pdf")
+    processing_etag, sources = catalog.available_sources_with_etag()
+    assert processing_etag != etag and sources == []
+    catalog.mark_ready("a.pdf", chunk_count=3, content_hash="h1")
+    ready_etag, sources = catalog.available_sources_with_etag()
+    assert ready_etag != processing_etag and sources == ["a.pdf"]
+    # Nothing changed, so a revalidating client can be answered with 304.
+    assert catalog.available_sources_with_etag()[0] == ready_etag
+
+def test_entries_carry_ingestion_state(data_root):
+    catalog = DocumentCatalog()
+    catalog.mark_ready("a.pdf", chunk_count=3, content_hash="h1")
+    catalog.mark_processing("b.pdf")
+    catalog.mark_failed("b.pdf", "no text")
+    etag, entries = catalog.entries_with_etag()
+    assert etag == catalog.etag
+    assert [(entry["source"], entry["status"], entry["available"]) for entry in entries] == [
+        ("a.pdf", "ready", True), ("b.pdf", "failed", False)]
+    assert entries[1]["error"] == "no text"
+
+def test_re_ingesting_keeps_the_previous_version_available(data_root):
+    catalog = DocumentCatalog()
+    catalog.mark_ready("a.pdf", chunk_count=3, content_hash="h1")
+    catalog.mark_processing("a.pdf")
+    assert catalog.available_sources() == ["a.pdf"]
+
+def test_state_and_version_survive_a_restart(data_root):
+    catalog = DocumentCatalog()
+    catalog.mark_ready("a.pdf", chunk_count=3, content_hash="h1")
+    reloaded = DocumentCatalog()
+    assert reloaded.etag == catalog.etag
+    assert reloaded.get("a.pdf")["content_hash"] == "h1"
+
+def test_first_start_rebuilds_from_manifests(data_root):
+    DocumentManifest("old.pdf", {"p1": {"hash": "x"}, "p2": {"hash": "y"}}, content_hash="h").save()
+    catalog = DocumentCatalog()
+    assert catalog.available_sources() == ["old.pdf"]
+    assert catalog.get("old.pdf")["chunk_count"] == 2
+
+def test_seeding_adds_documents_only_in_the_store_once(data_root):
+    catalog = DocumentCatalog()
+    catalog.mark_ready("a.pdf", chunk_count=3, content_hash="h1")
+    assert not catalog.seeded
+    etag = catalog.etag
+    catalog.seed_from_store({"a.pdf": 99, "legacy.pdf": 7})
+    assert catalog.etag != etag
+    assert catalog.available_sources() == ["a.pdf", "legacy.pdf"]
+    assert catalog.get("a.pdf")["chunk_count"] == 3
+    assert catalog.get("legacy.pdf")["chunk_count"] == 7
+    assert DocumentCatalog().seeded
+
+def test_listeners_hear_about_finished_ingestions(data_root):
+    catalog = DocumentCatalog()
+    heard = []
+    catalog.add_listener(lambda source, entry: heard.append((source, entry["status"])))
+    catalog.mark_processing("a.pdf")
+    catalog.mark_ready("a.pdf", chunk_count=1, content_hash="h")
+    catalog.mark_failed("b.pdf", "boom")
+    assert heard == [("a.pdf", "ready"), ("b.pdf", "failed")]
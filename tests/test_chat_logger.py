@@ -0,0 +1,83 @@
+# tests/test_chat_logger.py
+import time
+
+import pytest
+
+pytest.importorskip("dotenv")
+
+from chat_logger import ChatTurnLogger
+
+def record(i: int) -> dict:
+    return {"_id": f"turn-{i}", "user_message": f"q{i}", "bot_response": f"a{i}"}
+
+class FlakySink:
+    def __init__(self, up: bool = True):
+        self.up = up
+        self.batches = []
+
+    def __call__(self, records):
+        if not self.up:
+            raise ConnectionError("backend down")
+        self.batches.append([r["_id"] for r in records])
+
+    @property
+    def written(self):
+        return [turn_id for batch in self.batches for turn_id in batch]
+
+def wait_for(condition, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+def make_logger(sink, **kwargs) -> ChatTurnLogger:
+    options = {"batch_size": 10, "flush_interval": 0.05, "retry_interval": 0.0}
+    options.update(kwargs)
+    return ChatTurnLogger(sink, **options)
+
+def test_turns_are_written_in_batches(data_root):
+    sink = FlakySink()
+    logger = make_logger(sink)
+    logger.start()
+    for i in range(25):
+        logger.log(record(i))
+    logger.stop()
+    assert sink.written == [f"turn-{i}" for i in range(25)]
+    assert all(len(batch) <= 10 for batch in sink.batches)
+    assert logger.counters["written"] == 25
+
+def test_failed_batches_are_spooled_and_replayed(data_root):
+    sink = FlakySink(up=False)
+    logger = make_logger(sink)
+    logger.start()
+    for i in range(5):
+        logger.log(record(i))
+    wait_for(lambda: logger.counters["spooled"] == 5)
+    sink.up = True
+    wait_for(lambda: logger.counters["replayed"] == 5)
+    logger.stop()
+    assert sorted(sink.written) == [f"turn-{i}" for i in range(5)]
+    assert logger.stats()["spool_segments"] == 0
+
+def test_spool_left_at_shutdown_is_replayed_by_the_next_process(data_root):
+    down = FlakySink(up=False)
+    logger = make_logger(down, retry_interval=60)
+    logger.start()
+    logger.log(record(1))
+    logger.stop()
+    assert logger.stats()["spool_segments"] == 1
+
+    sink = FlakySink()
+    restarted = make_logger(sink)
+    restarted.start()
+    wait_for(lambda: restarted.counters["replayed"] == 1)
+    restarted.stop()
+    assert sink.written == ["turn-1"]
+
+def test_full_queue_spills_to_the_spool(data_root):
+    logger = make_logger(FlakySink(), max_queue=2)  # not started, so nothing drains
+    for i in range(3):
+        logger.log(record(i))
+    assert logger.counters["overflowed"] == 1
+    assert logger.counters["spooled"] == 1
+    logger.stop()
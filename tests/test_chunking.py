@@ -0,0 +1,93 @@
+# tests/test_chunking.py
+import pytest
+
+pytest.importorskip("langchain.text_splitter")
+pytest.importorskip("fitz")
+pytest.importorskip("dotenv")
+
+from chunking import MIN_SEGMENT_CHARS, DocumentStructure, SectionIndexBuilder, iter_chunks, load_section_index
+from pdf_extraction import PageOffsetMap, PageText
+
+def filler(words: int) -> str:
+    return " ".join(f"word{i}" for i in range(words)) + "\n"
+
+STATUTE_PAGES = [
+    "CHAPTER I\nPRELIMINARY\n"
+    "1. Short title and commencement.—(1) " + filler(150)
+    + "2. Definitions.—In this Act, " + filler(300),
+    "CHAPTER II\nLICENSING OF DRIVERS\n"
+    "3. Necessity for driving licence.—(1) " + filler(150)
+    + "CHAPTER III\nOFFENCES\n"
+    "4. Driving at excessive speed.—Whoever " + filler(150),
+]
+
+def chunk_pages(pages, **kwargs):
+    offset_map = PageOffsetMap()
+    page_texts = [PageText(number, offset_map.add_page(number, text), text)
+                  for number, text in enumerate(pages, start=1)]
+    structure = DocumentStructure()
+    return list(iter_chunks(page_texts, offset_map, structure=structure, **kwargs)), structure
+
+def heading_positions(pages, labels):
+    document = "".join(pages)
+    return {label: document.index(label) for label in labels}
+
+def test_statute_chunks_stay_inside_their_section():
+    chunks, structure = chunk_pages(STATUTE_PAGES)
+    assert structure.is_statute
+    sections = heading_positions(STATUTE_PAGES, ["1. Short", "2. Definitions", "3. Necessity", "4. Driving"])
+    starts = {label.split(".")[0]: position for label, position in sections.items()}
+    assert {chunk.section for chunk in chunks} == {"1", "2", "3", "4"}
+    for chunk in chunks:
+        end = chunk.char_start + len(chunk.text)
+        # Section 1 follows its chapter heading too closely to start a chunk of its own.
+        assert not any(chunk.char_start < position < end for label, position in starts.items() if label != "1")
+        # A chunk that opens with a chapter heading belongs to the section right after it.
+        assert starts[chunk.section] <= chunk.char_start + MIN_SEGMENT_CHARS
+
+def test_statute_chunks_carry_chapter_title_and_page():
+    chunks, _ = chunk_pages(STATUTE_PAGES)
+    first = next(chunk for chunk in chunks if chunk.section == "3")
+    assert first.chapter == "CHAPTER II"
+    assert first.section_title == "Necessity for driving licence"
+    assert first.page_number == 2
+    assert next(chunk for chunk in chunks if chunk.section == "4").chapter == "CHAPTER III"
+
+def test_small_windows_give_the_same_sections():
+    # The statute is recognised in the first window thanks to its table of contents.
+    pages = ["CHAPTER I\nPRELIMINARY\nCHAPTER II\nLICENSING OF DRIVERS\nCHAPTER III\nOFFENCES\n"] + STATUTE_PAGES
+    chunks, _ = chunk_pages(pages)
+    windowed, _ = chunk_pages(pages, window_chars=500)
+    assert [chunk.section for chunk in windowed][-1] == chunks[-1].section == "4"
+    assert {chunk.section for chunk in windowed} == {chunk.section for chunk in chunks}
+
+def test_numbered_lists_in_ordinary_documents_are_not_sections():
+    pages = ["1. Introduction\n" + filler(200) + "2. Background\n" + filler(200) + "3. Method\n" + filler(200)]
+    chunks, structure = chunk_pages(pages)
+    assert not structure.is_statute
+    assert chunks and all(chunk.section is None for chunk in chunks)
+    assert "".join(chunk.text for chunk in chunks).count("word199") >= 3
+
+def test_sections_seen_before_the_statute_is_recognised_are_kept(data_root):
+    # No statute markers in the first window: sections 1 and 2 are held
+    # back until the CHAPTER headings on the second page are seen.
+    pages = ["1. Short title and commencement.—(1) " + filler(150)
+             + "2. Definitions.—In this Act, " + filler(300),
+             "CHAPTER II\nLICENSING OF DRIVERS\n"
+             "3. Necessity for driving licence.—(1) " + filler(150)
+             + "CHAPTER III\nOFFENCES\n"
+             "4. Driving at excessive speed.—Whoever " + filler(150)
+             + "CHAPTER IV\nPENALTIES\n"
+             "5. Penalty for speeding.—Whoever " + filler(150)]
+    chunks, structure = chunk_pages(pages, window_chars=500)
+    assert structure.is_statute
+    assert [heading.label for heading in structure.headings if heading.kind == "section"] == ["1", "2", "3", "4", "5"]
+    assert structure.positions_between(-1, len("".join(pages))) == [heading.position for heading in structure.headings]
+    assert next(chunk for chunk in chunks if chunk.section == "5").chapter == "CHAPTER IV"
+    builder = SectionIndexBuilder()
+    for chunk in chunks:
+        builder.add(f"p{chunk.index}", chunk)
+    builder.save("late.pdf", structure)
+    sections = load_section_index("late.pdf")
+    assert sections["2"]["title"] == "Definitions"
+    assert sections["1"]["point_ids"][0] == "p0"
@@ -0,0 +1,56 @@
+# tests/test_context_packing.py
+from context_packing import PASSAGE_SEPARATOR, pack_context
+from tokens import CHARS_PER_TOKEN
+
+# Distinct words, so a wrongly merged overlap shows up as garbled text.
+DOCUMENT = " ".join(f"w{i}" for i in range(400))
+
+def hit(start: int, end: int, **payload) -> dict:
+    return {"text": DOCUMENT[start:end], "char_start": start, **payload}
+
+def test_overlapping_chunks_merge_into_one_passage_in_document_order():
+    packed = pack_context([hit(250, 550), hit(0, 300)])
+    assert packed.text == DOCUMENT[0:550]
+    assert (packed.chunks_used, packed.passages) == (2, 1)
+    assert packed.tokens < packed.naive_tokens
+    assert packed.tokens_saved == packed.naive_tokens - packed.tokens
+
+def test_contained_chunk_adds_nothing():
+    packed = pack_context([hit(0, 500), hit(100, 200)])
+    assert packed.text == DOCUMENT[0:500]
+    assert packed.passages == 1
+
+def test_touching_chunks_merge_across_trimmed_whitespace():
+    # The splitter drops the space between neighbouring chunks.
+    space = DOCUMENT.index(" ", 100)
+    packed = pack_context([hit(0, space), hit(space + 1, 200)])
+    assert packed.text == DOCUMENT[0:200]
+    assert packed.passages == 1
+
+def test_distant_chunks_stay_separate_and_ordered():
+    packed = pack_context([hit(600, 700), hit(0, 100)])
+    assert packed.text == DOCUMENT[0:100] + PASSAGE_SEPARATOR + DOCUMENT[600:700]
+    assert packed.passages == 2
+
+def test_overlap_with_different_text_is_not_merged():
+    other = {"text": "x" * 100, "char_start": 50}
+    packed = pack_context([hit(0, 100), other])
+    assert packed.passages == 2
+
+def test_chunks_without_position_follow_in_relevance_order():
+    packed = pack_context([{"text": "first"}, hit(0, 50), {"text": "second"}])
+    assert packed.text == PASSAGE_SEPARATOR.join([DOCUMENT[0:50], "first", "second"])
+
+def test_passages_are_labelled_with_section_and_page():
+    packed = pack_context([hit(0, 50, section="183", section_title="Driving at excessive speed", page=12)])
+    assert packed.text == "[Section 183: Driving at excessive speed, page 12]\n" + DOCUMENT[0:50]
+
+def test_budget_skips_chunks_that_do_not_fit():
+    packed = pack_context([hit(0, 80), hit(1000, 1400), hit(2000, 2040)], token_budget=30)
+    assert packed.chunks_used == 2
+    assert packed.text == DOCUMENT[0:80] + PASSAGE_SEPARATOR + DOCUMENT[2000:2040]
+
+def test_best_chunk_is_cut_to_the_budget_rather_than_dropped():
+    packed = pack_context([hit(0, 1000)], token_budget=10)
+    assert packed.chunks_used == 1
+    assert packed.text == DOCUMENT[0:10 * CHARS_PER_TOKEN]
@@ -0,0 +1,60 @@
+# tests/test_embedding_cache.py
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("dotenv")
+
+from embedding_cache import EmbeddingCache, cache_key
+
+MODEL = "test-model"
+DIMENSION = 4
+
+def make_cache(capacity: int = 3) -> EmbeddingCache:
+    return EmbeddingCache(MODEL, backend="torch", max_bytes=capacity * DIMENSION * 4, dtype="float32")
+
+def vector(value: float) -> np.ndarray:
+    return np.full((1, DIMENSION), value, dtype=np.float32)
+
+def test_miss_then_hit(data_root):
+    cache = make_cache()
+    assert cache.get_many(["alpha"]) == [None]
+    cache.put_many(["alpha"], vector(1.0))
+    [found] = cache.get_many(["alpha"])
+    assert np.array_equal(found, vector(1.0)[0])
+    assert (cache.hits, cache.misses) == (1, 1)
+
+def test_whitespace_is_normalized(data_root):
+    cache = make_cache()
+    cache.put_many(["alpha  beta\n"], vector(2.0))
+    assert cache.get_many(["alpha beta"])[0] is not None
+
+def test_least_recently_used_entry_is_evicted(data_root):
+    cache = make_cache(capacity=3)
+    for value, text in enumerate(["a", "b", "c"]):
+        cache.put_many([text], vector(value))
+    cache.get_many(["a"])  # "b" is now the oldest
+    cache.put_many(["d"], vector(9.0))
+    assert cache.evictions == 1
+    hits = cache.get_many(["a", "b", "c", "d"])
+    assert [found is not None for found in hits] == [True, False, True, True]
+    assert np.array_equal(hits[3], vector(9.0)[0])
+
+def test_entries_survive_a_reload(data_root):
+    cache = make_cache()
+    cache.put_many(["alpha", "beta"], np.vstack([vector(1.0), vector(2.0)]))
+    cache.flush()
+    reloaded = make_cache()
+    assert np.array_equal(reloaded.get_many(["beta"])[0], vector(2.0)[0])
+
+def test_key_ending_in_a_nul_byte_survives_a_reload(data_root):
+    text = next(f"text {i}" for i in range(10000) if cache_key(MODEL, f"text {i}", "torch").endswith("00"))
+    cache = make_cache()
+    cache.put_many([text], vector(3.0))
+    cache.flush()
+    assert make_cache().get_many([text])[0] is not None
+
+def test_backends_do_not_share_entries(data_root):
+    assert cache_key(MODEL, "alpha", "torch") != cache_key(MODEL, "alpha", "onnx")
+    make_cache().put_many(["alpha"], vector(1.0))
+    onnx = EmbeddingCache(MODEL, backend="onnx", max_bytes=3 * DIMENSION * 4, dtype="float32")
+    assert onnx.get_many(["alpha"]) == [None]
@@ -0,0 +1,97 @@
+# tests/test_embeddings.py
+import asyncio
+import threading
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from embeddings import MicroBatcher
+
+class RecordingEncoder:
+    """Encodes each text as its length; can hold the worker until released."""
+    def __init__(self):
+        self.batches = []
+        self.release = threading.Event()
+        self.release.set()
+        self.started = threading.Event()
+
+    def __call__(self, texts):
+        self.started.set()
+        self.release.wait(5)
+        self.batches.append(list(texts))
+        return np.array([[float(len(text))] for text in texts], dtype=np.float32)
+
+def test_each_request_gets_its_own_rows():
+    encoder = RecordingEncoder()
+    batcher = MicroBatcher(encoder)
+    assert batcher.submit(["a", "bbb"]).result(5).ravel().tolist() == [1.0, 3.0]
+
+def test_waiting_queries_share_one_batch():
+    encoder = RecordingEncoder()
+    encoder.release.clear()
+    batcher = MicroBatcher(encoder)
+    first = batcher.submit(["warm"])
+    encoder.started.wait(5)
+    # Queued while the worker is busy, so they are merged into one batch.
+    futures = [batcher.submit(["x" * n]) for n in (1, 2, 3)]
+    encoder.release.set()
+    first.result(5)
+    assert [future.result(5).ravel().tolist() for future in futures] == [[1.0], [2.0], [3.0]]
+    assert encoder.batches[1] == ["x", "xx", "xxx"]
+
+def test_queries_go_ahead_of_bulk_requests():
+    encoder = RecordingEncoder()
+    encoder.release.clear()
+    batcher = MicroBatcher(encoder)
+    batcher.submit(["warm"])
+    encoder.started.wait(5)
+    bulk = batcher.submit([f"chunk {i}" for i in range(20)])
+    query = batcher.submit(["query"])
+    encoder.release.set()
+    query.result(5), bulk.result(5)
+    assert encoder.batches[1] == ["query"]
+
+def test_background_requests_wait_for_everything_else():
+    encoder = RecordingEncoder()
+    encoder.release.clear()
+    batcher = MicroBatcher(encoder)
+    batcher.submit(["warm"])
+    encoder.started.wait(5)
+    background = batcher.submit(["question"], background=True)
+    bulk = batcher.submit([f"chunk {i}" for i in range(20)])
+    query = batcher.submit(["query"])
+    encoder.release.set()
+    background.result(5), bulk.result(5), query.result(5)
+    assert encoder.batches[1:] == [["query"], [f"chunk {i}" for i in range(20)], ["question"]]
+
+def test_an_encode_error_reaches_every_waiting_caller():
+    def failing(texts):
+        raise RuntimeError("model unavailable")
+
+    batcher = MicroBatcher(failing)
+    with pytest.raises(RuntimeError, match="model unavailable"):
+        batcher.submit(["a"]).result(5)
+    # The worker survives and keeps serving requests.
+    with pytest.raises(RuntimeError):
+        batcher.submit(["b"]).result(5)
+
+def test_a_cancelled_request_is_dropped_and_the_worker_survives():
+    encoder = RecordingEncoder()
+    encoder.release.clear()
+    batcher = MicroBatcher(encoder)
+
+    async def scenario():
+        busy = batcher.submit(["busy"])
+        encoder.started.wait(5)
+        abandoned = batcher.submit(["abandoned"])
+        waiting = asyncio.wrap_future(abandoned)
+        waiting.cancel()
+        while not abandoned.cancelled():  # the cancel reaches the batcher's future on a later loop turn
+            await asyncio.sleep(0)
+        encoder.release.set()
+        await asyncio.wrap_future(busy)
+        return await asyncio.wait_for(asyncio.wrap_future(batcher.submit(["after"])), 5)
+
+    assert asyncio.run(scenario()).ravel().tolist() == [5.0]
+    assert ["abandoned"] not in encoder.batches
@@ -0,0 +1,116 @@
+# tests/test_ingestion.py
+import hashlib
+
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("langchain.text_splitter")
+pytest.importorskip("fitz")
+pytest.importorskip("dotenv")
+
+import embedding_cache
+import ingestion
+from catalog import DocumentCatalog
+from manifests import DocumentManifest
+from pdf_extraction import PageText
+from vector_store import LocalVectorStore
+
+SOURCE = "course.pdf"
+
+def paragraph(topic: str, words: int = 120) -> str:
+    return " ".join(f"{topic}{i}" for i in range(words)) + ".\n\n"
+
+PAGES = [paragraph("alpha") + paragraph("beta"), paragraph("gamma") + paragraph("delta")]
+
+class FakeEmbeddingService:
+    model_name = "fake-model"
+    backend = "torch"
+    dimension = 8
+
+    def __init__(self):
+        self.encoded = []
+
+    def encode(self, texts):
+        self.encoded.extend(texts)
+        return np.array([np.frombuffer(hashlib.sha256(text.encode()).digest()[:8], dtype=np.uint8)
+                         for text in texts], dtype=np.float32) + 1.0
+
+class FakeStore(LocalVectorStore):
+    def __init__(self, folder):
+        super().__init__("test", folder=folder)
+        self.deleted_sources = []
+
+    def delete_source(self, source):
+        self.deleted_sources.append(source)
+        super().delete_source(source)
+
+@pytest.fixture
+def pipeline(data_root, monkeypatch):
+    """Ingestion wired to an in-process store, a fake model and in-memory 'PDF' pages."""
+    pages = {}
+    service = FakeEmbeddingService()
+    store = FakeStore(str(data_root / "vectors"))
+
+    def iter_pdf_pages(pdf_path, offset_map=None, max_workers=None):
+        for number, text in enumerate(pages[pdf_path], start=1):
+            start = offset_map.add_page(number, text) if offset_map is not None else 0
+            yield PageText(number, start, text)
+
+    monkeypatch.setattr(ingestion, "iter_pdf_pages", iter_pdf_pages)
+    monkeypatch.setattr(ingestion, "get_page_count", lambda pdf_path: len(pages[pdf_path]))
+    monkeypatch.setattr(ingestion, "get_embedding_service", lambda: service)
+    monkeypatch.setattr(ingestion, "get_vector_store", lambda collection_name: store)
+    monkeypatch.setattr(ingestion, "get_catalog", lambda: DocumentCatalog())
+    monkeypatch.setattr(embedding_cache, "_caches", {})
+
+    def ingest(page_texts):
+        pages[SOURCE] = page_texts
+        service.encoded.clear()
+        return ingestion.simple_ingestion(SOURCE, progress=lambda *args: None)
+    return ingest, service, store
+
+def test_first_ingestion_embeds_and_stores_every_chunk(pipeline):
+    ingest, service, store = pipeline
+    result = ingest(PAGES)
+    assert result["embedded"] == result["chunks"] == store.count(SOURCE) > 1
+    assert len(DocumentManifest.load(SOURCE).chunks) == result["chunks"]
+
+def test_unchanged_document_is_not_re_embedded(pipeline):
+    ingest, service, store = pipeline
+    first = ingest(PAGES)
+    again = ingest(PAGES)
+    assert (again["embedded"], again["moved"], again["deleted"]) == (0, 0, 0)
+    assert again["content_hash"] == first["content_hash"]
+    assert service.encoded == []
+
+def test_edit_re_embeds_only_changed_chunks(pipeline):
+    ingest, service, store = pipeline
+    first = ingest(PAGES)
+    edited = ingest([PAGES[0], paragraph("gamma") + paragraph("epsilon")])
+    assert 0 < edited["embedded"] < first["chunks"]
+    assert edited["deleted"] >= 1
+    assert store.count(SOURCE) == edited["chunks"]
+    assert all("epsilon" in text or "gamma" in text for text in service.encoded)
+
+def test_manifest_is_ignored_when_the_store_was_wiped(pipeline):
+    ingest, service, store = pipeline
+    first = ingest(PAGES)
+    # The collection is recreated while tutor_data/manifests survives.
+    super(FakeStore, store).delete_source(SOURCE)
+    again = ingest(PAGES)
+    assert again["embedded"] == first["chunks"]
+    assert store.count(SOURCE) == first["chunks"]
+    assert store.deleted_sources == [SOURCE, SOURCE]
+
+class CountingStore:
+    def __init__(self, stored):
+        self.stored = stored
+
+    def count(self, source):
+        return self.stored
+
+def test_trusted_manifest_requires_matching_count(data_root):
+    assert ingestion._load_trusted_manifest(SOURCE, CountingStore(0)) is None
+    DocumentManifest(SOURCE, {"a": {"hash": "x"}, "b": {"hash": "y"}}).save()
+    assert ingestion._load_trusted_manifest(SOURCE, CountingStore(2)).chunks.keys() == {"a", "b"}
+    assert ingestion._load_trusted_manifest(SOURCE, CountingStore(1)) is None
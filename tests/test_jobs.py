@@ -0,0 +1,73 @@
+# tests/test_jobs.py
+import threading
+
+import pytest
+
+pytest.importorskip("numpy")
+pytest.importorskip("langchain.text_splitter")
+pytest.importorskip("fitz")
+pytest.importorskip("dotenv")
+
+import jobs
+from jobs import JOB_QUEUED, JOB_SUCCEEDED, JobManager
+
+class BlockingIngestion:
+    """Stands in for simple_ingestion; holds each run until released."""
+    def __init__(self):
+        self.release = threading.Event()
+        self.started = threading.Semaphore(0)
+        self.running = 0
+        self.max_running = 0
+        self.runs = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, pdf_path, progress=None):
+        with self._lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        self.started.release()
+        self.release.wait(5)
+        with self._lock:
+            self.running -= 1
+            self.runs += 1
+        return None  # no follow-up starting points
+
+@pytest.fixture
+def ingestion(monkeypatch):
+    fake = BlockingIngestion()
+    monkeypatch.setattr(jobs, "simple_ingestion", fake)
+    return fake
+
+def wait_until_finished(manager, job_ids):
+    for _ in range(500):
+        if all(manager.get(job_id)["finished_at"] for job_id in job_ids):
+            return
+        threading.Event().wait(0.01)
+    raise AssertionError("jobs did not finish")
+
+def test_a_second_upload_joins_the_queued_job(ingestion):
+    manager = JobManager(max_workers=1)
+    running = manager.submit("uploads/a.pdf")
+    assert ingestion.started.acquire(timeout=5)
+    queued = manager.submit("uploads/b.pdf")
+    assert manager.submit("uploads/b.pdf").id == queued.id
+    assert manager.get(queued.id)["status"] == JOB_QUEUED
+    ingestion.release.set()
+    wait_until_finished(manager, [running.id, queued.id])
+    assert ingestion.runs == 2
+    manager.shutdown()
+
+def test_uploads_of_a_running_file_are_ingested_after_it(ingestion):
+    manager = JobManager(max_workers=2)
+    first = manager.submit("uploads/a.pdf")
+    assert ingestion.started.acquire(timeout=5)
+    second = manager.submit("uploads/a.pdf")
+    assert second.id != first.id
+    # The second job waits for the first instead of ingesting alongside it.
+    assert not ingestion.started.acquire(timeout=0.2)
+    assert manager.submit("uploads/a.pdf").id == second.id
+    ingestion.release.set()
+    wait_until_finished(manager, [first.id, second.id])
+    assert ingestion.max_running == 1 and ingestion.runs == 2
+    assert manager.get(second.id)["status"] == JOB_SUCCEEDED
+    manager.shutdown()
@@ -0,0 +1,137 @@
+# tests/test_sessions.py
+import asyncio
+
+import pytest
+
+pytest.importorskip("dotenv")
+
+from sessions import FALLBACK_SUMMARY_CHARS, MIN_RECENT_TURNS, SessionStore, fit_history
+
+LONG = "word " * 100  # ~125 tokens
+
+def fill(store, session, turns: int):
+    for i in range(turns):
+        session.turns.append({"user": f"question {i} {LONG}", "bot": f"answer {i}"})
+        session.turn_count += 1
+
+def test_sessions_are_found_again_and_reset_on_a_new_document():
+    store = SessionStore()
+    session = store.get_or_create(None, "a.pdf")
+    assert store.get_or_create(session.id, "a.pdf") is session
+    fill(store, session, 1)
+    switched = store.get_or_create(session.id, "b.pdf")
+    assert switched.id == session.id and switched.turns == []
+    assert store.get_or_create("unknown", "a.pdf").id != "unknown"
+
+def test_least_recently_used_sessions_are_dropped():
+    store = SessionStore(max_sessions=2)
+    first = store.get_or_create(None, "a.pdf")
+    store.get_or_create(None, "a.pdf")
+    store.get_or_create(None, "a.pdf")
+    assert store.get_or_create(first.id, "a.pdf") is not first
+
+def test_history_from_an_older_client_seeds_a_fresh_session():
+    store = SessionStore()
+    session = store.get_or_create(None, "a.pdf")
+    store.seed_history(session, [{"user": "q1"}, {"bot": "a1"}, {"user": "q2"}, {"bot": "a2"}])
+    assert session.turns == [{"user": "q1", "bot": "a1"}, {"user": "q2", "bot": "a2"}]
+    store.seed_history(session, [{"user": "ignored"}])
+    assert session.turn_count == 2
+
+def test_compaction_folds_the_oldest_turns_into_the_summary():
+    folded = []
+
+    async def summarizer(previous, turns):
+        folded.extend(turns)
+        return "summary of earlier turns"
+
+    store = SessionStore(summarizer=summarizer, token_budget=500)
+    session = store.get_or_create(None, "a.pdf")
+    fill(store, session, 6)
+    asyncio.run(store.compact(session))
+    assert session.summary == "summary of earlier turns"
+    assert len(session.turns) >= MIN_RECENT_TURNS
+    assert folded + session.turns == [{"user": f"question {i} {LONG}", "bot": f"answer {i}"} for i in range(6)]
+    assert session.history_tokens() <= 500
+    assert store.compactions == 1
+
+def test_failed_summarizer_falls_back_to_a_digest():
+    async def summarizer(previous, turns):
+        raise RuntimeError("LLM down")
+
+    store = SessionStore(summarizer=summarizer, token_budget=500)
+    session = store.get_or_create(None, "a.pdf")
+    session.summary = "Earlier summary."
+    fill(store, session, 6)
+    asyncio.run(store.compact(session))
+    assert session.summary.startswith("Earlier summary. Earlier the student asked: question 0")
+    assert len(session.summary) == FALLBACK_SUMMARY_CHARS
+
+def test_prompt_history_keeps_the_latest_turns_within_the_budget():
+    turns = [{"user": f"question {i} {LONG}", "bot": f"answer {i}"} for i in range(6)]
+    assert fit_history(turns, "", token_budget=300) == turns[-2:]
+    assert fit_history(turns, LONG, token_budget=300) == turns[-1:]
+    # The latest turn is always sent.
+    assert fit_history(turns, "", token_budget=10) == turns[-1:]
+    assert fit_history(turns[:2], "", token_budget=1200) == turns[:2]
+
+def test_append_turn_compacts_in_the_background_once_over_budget():
+    calls = []
+
+    async def summarizer(previous, turns):
+        calls.append(len(turns))
+        return "summary"
+
+    async def chat():
+        store = SessionStore(summarizer=summarizer, token_budget=500)
+        session = store.get_or_create(None, "a.pdf")
+        store.append_turn(session, "short question", "short answer")
+        assert not store._background_tasks
+        for i in range(5):
+            store.append_turn(session, f"question {i} {LONG}", "answer")
+        await asyncio.gather(*store._background_tasks)
+        return session
+
+    session = asyncio.run(chat())
+    assert calls and session.summary == "summary"
+    assert session.turn_count == 6
+
+def test_sessions_persist_when_enabled(data_root):
+    store = SessionStore(persist=True)
+    session = store.get_or_create(None, "a.pdf")
+    asyncio.run(_append(store, session))
+    restored = SessionStore(persist=True).get_or_create(session.id, "a.pdf")
+    assert restored.turns == [{"user": "q", "bot": "a"}]
+
+async def _append(store, session):
+    store.append_turn(session, "q", "a")
+
+def test_turns_appended_before_compaction_starts_schedule_it_once():
+    calls = []
+
+    async def summarizer(previous, turns):
+        calls.append(len(turns))
+        await asyncio.sleep(0)  # an LLM call: other tasks run meanwhile
+        return "summary"
+
+    async def chat():
+        store = SessionStore(summarizer=summarizer, token_budget=300)
+        session = store.get_or_create(None, "a.pdf")
+        # No await between the turns, so no compaction task has started yet.
+        for i in range(6):
+            store.append_turn(session, f"question {i} {LONG}", "answer")
+        await asyncio.gather(*store._background_tasks)
+        return store, session
+
+    store, session = asyncio.run(chat())
+    assert store.compactions == 1
+    # Every turn is either in the summary or still in the history.
+    assert calls[0] + len(session.turns) == 6
+
+def test_end_forgets_the_conversation(data_root):
+    store = SessionStore(persist=True)
+    session = store.get_or_create(None, "a.pdf")
+    asyncio.run(_append(store, session))
+    store.end(session.id)
+    assert store.get_or_create(session.id, "a.pdf").turns == []
+    assert SessionStore(persist=True).get_or_create(session.id, "a.pdf").turns == []
@@ -0,0 +1,61 @@
+# tests/test_sparse_index.py
+import os
+
+import pytest
+
+pytest.importorskip("numpy")
+
+from sparse_index import SparseIndexBuilder, _index_path, load_sparse_index, tokenize
+
+CHUNKS = {
+    "p1": "Section 183 sets the fine for speeding on public roads.",
+    "p2": "A learner must hold a valid driving licence issued by the licensing authority.",
+    "p3": "Speeds above the limit are measured by radar; the speeding driver is stopped.",
+    "p4": "Section 3 requires a licence before driving any motor vehicle.",
+}
+
+@pytest.fixture
+def index(data_root):
+    builder = SparseIndexBuilder()
+    for point_id, text in CHUNKS.items():
+        builder.add(point_id, text)
+    builder.save("act.pdf")
+    return load_sparse_index("act.pdf")
+
+def test_tokenize_drops_stopwords_and_stems():
+    assert tokenize("What is the fine for Speeding?") == tokenize("fine speed")
+    assert len(set(tokenize("speeds speed speeding"))) == 1
+    assert tokenize("penalties under section 183") == ["penalty", "under", "section", "183"]
+
+def test_exact_terms_rank_first(index):
+    assert [point_id for point_id, _ in index.search("section 183", limit=4)][0] == "p1"
+    assert [point_id for point_id, _ in index.search("licence", limit=4)] in (["p2", "p4"], ["p4", "p2"])
+
+def test_scores_are_best_first_and_limited(index):
+    hits = index.search("speeding driving licence", limit=2)
+    assert len(hits) == 2
+    assert hits[0][1] >= hits[1][1] > 0
+
+def test_no_match_returns_nothing(index):
+    assert index.search("helicopter", limit=4) == []
+    assert index.search("speeding", limit=0) == []
+
+def test_missing_index_is_none(data_root):
+    assert load_sparse_index("never-ingested.pdf") is None
+
+def test_a_rebuilt_index_replaces_the_loaded_one(index, data_root):
+    builder = SparseIndexBuilder()
+    builder.add("q1", "helicopter landing pads")
+    builder.save("act.pdf")
+    # The cache is keyed by modification time; make sure the new file has a new one.
+    path = _index_path("act.pdf")
+    os.utime(path, (os.path.getmtime(path) + 5,) * 2)
+    assert load_sparse_index("act.pdf").search("helicopter", limit=4)[0][0] == "q1"
+
+def test_reciprocal_rank_fusion_rewards_agreement():
+    bot_logic = pytest.importorskip("bot_logic")
+    fused = bot_logic.reciprocal_rank_fusion([["a", "b", "c"], ["c", "a", "d"]], k=60)
+    ids = [point_id for point_id, _ in fused]
+    assert ids[:2] == ["a", "c"]
+    assert set(ids) == {"a", "b", "c", "d"}
+    assert fused[0][1] == pytest.approx(1 / 61 + 1 / 62)
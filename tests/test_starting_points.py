@@ -0,0 +1,68 @@
+# tests/test_starting_points.py
+import asyncio
+import functools
+import types
+
+import pytest
+
+pytest.importorskip("dotenv")
+
+import starting_points
+
+GROUPS = [("g1", "first section"), ("g2", "second section"), ("g3", "third section")]
+
+class FakeModel:
+    """Answers every prompt except those mentioning a section listed in `failing`."""
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.prompts = []
+
+    async def generate_content_async(self, prompt, request_options=None):
+        self.prompts.append(prompt)
+        if any(section in prompt for section in self.failing):
+            raise RuntimeError("quota exceeded")
+        if "SECTION SUMMARIES" in prompt:
+            return types.SimpleNamespace(text="TOPICS: Alpha, Beta\nQUESTIONS:\n1. Why?\n2. How?")
+        return types.SimpleNamespace(text="- a topic")
+
+@pytest.fixture
+def use_model(data_root, monkeypatch):
+    monkeypatch.setattr(starting_points, "_collect_groups", lambda pdf_path: list(GROUPS))
+    monkeypatch.setattr(starting_points, "SUMMARY_REQUESTS_PER_MINUTE", 0)
+
+    def use(model):
+        resources = types.SimpleNamespace(gemini_model=lambda: model)
+        monkeypatch.setattr(starting_points, "get_resources", lambda: resources)
+        return model
+    return use
+
+def test_topics_and_questions_are_parsed(use_model):
+    use_model(FakeModel())
+    result = asyncio.run(starting_points.agenerate_starting_points("docs/act.pdf", max_retries=1))
+    assert result == {"topics": "Alpha, Beta", "questions": ["Why?", "How?"]}
+
+def test_a_failed_section_fails_the_whole_generation(use_model):
+    model = use_model(FakeModel(failing={"second section"}))
+    assert asyncio.run(starting_points.agenerate_starting_points("docs/act.pdf", max_retries=1)) is None
+    assert not any("SECTION SUMMARIES" in prompt for prompt in model.prompts)
+
+def test_the_retry_only_summarizes_the_missing_section(use_model):
+    use_model(FakeModel(failing={"second section"}))
+    asyncio.run(starting_points.agenerate_starting_points("docs/act.pdf", max_retries=1))
+    model = use_model(FakeModel())
+    assert asyncio.run(starting_points.agenerate_starting_points("docs/act.pdf", max_retries=1)) is not None
+    map_prompts = [prompt for prompt in model.prompts if "SECTION TEXT" in prompt]
+    assert len(map_prompts) == 1 and "second section" in map_prompts[0]
+
+def test_fallback_is_served_but_not_stored(use_model, monkeypatch):
+    # One attempt per request, so the test does not sit through retry delays.
+    monkeypatch.setattr(starting_points, "agenerate_starting_points",
+                        functools.partial(starting_points.agenerate_starting_points, max_retries=1))
+    use_model(FakeModel(failing={"second section"}))
+    result = asyncio.run(starting_points.aensure_starting_points("docs/act.pdf", "hash-1"))
+    assert result == starting_points.FALLBACK_STARTING_POINTS
+    assert starting_points.load_starting_points("act.pdf", "hash-1") is None
+    use_model(FakeModel())
+    result = asyncio.run(starting_points.aensure_starting_points("docs/act.pdf", "hash-1"))
+    assert result["topics"] == "Alpha, Beta"
+    assert starting_points.load_starting_points("act.pdf", "hash-1") == result
@@ -0,0 +1,62 @@
+# tests/test_vector_store.py
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("dotenv")
+
+from vector_store import LocalVectorStore
+
+SOURCE = "Motor Vehicles Act.pdf"  # spaces are quoted in the partition folder name
+
+def vectors(*rows):
+    return np.array(rows, dtype=np.float32)
+
+@pytest.fixture
+def store(tmp_path):
+    store = LocalVectorStore("test", folder=str(tmp_path))
+    store.ensure_collection(3)
+    store.upsert(SOURCE, ["a", "b", "c"], vectors([1, 0, 0], [0, 1, 0], [0, 0, 1]),
+                 [{"text": "A"}, {"text": "B"}, {"text": "C"}])
+    return store
+
+def test_search_ranks_by_cosine_similarity(store):
+    hits = store.search(SOURCE, [0.1, 0.9, 0.3], limit=2)
+    assert [hit.id for hit in hits] == ["b", "c"]
+    assert hits[0].payload == {"text": "B"}
+    assert hits[0].score > hits[1].score
+
+def test_search_is_scoped_to_the_source(store):
+    assert store.search("other.pdf", [1, 0, 0], limit=5) == []
+
+def test_upsert_replaces_an_existing_point(store):
+    store.upsert(SOURCE, ["a"], vectors([0, 5, 0]), [{"text": "A2"}])
+    assert store.count(SOURCE) == 3
+    best = store.search(SOURCE, [0, 1, 0], limit=3)
+    assert {hit.id for hit in best[:2]} == {"a", "b"}
+    assert best[0].score == pytest.approx(1.0)
+    assert store.get(SOURCE, ["a"])[0].payload == {"text": "A2"}
+
+def test_delete_keeps_rows_and_payloads_aligned(store):
+    store.upsert(SOURCE, ["d"], vectors([1, 1, 0]), [{"text": "D"}])
+    store.delete(SOURCE, ["a", "c"])
+    assert store.count(SOURCE) == 2
+    assert {hit.id: hit.payload["text"] for hit in store.get(SOURCE, ["a", "b", "c", "d"])} == {"b": "B", "d": "D"}
+    assert store.search(SOURCE, [1, 0, 0], limit=1)[0].id == "d"
+
+def test_set_payloads_merges_fields(store):
+    store.set_payloads(SOURCE, {"a": {"page": 4}, "missing": {"page": 1}})
+    assert store.get(SOURCE, ["a"])[0].payload == {"text": "A", "page": 4}
+
+def test_flush_persists_for_a_new_store(store, tmp_path):
+    store.flush()
+    reopened = LocalVectorStore("test", folder=str(tmp_path))
+    assert reopened.count(SOURCE) == 3
+    assert reopened.search(SOURCE, [0, 0, 1], limit=1)[0].id == "c"
+    assert reopened.source_counts() == {SOURCE: 3}
+
+def test_delete_source_empties_the_partition(store, tmp_path):
+    store.flush()
+    store.delete_source(SOURCE)
+    assert store.count(SOURCE) == 0
+    assert store.search(SOURCE, [1, 0, 0], limit=3) == []
+    assert LocalVectorStore("test", folder=str(tmp_path)).source_counts() == {}
@@ -0,0 +1,9 @@
+# tokens.py
+# Cheap token estimates for prompt budgeting. Gemini does not expose a local
+# tokenizer, and a round trip to count_tokens would cost more than it saves,
+# so we use the usual ~4 characters per token rule of thumb for English.
+
+CHARS_PER_TOKEN = 4
+
+def estimate_tokens(text: str) -> int:
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
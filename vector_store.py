@@ -0,0 +1,475 @@
+# vector_store.py
+# One interface for storing and searching chunk vectors, with two backends:
+#   - "qdrant": the Qdrant server (default)
+#   - "local":  in-process, one memory-mapped partition per document; needs
+#               no external service and searches a document in well under a
+#               millisecond for typical course material.
+# Select with VECTOR_STORE=qdrant|local. Every operation is scoped to one
+# document (source), because that is how the tutor retrieves.
+
+# --- 1. Imports ---
+import os
+import json
+import threading
+import urllib.parse
+from typing import Dict, List, NamedTuple, Optional, Sequence
+
+import numpy as np
+
+from config import data_dir
+
+VECTOR_STORE_BACKEND = os.getenv("VECTOR_STORE", "qdrant").lower()
+QDRANT_HOST = os.getenv("QDRANT_HOST", "localhost")
+QDRANT_PORT = int(os.getenv("QDRANT_PORT", "6333"))
+# gRPC is cheaper per call than REST for the small searches of a chat turn.
+QDRANT_PREFER_GRPC = os.getenv("QDRANT_PREFER_GRPC", "0") == "1"
+QDRANT_GRPC_PORT = int(os.getenv("QDRANT_GRPC_PORT", "6334"))
+# Seconds before a Qdrant call gives up, so a down server cannot hang workers.
+QDRANT_TIMEOUT = int(os.getenv("QDRANT_TIMEOUT", "5"))
+# Storage type of local partitions; float16 halves memory and disk.
+LOCAL_VECTOR_DTYPE = os.getenv("LOCAL_VECTOR_DTYPE", "float32")
+DELETE_BATCH_SIZE = 1000
+
+class SearchHit(NamedTuple):
+    id: str
+    score: Optional[float]  # cosine similarity; None for get()
+    payload: dict
+
+# --- 2. The VectorStore Interface ---
+class VectorStore:
+    """Base class; backends implement every method except asearch, which defaults to search."""
+    backend = "base"
+
+    def ensure_collection(self, vector_size: int):
+        raise NotImplementedError
+
+    def upsert(self, source: str, ids: Sequence[str], vectors: np.ndarray, payloads: Sequence[dict]):
+        raise NotImplementedError
+
+    def set_payloads(self, source: str, payloads: Dict[str, dict]):
+        """Merges fields into the payloads of existing points."""
+        raise NotImplementedError
+
+    def delete(self, source: str, ids: Sequence[str]):
+        raise NotImplementedError
+
+    def delete_source(self, source: str):
+        raise NotImplementedError
+
+    def search(self, source: str, vector: Sequence[float], limit: int) -> List[SearchHit]:
+        raise NotImplementedError
+
+    async def asearch(self, source: str, vector: Sequence[float], limit: int) -> List[SearchHit]:
+        return self.search(source, vector, limit)
+
+    def get(self, source: str, ids: Sequence[str]) -> List[SearchHit]:
+        """Fetches points by ID (in the given order, skipping unknown IDs)."""
+        raise NotImplementedError
+
+    def count(self, source: str) -> int:
+        """Number of points stored for a document."""
+        raise NotImplementedError
+
+    def source_counts(self) -> Dict[str, int]:
+        """Every document in the collection with its point count (a full scan; for seeding)."""
+        raise NotImplementedError
+
+    def flush(self, source: Optional[str] = None):
+        """Makes writes durable; called at the end of an ingestion."""
+
+    def ping(self):
+        """Raises if the backend cannot be reached; used by readiness probes."""
+
+    def close(self):
+        pass
+
+    async def aclose(self):
+        self.close()
+
+# --- 3. Qdrant Backend ---
+class QdrantVectorStore(VectorStore):
+    backend = "qdrant"
+
+    def __init__(self, collection_name: str, host: str = QDRANT_HOST, port: int = QDRANT_PORT,
+                 prefer_grpc: bool = QDRANT_PREFER_GRPC, timeout: int = QDRANT_TIMEOUT):
+        self.collection_name = collection_name
+        self._options = {"host": host, "port": port, "grpc_port": QDRANT_GRPC_PORT,
+                         "prefer_grpc": prefer_grpc, "timeout": timeout}
+        self._clients = None
+        self._clients_lock = threading.Lock()
+
+    def _connect(self) -> tuple:
+        # qdrant_client (and its gRPC stack) is imported on first use, which
+        # keeps app startup fast. One client of each kind per process; both
+        # keep their connections open.
+        with self._clients_lock:
+            if self._clients is None:
+                from qdrant_client import AsyncQdrantClient, QdrantClient, models
+                self._clients = (QdrantClient(**self._options), AsyncQdrantClient(**self._options), models)
+            return self._clients
+
+    @property
+    def client(self):
+        return self._connect()[0]
+
+    @property
+    def async_client(self):
+        return self._connect()[1]
+
+    @property
+    def models(self):
+        return self._connect()[2]
+
+    def _source_filter(self, source: str):
+        models = self.models
+        return models.Filter(must=[models.FieldCondition(key="source", match=models.MatchValue(value=source))])
+
+    def ensure_collection(self, vector_size: int):
+        models = self.models
+        try:
+            # Check if collection exists. If not, create it.
+            collection_info = self.client.get_collection(collection_name=self.collection_name)
+        except Exception:
+            print(f"  - Collection '{self.collection_name}' not found. Creating it...")
+            self.client.create_collection(
+                collection_name=self.collection_name,
+                vectors_config=models.VectorParams(size=vector_size, distance=models.Distance.COSINE),
+            )
+            collection_info = None
+        # Every search is filtered by source, so index it (also for older collections).
+        if collection_info is None or "source" not in (collection_info.payload_schema or {}):
+            self.client.create_payload_index(
+                collection_name=self.collection_name, field_name="source",
+                field_schema=models.PayloadSchemaType.KEYWORD, wait=True
+            )
+
+    def upsert(self, source: str, ids: Sequence[str], vectors: np.ndarray, payloads: Sequence[dict]):
+        points = [
+            self.models.PointStruct(id=point_id, vector=np.asarray(vector).tolist(), payload=payload)
+            for point_id, vector, payload in zip(ids, vectors, payloads)
+        ]
+        self.client.upsert(collection_name=self.collection_name, points=points, wait=True)
+
+    def set_payloads(self, source: str, payloads: Dict[str, dict]):
+        models = self.models
+        self.client.batch_update_points(
+            collection_name=self.collection_name,
+            update_operations=[
+                models.SetPayloadOperation(set_payload=models.SetPayload(payload=payload, points=[point_id]))
+                for point_id, payload in payloads.items()
+            ],
+            wait=True
+        )
+
+    def delete(self, source: str, ids: Sequence[str]):
+        ids = list(ids)
+        for start in range(0, len(ids), DELETE_BATCH_SIZE):
+            self.client.delete(
+                collection_name=self.collection_name,
+                points_selector=self.models.PointIdsList(points=ids[start:start + DELETE_BATCH_SIZE]),
+                wait=True
+            )
+
+    def delete_source(self, source: str):
+        self.client.delete(
+            collection_name=self.collection_name,
+            points_selector=self.models.FilterSelector(filter=self._source_filter(source)),
+            wait=True
+        )
+
+    @staticmethod
+    def _to_hits(points) -> List[SearchHit]:
+        return [SearchHit(str(point.id), getattr(point, "score", None), point.payload or {}) for point in points]
+
+    def search(self, source: str, vector: Sequence[float], limit: int) -> List[SearchHit]:
+        return self._to_hits(self.client.search(
+            collection_name=self.collection_name, query_vector=list(vector),
+            query_filter=self._source_filter(source), limit=limit
+        ))
+
+    async def asearch(self, source: str, vector: Sequence[float], limit: int) -> List[SearchHit]:
+        return self._to_hits(await self.async_client.search(
+            collection_name=self.collection_name, query_vector=list(vector),
+            query_filter=self._source_filter(source), limit=limit
+        ))
+
+    def get(self, source: str, ids: Sequence[str]) -> List[SearchHit]:
+        points = {str(point.id): point for point in self.client.retrieve(
+            collection_name=self.collection_name, ids=list(ids), with_payload=True, with_vectors=False)}
+        return [SearchHit(point_id, None, points[point_id].payload or {}) for point_id in ids if point_id in points]
+
+    def count(self, source: str) -> int:
+        if not self.client.collection_exists(self.collection_name):
+            return 0
+        return self.client.count(collection_name=self.collection_name,
+                                 count_filter=self._source_filter(source), exact=True).count
+
+    def source_counts(self) -> Dict[str, int]:
+        counts: Dict[str, int] = {}
+        if not self.client.collection_exists(self.collection_name):
+            return counts
+        offset = None
+        while True:
+            points, offset = self.client.scroll(collection_name=self.collection_name, limit=1000, offset=offset,
+                                                with_payload=["source"], with_vectors=False)
+            for point in points:
+                source = (point.payload or {}).get("source")
+                if source:
+                    counts[source] = counts.get(source, 0) + 1
+            if offset is None:
+                return counts
+
+    def ping(self):
+        self.client.get_collections()
+
+    def close(self):
+        if self._clients is not None:
+            self._clients[0].close()
+
+    async def aclose(self):
+        if self._clients is not None:
+            await self._clients[1].close()
+            self._clients[0].close()
+
+# --- 4. Local (in-process) Backend ---
+class _Partition:
+    """
+    The vectors of one document: unit-normalized rows (so a dot product is
+    the cosine similarity) in a growable array, plus IDs and payloads.
+    On disk: vectors.npy (memory-mapped when loaded) and rows.json.
+    """
+    def __init__(self, folder: str, dtype: str):
+        self.folder = folder
+        self.dtype = np.dtype(dtype)
+        self.lock = threading.Lock()
+        self.ids: List[str] = []
+        self.payloads: List[dict] = []
+        self.index: Dict[str, int] = {}
+        self.matrix: Optional[np.ndarray] = None  # capacity x dim; rows [0, size) are live
+        self.dirty = False
+        self.loaded_mtime = None
+        self._load()
+
+    @property
+    def size(self) -> int:
+        return len(self.ids)
+
+    def _rows_path(self) -> str:
+        return os.path.join(self.folder, "rows.json")
+
+    def _vectors_path(self) -> str:
+        return os.path.join(self.folder, "vectors.npy")
+
+    def _disk_mtime(self):
+        path = self._rows_path()
+        return os.path.getmtime(path) if os.path.exists(path) else None
+
+    def _load(self):
+        mtime = self._disk_mtime()
+        if mtime is None:
+            return
+        with open(self._rows_path(), "r", encoding="utf-8") as f:
+            rows = json.load(f)
+        # Read-only map; copied into memory on the first write.
+        matrix = np.load(self._vectors_path(), mmap_mode="r") if rows["ids"] else None
+        if matrix is not None and matrix.shape[0] < len(rows["ids"]):
+            return  # caught between the two writes of a save; retried on the next search
+        self.ids, self.payloads, self.matrix = rows["ids"], rows["payloads"], matrix
+        self.index = {point_id: row for row, point_id in enumerate(self.ids)}
+        self.loaded_mtime = mtime
+
+    def refresh(self):
+        """Picks up a partition written by another process (e.g. a CLI ingestion)."""
+        if not self.dirty and self._disk_mtime() != self.loaded_mtime:
+            self._load()
+
+    def _writable(self, needed_rows: int, dim: int):
+        if self.matrix is None:
+            self.matrix = np.zeros((max(needed_rows, 64), dim), dtype=self.dtype)
+        elif not self.matrix.flags.writeable or needed_rows > self.matrix.shape[0]:
+            capacity = self.matrix.shape[0]
+            while capacity < needed_rows:
+                capacity *= 2
+            grown = np.zeros((capacity, self.matrix.shape[1]), dtype=self.dtype)
+            grown[:self.size] = self.matrix[:self.size]
+            self.matrix = grown
+
+    def upsert(self, ids: Sequence[str], vectors: np.ndarray, payloads: Sequence[dict]):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        new_count = sum(1 for point_id in ids if point_id not in self.index)
+        self._writable(self.size + new_count, vectors.shape[1])
+        for point_id, vector, payload in zip(ids, vectors, payloads):
+            row = self.index.get(point_id)
+            if row is None:
+                row = self.index[point_id] = self.size
+                self.ids.append(point_id)
+                self.payloads.append(payload)
+            else:
+                self.payloads[row] = payload
+            self.matrix[row] = vector
+        self.dirty = True
+
+    def delete(self, ids: Sequence[str]):
+        rows = [self.index[point_id] for point_id in ids if point_id in self.index]
+        if not rows:
+            return
+        self._writable(self.size, self.matrix.shape[1])
+        # Swap each deleted row with the last live row; going from the highest
+        # row down, the last row is never one that is still to be deleted.
+        for row in sorted(rows, reverse=True):
+            last = self.size - 1
+            if row != last:
+                self.matrix[row] = self.matrix[last]
+                self.ids[row], self.payloads[row] = self.ids[last], self.payloads[last]
+            self.ids.pop()
+            self.payloads.pop()
+        self.index = {point_id: row for row, point_id in enumerate(self.ids)}
+        self.dirty = True
+
+    def search(self, vector: Sequence[float], limit: int) -> List[SearchHit]:
+        if not self.size or limit <= 0:
+            return []
+        query = np.asarray(vector, dtype=np.float32)
+        query = query / max(float(np.linalg.norm(query)), 1e-12)
+        # float16 partitions are widened per search; numpy has no fast float16 matmul.
+        scores = self.matrix[:self.size].astype(np.float32, copy=False) @ query
+        if limit < self.size:
+            top = np.argpartition(-scores, limit - 1)[:limit]
+            top = top[np.argsort(-scores[top])]
+        else:
+            top = np.argsort(-scores)
+        return [SearchHit(self.ids[row], float(scores[row]), self.payloads[row]) for row in top]
+
+    def save(self):
+        if not self.dirty:
+            return
+        os.makedirs(self.folder, exist_ok=True)
+        if self.size:
+            tmp_path = self._vectors_path() + ".tmp.npy"
+            np.save(tmp_path, np.ascontiguousarray(self.matrix[:self.size]))
+            os.replace(tmp_path, self._vectors_path())
+        tmp_path = self._rows_path() + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"ids": self.ids, "payloads": self.payloads}, f)
+        os.replace(tmp_path, self._rows_path())
+        self.dirty = False
+        self.loaded_mtime = self._disk_mtime()
+
+class LocalVectorStore(VectorStore):
+    backend = "local"
+
+    def __init__(self, collection_name: str, folder: Optional[str] = None, dtype: str = LOCAL_VECTOR_DTYPE):
+        self.collection_name = collection_name
+        self.folder = folder or data_dir("vectors", collection_name)
+        self.dtype = dtype
+        self._partitions: Dict[str, _Partition] = {}
+        self._lock = threading.Lock()
+
+    def _partition(self, source: str) -> _Partition:
+        with self._lock:
+            partition = self._partitions.get(source)
+            if partition is None:
+                partition = self._partitions[source] = _Partition(
+                    os.path.join(self.folder, urllib.parse.quote(source, safe="")), self.dtype)
+            return partition
+
+    def ensure_collection(self, vector_size: int):
+        os.makedirs(self.folder, exist_ok=True)
+
+    def ping(self):
+        os.makedirs(self.folder, exist_ok=True)
+        if not os.access(self.folder, os.W_OK):
+            raise OSError(f"{self.folder} is not writable")
+
+    def upsert(self, source: str, ids: Sequence[str], vectors: np.ndarray, payloads: Sequence[dict]):
+        partition = self._partition(source)
+        with partition.lock:
+            partition.upsert(ids, vectors, payloads)
+
+    def set_payloads(self, source: str, payloads: Dict[str, dict]):
+        partition = self._partition(source)
+        with partition.lock:
+            for point_id, fields in payloads.items():
+                row = partition.index.get(point_id)
+                if row is not None:
+                    partition.payloads[row] = {**partition.payloads[row], **fields}
+            partition.dirty = True
+
+    def delete(self, source: str, ids: Sequence[str]):
+        partition = self._partition(source)
+        with partition.lock:
+            partition.delete(ids)
+
+    def delete_source(self, source: str):
+        partition = self._partition(source)
+        with partition.lock:
+            partition.delete(list(partition.ids))
+            partition.save()
+
+    def search(self, source: str, vector: Sequence[float], limit: int) -> List[SearchHit]:
+        partition = self._partition(source)
+        with partition.lock:
+            partition.refresh()
+            return partition.search(vector, limit)
+
+    def get(self, source: str, ids: Sequence[str]) -> List[SearchHit]:
+        partition = self._partition(source)
+        with partition.lock:
+            partition.refresh()
+            return [SearchHit(point_id, None, partition.payloads[partition.index[point_id]])
+                    for point_id in ids if point_id in partition.index]
+
+    def count(self, source: str) -> int:
+        partition = self._partition(source)
+        with partition.lock:
+            partition.refresh()
+            return partition.size
+
+    def source_counts(self) -> Dict[str, int]:
+        if not os.path.isdir(self.folder):
+            return {}
+        sources = [urllib.parse.unquote(name) for name in os.listdir(self.folder)
+                   if os.path.exists(os.path.join(self.folder, name, "rows.json"))]
+        counts = {source: self.count(source) for source in sources}
+        return {source: count for source, count in counts.items() if count}
+
+    def flush(self, source: Optional[str] = None):
+        with self._lock:
+            partitions = [self._partitions[source]] if source in self._partitions else (
+                [] if source else list(self._partitions.values()))
+        for partition in partitions:
+            with partition.lock:
+                partition.save()
+
+    def close(self):
+        self.flush()
+
+# --- 5. Shared Instances ---
+_stores: Dict[tuple, VectorStore] = {}
+_stores_lock = threading.Lock()
+
+def get_vector_store(collection_name: str = "socratic_collection", backend: str = VECTOR_STORE_BACKEND) -> VectorStore:
+    """Returns the process-wide store for a collection, so ingestion and chat share partitions."""
+    with _stores_lock:
+        store = _stores.get((backend, collection_name))
+        if store is None:
+            if backend == "local":
+                store = LocalVectorStore(collection_name)
+            elif backend == "qdrant":
+                store = QdrantVectorStore(collection_name)
+            else:
+                raise ValueError(f"Unknown VECTOR_STORE backend: {backend!r} (expected 'qdrant' or 'local')")
+            _stores[(backend, collection_name)] = store
+        return store
+
+async def aclose_vector_stores():
+    """Closes every shared store (flushing local partitions); called on shutdown."""
+    with _stores_lock:
+        stores = list(_stores.values())
+        _stores.clear()
+    for store in stores:
+        try:
+            await store.aclose()
+        except Exception as e:
+            print(f"!!! Could not close the {store.backend} vector store: {e}")